@@ -3,7 +3,11 @@ Smart Attendance System - Flask Backend
 Main application server
 """
 
-from flask import Flask, request, jsonify
+# Startup is timed from here (see startup.py)
+import time
+_started = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
 import json
@@ -11,16 +15,24 @@ from datetime import datetime
 from pathlib import Path
 
 # Import custom modules
+import config
+import metrics
 from face_recognition_handler import FaceRecognitionHandler
 from dataset_downloader import DatasetDownloader
 from attendance_logger import AttendanceLogger
+from event_stream import format_sse
+from camera_sessions import SessionManager
+from encoding_pool import PoolBusy
+from face_quality import FaceRejected
+from bulk_enroll import enroll_dataset, import_archive
+from startup import Startup
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
 
 # Configuration
-BASE_DIR = Path(__file__).parent.parent
+BASE_DIR = config.DATA_DIR
 DATASETS_DIR = BASE_DIR / "datasets"
 MODELS_DIR = BASE_DIR / "models"
 LOGS_DIR = BASE_DIR / "attendance_logs"
@@ -29,10 +41,17 @@ LOGS_DIR = BASE_DIR / "attendance_logs"
 for directory in [DATASETS_DIR, MODELS_DIR, LOGS_DIR]:
     directory.mkdir(exist_ok=True)
 
-# Initialize handlers
-face_handler = FaceRecognitionHandler(str(MODELS_DIR))
-dataset_downloader = DatasetDownloader(str(DATASETS_DIR))
-attendance_logger = AttendanceLogger(str(LOGS_DIR))
+# Initialize handlers (encoding worker processes re-import this module as
+# __mp_main__; they only need face_encoder, not the server's state)
+if __name__ != '__mp_main__':
+    startup = Startup(_started)
+    startup.record('imports', _started)
+    _handlers_start = time.perf_counter()
+    face_handler = FaceRecognitionHandler(str(MODELS_DIR))
+    dataset_downloader = DatasetDownloader(str(DATASETS_DIR))
+    attendance_logger = AttendanceLogger(str(LOGS_DIR))
+    camera_sessions = SessionManager(face_handler)
+    startup.record('handlers', _handlers_start)
 
 # ==================== API ROUTES ====================
 
@@ -93,6 +112,8 @@ def upload_image():
         
         result = face_handler.add_image_to_person(person_id, file)
         return jsonify({"status": "success", "message": "Image uploaded", "image_id": result})
+    except FaceRejected as e:
+        return rejected_response(e)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -123,6 +144,23 @@ def model_status():
 
 # ==================== ATTENDANCE MARKING ====================
 
+def busy_response(error):
+    """429 for requests refused because every encoding worker is busy"""
+    response = jsonify({"status": "error", "message": str(error)})
+    response.status_code = 429
+    response.headers['Retry-After'] = '1'
+    return response
+
+def rejected_response(error):
+    """422 for a face too poor to encode, with the reason for the client"""
+    return jsonify({"status": "warning", "message": str(error), "reason": error.reason}), 422
+
+def all_rejected(faces):
+    """The first face when every detected face was too poor to encode, else None"""
+    if faces and all(face.get("reason") for face in faces):
+        return faces[0]
+    return None
+
 @app.route('/api/mark-attendance', methods=['POST'])
 def mark_attendance():
     """Mark attendance from image or frame"""
@@ -133,6 +171,9 @@ def mark_attendance():
         if not image_base64:
             return jsonify({"status": "error", "message": "Image required"}), 400
         
+        if data.get('multi'):
+            return mark_attendance_multi(image_base64)
+        
         # Recognize face
         recognized_person = face_handler.recognize_face(image_base64)
         
@@ -149,6 +190,197 @@ def mark_attendance():
                 "status": "warning",
                 "message": "Face not recognized"
             }), 404
+    except PoolBusy as e:
+        return busy_response(e)
+    except FaceRejected as e:
+        return rejected_response(e)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+def mark_attendance_multi(image_base64):
+    """Recognize every face in one frame and log all of them in one write"""
+    timings = {}
+    faces = face_handler.recognize_faces(image_base64, timings)
+    return log_faces(faces, timings)
+
+def log_faces(faces, timings):
+    """Log every recognized face of a frame in one write"""
+    persons = list(dict.fromkeys(f["name"] for f in faces if f["name"]))
+    
+    if not persons:
+        rejected = all_rejected(faces)
+        if rejected is not None:
+            return jsonify({
+                "status": "warning",
+                "message": rejected["message"],
+                "reason": rejected["reason"],
+                "faces": faces,
+                "timings": timings
+            }), 422
+        return jsonify({
+            "status": "warning",
+            "message": "Face not recognized",
+            "faces": faces,
+            "timings": timings
+        }), 404
+    
+    log_entry = attendance_logger.log_attendance_many(persons)
+    return jsonify({
+        "status": "success",
+        "persons": persons,
+        "faces": faces,
+        "timestamp": log_entry,
+        "timings": timings
+    })
+
+@app.route('/api/mark-attendance/frame', methods=['POST'])
+def mark_attendance_frame():
+    """
+    Mark attendance from one binary frame sent as the raw request body:
+    encoded image bytes (e.g. Content-Type: image/jpeg), or packed 8-bit RGB
+    pixels with X-Frame-Width and X-Frame-Height headers
+    """
+    try:
+        image_data = request.get_data(cache=False)
+        
+        if not image_data:
+            return jsonify({"status": "error", "message": "Frame required"}), 400
+        
+        width = request.headers.get('X-Frame-Width', type=int)
+        height = request.headers.get('X-Frame-Height', type=int)
+        if (width is None) != (height is None):
+            return jsonify({"status": "error", "message": "X-Frame-Width and X-Frame-Height go together"}), 400
+        
+        faces, timings = face_handler.recognize_frame(image_data, width, height)
+        return log_faces(faces, timings)
+    except PoolBusy as e:
+        return busy_response(e)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/mark-attendance/batch', methods=['POST'])
+def mark_attendance_batch():
+    """Mark attendance from many frames (multipart field 'frames') in one request"""
+    try:
+        frames = [f.read() for f in request.files.getlist('frames')]
+        
+        if not frames:
+            return jsonify({"status": "error", "message": "No frames provided"}), 400
+        
+        results = face_handler.recognize_batch(frames)
+        persons = list(dict.fromkeys(
+            face["name"]
+            for frame in results
+            for face in frame.get("faces", [])
+            if face["name"]
+        ))
+        
+        if not persons:
+            rejected = all_rejected([face for frame in results for face in frame.get("faces", [])])
+            if rejected is not None:
+                return jsonify({
+                    "status": "warning",
+                    "message": rejected["message"],
+                    "reason": rejected["reason"],
+                    "frames": results
+                }), 422
+            return jsonify({
+                "status": "warning",
+                "message": "Face not recognized",
+                "frames": results
+            }), 404
+        
+        # All entries from the batch go to the log in one write
+        log_entry = attendance_logger.log_attendance_many(persons)
+        return jsonify({
+            "status": "success",
+            "persons": persons,
+            "frames": results,
+            "timestamp": log_entry
+        })
+    except PoolBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# ==================== CAMERA SESSIONS ====================
+
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    """Open a camera session (optional: name, detect_scale, detect_interval)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        options = {}
+        if 'detect_scale' in data:
+            options['detect_scale'] = float(data['detect_scale'])
+        if 'detect_interval' in data:
+            options['detect_interval'] = int(data['detect_interval'])
+        
+        session = camera_sessions.create(data.get('name'), **options)
+        return jsonify({"status": "success", "session": session.info()})
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/sessions', methods=['GET'])
+def list_sessions():
+    """List open camera sessions"""
+    try:
+        sessions = [session.info() for session in camera_sessions.list()]
+        return jsonify({"status": "success", "sessions": sessions})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def close_session(session_id):
+    """Close a camera session"""
+    try:
+        camera_sessions.close(session_id)
+        return jsonify({"status": "success", "message": "Session closed"})
+    except KeyError:
+        return jsonify({"status": "error", "message": "Session not found"}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/sessions/<session_id>/frames', methods=['POST'])
+def session_frame(session_id):
+    """
+    Process the next frame of a camera session (same body as
+    /api/mark-attendance/frame). A person is logged once per track, and
+    not again by this camera until SESSION_COOLDOWN has passed.
+    """
+    try:
+        session = camera_sessions.get(session_id)
+    except KeyError:
+        return jsonify({"status": "error", "message": "Session not found"}), 404
+    
+    try:
+        image_data = request.get_data(cache=False)
+        
+        if not image_data:
+            return jsonify({"status": "error", "message": "Frame required"}), 400
+        
+        width = request.headers.get('X-Frame-Width', type=int)
+        height = request.headers.get('X-Frame-Height', type=int)
+        if (width is None) != (height is None):
+            return jsonify({"status": "error", "message": "X-Frame-Width and X-Frame-Height go together"}), 400
+        
+        faces, persons, timings = session.process(face_handler, image_data, width, height)
+        log_entry = attendance_logger.log_attendance_many(persons) if persons else None
+        return jsonify({
+            "status": "success",
+            "persons": persons,
+            "faces": faces,
+            "timestamp": log_entry,
+            "timings": timings
+        })
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -156,25 +388,83 @@ def mark_attendance():
 
 @app.route('/api/attendance-logs', methods=['GET'])
 def get_attendance_logs():
-    """Get attendance logs"""
+    """
+    Get attendance logs.
+    ?date=&person_id= returns one day (default today). Any of
+    start_date, end_date, person, page or page_size switches to a range
+    query (person alone gives that person's full history), paginated.
+    """
     try:
+        range_args = ('start_date', 'end_date', 'person', 'page', 'page_size')
+        if any(arg in request.args for arg in range_args):
+            result = attendance_logger.query_logs(
+                start_date=request.args.get('start_date'),
+                end_date=request.args.get('end_date'),
+                person_name=request.args.get('person'),
+                page=request.args.get('page', 1, type=int),
+                page_size=min(request.args.get('page_size', 100, type=int), 1000)
+            )
+            return jsonify({"status": "success", **result})
+        
         date = request.args.get('date')
         person_id = request.args.get('person_id')
         
         logs = attendance_logger.get_logs(date=date, person_id=person_id)
         return jsonify({"status": "success", "logs": logs})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/attendance-stats', methods=['GET'])
 def get_attendance_stats():
-    """Get attendance statistics"""
+    """Get attendance statistics (supports ETag / Last-Modified revalidation)"""
     try:
-        stats = attendance_logger.get_statistics()
-        return jsonify({"status": "success", "stats": stats})
+        # Unchanged since the client's copy: answer without building the stats
+        etag = attendance_logger.statistics_etag()
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        
+        stats, etag, last_modified = attendance_logger.get_statistics_cached()
+        response = jsonify({"status": "success", "stats": stats})
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/attendance/stream', methods=['GET'])
+def attendance_stream():
+    """Live attendance updates as server-sent events"""
+    try:
+        subscription = attendance_logger.events.subscribe()
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    
+    def generate():
+        try:
+            # Current statistics first, so the client starts from a known state
+            stats = attendance_logger.get_statistics()
+            yield "retry: 3000\n"
+            yield format_sse('snapshot', stats)
+            while True:
+                event = subscription.get(timeout=config.STREAM_KEEPALIVE)
+                if event is None:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                else:
+                    yield format_sse(*event)
+        finally:
+            attendance_logger.events.unsubscribe(subscription)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # ==================== DATASET MANAGEMENT ====================
 
 @app.route('/api/datasets/available', methods=['GET'])
@@ -186,6 +476,27 @@ def get_available_datasets():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/datasets', methods=['GET'])
+def list_datasets():
+    """Get downloaded datasets with their person and image counts"""
+    try:
+        datasets = dataset_downloader.list_datasets()
+        return jsonify({"status": "success", "datasets": datasets})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/datasets/<dataset_name>', methods=['GET'])
+def get_dataset_info(dataset_name):
+    """Get counts and size of a downloaded dataset (`?refresh=1` rescans it)"""
+    try:
+        refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
+        info = dataset_downloader.get_dataset_info(dataset_name, refresh=refresh)
+        if info is None:
+            return jsonify({"status": "error", "message": f"Dataset {dataset_name} not found"}), 404
+        return jsonify({"status": "success", "dataset": info})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/datasets/download', methods=['POST'])
 def download_dataset():
     """Download dataset"""
@@ -214,6 +525,53 @@ def import_local_dataset():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/datasets/import', methods=['POST'])
+def import_dataset_archive():
+    """
+    Import a dataset archive (zip or tar, as the raw request body) while it
+    is uploaded; `?name=` names the dataset (default: X-Filename without
+    extension) and `?enroll=1` enrolls its persons as images arrive.
+    Streams progress as newline-delimited JSON.
+    """
+    dataset_name = request.args.get('name') or request.headers.get('X-Filename', '').split('.')[0]
+    enroll = request.args.get('enroll', '').lower() in ('1', 'true', 'yes')
+    try:
+        importer = dataset_downloader.create_importer(dataset_name)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    def generate():
+        try:
+            for event in import_archive(face_handler, importer, request.stream, enroll):
+                if event["type"] == "imported":
+                    dataset_downloader.record_import(importer)
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/datasets/<dataset_name>/enroll', methods=['POST'])
+def bulk_enroll_dataset(dataset_name):
+    """
+    Enroll every person of a dataset (one folder of images per person).
+    Streams progress as newline-delimited JSON; the last line is the result.
+    """
+    dataset_path = DATASETS_DIR / dataset_name
+    if dataset_path.resolve().parent != DATASETS_DIR.resolve() or not dataset_path.is_dir():
+        return jsonify({"status": "error", "message": f"Dataset {dataset_name} not found"}), 404
+    
+    events = enroll_dataset(face_handler, dataset_path)
+    
+    def generate():
+        try:
+            for event in events:
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 # ==================== SETTINGS ====================
 
 @app.route('/api/settings', methods=['GET'])
@@ -230,6 +588,28 @@ def get_settings():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/ready', methods=['GET'])
+def readiness():
+    """
+    Readiness: 200 once libraries, models and the gallery are loaded, 503
+    while they are (warmup starts on the first call if it has not yet)
+    """
+    startup.warm_up(face_handler.warmup)
+    status = startup.status()
+    if startup.ready:
+        return jsonify({"status": "success", **status})
+    response = jsonify({"status": "error" if startup.error else "warming", **status})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Per-stage timers and counters in the Prometheus text format"""
+    if not metrics.ENABLED:
+        return jsonify({"status": "error", "message": "Metrics are disabled (set METRICS_ENABLED=True)"}), 404
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 # ==================== ERROR HANDLERS ====================
 
 @app.errorhandler(404)
@@ -253,4 +633,8 @@ if __name__ == '__main__':
     print("Starting server at http://localhost:5000")
     print("=" * 50)
     
+    # The debug reloader runs the server in a child process; warm that one
+    if config.WARMUP_ON_START and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        startup.warm_up(face_handler.warmup)
+    
     app.run(debug=True, host='0.0.0.0', port=5000)
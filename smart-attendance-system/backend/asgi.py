@@ -0,0 +1,255 @@
+"""
+ASGI
+Async serving mode: the routes of app.py behind an ASGI front end.
+
+Request bodies are received and responses sent on the event loop, so a slow
+upload or a slow client never holds a thread (except archive imports, which
+are extracted while they upload). Each request is then handled by its
+Flask view in a thread pool: recognition and enrollment requests in one
+pool (SERVER_RECOGNITION_THREADS), everything else in another
+(SERVER_THREADS), so a burst of recognition work cannot delay requests such
+as /api/model-status. The live attendance stream is served on the event
+loop itself instead of holding a thread per client.
+
+Run with:
+    python backend/serve.py
+"""
+
+import asyncio
+import io
+import json
+import re
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from app import app as flask_app, face_handler, attendance_logger, startup
+from event_stream import format_sse
+
+# Requests that decode and encode faces, or download datasets
+RECOGNITION_ROUTES = re.compile(
+    r"^/api/(mark-attendance(/.*)?|sessions/[^/]+/frames|upload-image|train-model"
+    r"|datasets/(download|import(-local)?|[^/]+/enroll))$"
+)
+
+# Requests whose body is read by the view as it arrives (archive imports)
+# instead of being received in full first
+STREAMED_ROUTES = re.compile(r"^/api/datasets/import$")
+
+# Bodies larger than this are spooled to a temporary file while received
+SPOOL_BYTES = 1024 * 1024
+
+_recognition_pool = ThreadPoolExecutor(
+    max_workers=config.SERVER_RECOGNITION_THREADS, thread_name_prefix="recognition"
+)
+_request_pool = ThreadPoolExecutor(max_workers=config.SERVER_THREADS, thread_name_prefix="request")
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+    elif scope['type'] == 'http':
+        if scope['path'] == '/api/attendance/stream' and scope['method'] == 'GET':
+            await _attendance_stream(scope, receive, send)
+        else:
+            await _call_flask(scope, receive, send)
+
+async def _lifespan(receive, send):
+    """Startup and shutdown of the server"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if config.WARMUP_ON_START:
+                # In the background: /api/ready reports when it is done
+                startup.warm_up(face_handler.warmup)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            face_handler.close()
+            attendance_logger.close()
+            _recognition_pool.shutdown(wait=False, cancel_futures=True)
+            _request_pool.shutdown(wait=False, cancel_futures=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def _receive_body(receive):
+    """Receive the whole request body without blocking a thread"""
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None
+        body.write(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    size = body.tell()
+    body.seek(0)
+    return body, size
+
+class _StreamedBody(io.RawIOBase):
+    """Request body read from a worker thread, one ASGI message at a time"""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._data = b''
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._data and not self._done:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                self._done = True
+            else:
+                self._data = message.get('body', b'')
+                self._done = not message.get('more_body', False)
+        size = min(len(buffer), len(self._data))
+        buffer[:size] = self._data[:size]
+        self._data = self._data[size:]
+        return size
+
+def _environ(scope, body, size):
+    """WSGI environ for an ASGI HTTP request (size None: body of unknown length)"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    if size is None:
+        environ['wsgi.input_terminated'] = True
+    else:
+        environ['CONTENT_LENGTH'] = str(size)
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def _run_flask(environ, loop, send):
+    """
+    Run the Flask app for one request in a worker thread, passing each
+    chunk of the response to the event loop as it is produced (so streamed
+    responses, such as enrollment progress, reach the client as they go)
+    """
+    def send_message(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(k.encode('latin1'), v.encode('latin1')) for k, v in headers]
+        return write
+
+    def write(data):
+        if not response.get('started'):
+            send_message({'type': 'http.response.start', 'status': response['status'],
+                          'headers': response['headers']})
+            response['started'] = True
+        if data:
+            send_message({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+    result = flask_app(environ, start_response)
+    try:
+        for chunk in result:
+            write(chunk)
+        write(b'')
+        send_message({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+async def _call_flask(scope, receive, send):
+    """Serve a request with its Flask view, in the matching thread pool"""
+    loop = asyncio.get_running_loop()
+    if STREAMED_ROUTES.match(scope['path']):
+        body, size = io.BufferedReader(_StreamedBody(receive, loop)), None
+    else:
+        received = await _receive_body(receive)
+        if received is None:
+            return
+        body, size = received
+
+    pool = _recognition_pool if RECOGNITION_ROUTES.match(scope['path']) else _request_pool
+    try:
+        await loop.run_in_executor(pool, _run_flask, _environ(scope, body, size), loop, send)
+    finally:
+        body.close()
+
+async def _attendance_stream(scope, receive, send):
+    """Live attendance updates as server-sent events (see app.attendance_stream)"""
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    try:
+        subscription = attendance_logger.events.subscribe(
+            on_push=lambda: loop.call_soon_threadsafe(wake.set)
+        )
+    except RuntimeError as e:
+        content = json.dumps({"status": "error", "message": str(e)}).encode()
+        await send({'type': 'http.response.start', 'status': 503, 'headers': [
+            (b'content-type', b'application/json'),
+            (b'access-control-allow-origin', b'*')
+        ]})
+        await send({'type': 'http.response.body', 'body': content})
+        return
+
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        # Current statistics first, so the client starts from a known state
+        stats = await loop.run_in_executor(_request_pool, attendance_logger.get_statistics)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            (b'access-control-allow-origin', b'*')
+        ]})
+        await _send_event(send, "retry: 3000\n" + format_sse('snapshot', stats))
+
+        while not disconnected.done():
+            # Cleared before draining, so a push during the drain is not missed
+            wake.clear()
+            event = subscription.get(timeout=0)
+            while event is not None:
+                await _send_event(send, format_sse(*event))
+                event = subscription.get(timeout=0)
+
+            waiter = asyncio.ensure_future(wake.wait())
+            done, _ = await asyncio.wait(
+                {waiter, disconnected}, timeout=config.STREAM_KEEPALIVE,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            waiter.cancel()
+            if not done:
+                # Keeps proxies from closing an idle connection
+                await _send_event(send, ": keepalive\n\n")
+    finally:
+        disconnected.cancel()
+        attendance_logger.events.unsubscribe(subscription)
+
+async def _send_event(send, text):
+    await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
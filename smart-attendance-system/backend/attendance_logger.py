@@ -1,104 +1,216 @@
 """
 Attendance Logger
 Handles attendance logging and statistics
+
+Entries are kept by a storage engine (see attendance_storage.py): per-day
+append-only journals by default, or SQLite when ATTENDANCE_STORAGE=sqlite.
+Today's statistics are kept in memory and updated as check-ins are logged,
+and every check-in is published to live subscribers (see event_stream.py).
 """
 
-import json
+import threading
+import time
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
 import csv
 
+import config
+import metrics
+from attendance_storage import JournalStorage, SQLiteStorage, to_log
+from event_stream import EventBroadcaster
+from timing import elapsed_ms
+
+def _utc(timestamp):
+    """A local ISO timestamp or date as an aware UTC datetime"""
+    return datetime.fromisoformat(timestamp).astimezone(timezone.utc)
+
+def _etag(date, stats):
+    """
+    ETag of a day's statistics. Every check-in adds to the day's mark count,
+    so the count identifies the statistics without a per-process version.
+    """
+    return f"{date}-{stats['marked']}"
+
 class AttendanceLogger:
-    def __init__(self, logs_dir):
+    def __init__(self, logs_dir, storage=None):
         self.logs_dir = Path(logs_dir)
         self.logs_dir.mkdir(exist_ok=True)
         self.current_date_file = None
+        
+        storage = storage or config.ATTENDANCE_STORAGE
+        if storage == 'sqlite':
+            self.storage = SQLiteStorage(self.logs_dir / config.ATTENDANCE_DB)
+        elif storage == 'journal':
+            self.storage = JournalStorage(self.logs_dir)
+        else:
+            raise ValueError(f"Unknown attendance storage: {storage}")
+        
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self.events = EventBroadcaster(config.STREAM_BUFFER_SIZE, config.STREAM_MAX_CLIENTS)
     
     def log_attendance(self, person_name):
         """Log attendance for a person"""
+        return self.log_attendance_many([person_name])
+    
+    def log_attendance_many(self, person_names):
+        """Log attendance for several persons in a single write"""
+        timings = {} if metrics.ENABLED else None
+        operation_start = time.perf_counter()
         today = datetime.now().strftime("%Y-%m-%d")
-        log_file = self.logs_dir / f"attendance_{today}.json"
-        
         timestamp = datetime.now().isoformat()
         
-        # Load existing logs
-        if log_file.exists():
-            with open(log_file, 'r') as f:
-                logs = json.load(f)
-        else:
-            logs = []
-        
-        # Check if person already marked attendance today
-        for log in logs:
-            if log['person_name'] == person_name:
-                # Already marked, update check-out time
-                log['checkout_time'] = timestamp
-                log['duration'] = self._calculate_duration(log['timestamp'], timestamp)
-        else:
-            # New entry
-            logs.append({
-                'person_name': person_name,
-                'timestamp': timestamp,
-                'checkout_time': None,
-                'duration': '0m'
-            })
-        
-        # Save logs
-        with open(log_file, 'w') as f:
-            json.dump(logs, f, indent=2)
-        
+        streaming = self.events.has_subscribers
+        if streaming:
+            # Check-ins are told apart from check-outs by today's statistics
+            self._day_stats(today)
+        
+        # Written and counted under the statistics lock, so a day being
+        # loaded from storage at the same time cannot count them twice
+        with self._stats_lock:
+            start = time.perf_counter()
+            self.storage.record(today, person_names, timestamp)
+            if timings is not None:
+                timings['write_ms'] = elapsed_ms(start)
+            update = self._update_stats(today, person_names, timestamp)
+        
+        if streaming and update is not None:
+            start = time.perf_counter()
+            self._publish(today, person_names, timestamp, *update)
+            if timings is not None:
+                timings['publish_ms'] = elapsed_ms(start)
+        
+        if timings is not None:
+            metrics.observe('log_attendance', operation_start, timings)
+            metrics.CHECKINS.inc(len(person_names))
         return timestamp
     
-    def _calculate_duration(self, start, end):
-        """Calculate duration between two timestamps"""
-        start_dt = datetime.fromisoformat(start)
-        end_dt = datetime.fromisoformat(end)
-        delta = end_dt - start_dt
-        minutes = int(delta.total_seconds() / 60)
-        hours = minutes // 60
-        mins = minutes % 60
-        
-        if hours > 0:
-            return f"{hours}h {mins}m"
-        return f"{mins}m"
+    def _update_stats(self, date, person_names, timestamp):
+        """
+        Fold new check-ins into the cached statistics for their day; returns
+        (names present for the first time, statistics delta), or None when
+        the day is not cached. Called with the statistics lock held.
+        """
+        stats = self._stats.get(date)
+        if stats is None:
+            # Not cached yet; built from storage on the next read
+            return None
+        hour = datetime.fromisoformat(timestamp).hour
+        new_names = set()
+        for name in person_names:
+            if name not in stats['present']:
+                stats['present'][name] = None
+                stats['hourly'][hour] += 1
+                new_names.add(name)
+        stats['marked'] += len(person_names)
+        stats['modified'] = max(stats['modified'], _utc(timestamp))
+        delta = {
+            'date': date,
+            'total_present': len(stats['present']),
+            'total_marked': stats['marked'],
+            'present_delta': len(new_names),
+            'marked_delta': len(person_names),
+            'hour': hour,
+            'hourly_count': stats['hourly'][hour],
+            'last_updated': stats['modified'].isoformat()
+        }
+        return new_names, delta
+    
+    def _publish(self, date, person_names, timestamp, new_names, delta):
+        """Publish check-in / check-out events and the statistics delta"""
+        for name in dict.fromkeys(person_names):
+            if name in new_names:
+                self.events.publish('checkin', dict(to_log(name, timestamp, None), date=date))
+            else:
+                logs = self.storage.day_logs(date, name)
+                log = logs[0] if logs else to_log(name, timestamp, timestamp)
+                self.events.publish('checkout', dict(log, date=date))
+        self.events.publish('stats', delta)
+    
+    def _day_stats(self, date):
+        """
+        Cached statistics for a day, loaded from storage on first use (under
+        the statistics lock, so no check-in is logged while it loads)
+        """
+        with self._stats_lock:
+            stats = self._stats.get(date)
+            if stats is not None:
+                return stats
+            
+            logs = self.storage.day_logs(date)
+            hourly = [0] * 24
+            # Last check-in or check-out of the day; midnight when there is none
+            modified = _utc(date)
+            for log in logs:
+                hourly[datetime.fromisoformat(log['timestamp']).hour] += 1
+                modified = max(modified, _utc(log['checkout_time'] or log['timestamp']))
+            stats = {
+                'present': dict.fromkeys(log['person_name'] for log in logs),
+                'marked': self.storage.marked_count(date),
+                'hourly': hourly,
+                'modified': modified
+            }
+            
+            # Only today's statistics change, so older days are dropped
+            if date == datetime.now().strftime("%Y-%m-%d"):
+                self._stats = {date: stats}
+            return stats
+    
+    def close(self):
+        """Flush and release storage"""
+        self.storage.close()
     
     def get_logs(self, date=None, person_id=None):
         """Get attendance logs"""
         if date is None:
             date = datetime.now().strftime("%Y-%m-%d")
         
-        log_file = self.logs_dir / f"attendance_{date}.json"
-        
-        if not log_file.exists():
-            return []
-        
-        with open(log_file, 'r') as f:
-            logs = json.load(f)
-        
-        if person_id:
-            logs = [l for l in logs if l.get('person_name') == person_id]
-        
-        return logs
+        return self.storage.day_logs(date, person_id)
+    
+    def query_logs(self, start_date=None, end_date=None, person_name=None, page=1, page_size=100):
+        """
+        Get attendance logs across a date range (inclusive, YYYY-MM-DD), for
+        one person or everyone, one page at a time. Each log carries its date.
+        """
+        if page < 1 or page_size < 1:
+            raise ValueError("page and page_size must be positive")
+        result = self.storage.query(start_date, end_date, person_name, page, page_size)
+        result['page'] = page
+        result['page_size'] = page_size
+        return result
     
     def get_statistics(self):
         """Get attendance statistics"""
+        return self.get_statistics_cached()[0]
+    
+    def get_statistics_cached(self):
+        """
+        Today's statistics plus an ETag and last-modified time (UTC) that
+        change only when a check-in is logged, and survive a restart
+        """
+        start = time.perf_counter()
         today = datetime.now().strftime("%Y-%m-%d")
-        logs = self.get_logs(date=today)
-        
-        # Count unique persons present (not individual check-in/check-out records)
-        unique_persons = set()
-        for log in logs:
-            unique_persons.add(log['person_name'])
-        
-        total_present = len(unique_persons)
-        
-        return {
-            'date': today,
-            'total_present': total_present,
-            'total_marked': len(logs),
-            'unique_persons': list(unique_persons),
-            'last_updated': datetime.now().isoformat()
-        }
+        stats = self._day_stats(today)
+        
+        with self._stats_lock:
+            unique_persons = list(stats['present'])
+            result = {
+                'date': today,
+                'total_present': len(unique_persons),
+                'total_marked': stats['marked'],
+                'unique_persons': unique_persons,
+                'hourly_checkins': list(stats['hourly']),
+                'last_updated': stats['modified'].isoformat()
+            }
+            etag = _etag(today, stats)
+        if metrics.ENABLED:
+            metrics.observe('get_statistics', start)
+        return result, etag, stats['modified']
+    
+    def statistics_etag(self):
+        """ETag of today's statistics, without building them"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        return _etag(today, self._day_stats(today))
     
     def export_to_csv(self, date=None, output_file=None):
         """Export attendance logs to CSV"""
@@ -0,0 +1,351 @@
+"""
+Attendance Storage
+Storage engines behind AttendanceLogger
+
+- JournalStorage: per-day append-only journals (attendance_{date}.jsonl)
+  with an in-memory index keyed by person
+- SQLiteStorage: one SQLite database (WAL mode) indexed by date and person
+
+Both keep one entry per person per day: the first check-in time, the
+latest check-out time and the number of marks.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import config
+
+# Past days whose index JournalStorage keeps in memory, least recently used
+# dropped first (the day being written is always kept)
+CACHED_DAYS = 31
+
+def calculate_duration(start, end):
+    """Duration between two ISO timestamps, e.g. '1h 5m'"""
+    if not end:
+        return '0m'
+    delta = datetime.fromisoformat(end) - datetime.fromisoformat(start)
+    minutes = int(delta.total_seconds() / 60)
+    hours = minutes // 60
+    mins = minutes % 60
+    
+    if hours > 0:
+        return f"{hours}h {mins}m"
+    return f"{mins}m"
+
+def to_log(person_name, timestamp, checkout_time, date=None):
+    """Log entry in the shape returned by the API"""
+    log = {
+        'person_name': person_name,
+        'timestamp': timestamp,
+        'checkout_time': checkout_time,
+        'duration': calculate_duration(timestamp, checkout_time)
+    }
+    if date is not None:
+        log['date'] = date
+    return log
+
+def paginate(items, page, page_size):
+    """Slice a list for a 1-based page"""
+    start = (page - 1) * page_size
+    return items[start:start + page_size]
+
+
+class JournalStorage:
+    """Per-day append-only journals with an in-memory per-person index"""
+    
+    def __init__(self, logs_dir):
+        self.logs_dir = logs_dir
+        self._days = OrderedDict()
+        self._event_counts = {}
+        self._journal = None
+        self._journal_date = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if config.ATTENDANCE_FSYNC_INTERVAL > 0:
+            threading.Thread(target=self._sync_loop, daemon=True).start()
+    
+    def record(self, date, person_names, timestamp):
+        """Append check-ins to the day's journal and index"""
+        records = [{'person_name': name, 'timestamp': timestamp} for name in person_names]
+        
+        with self._lock:
+            day = self._load_day(date)
+            journal = self._open_journal(date)
+            journal.write(''.join(json.dumps(r) + '\n' for r in records))
+            journal.flush()
+            self._dirty = True
+            if config.ATTENDANCE_FSYNC_INTERVAL <= 0:
+                self._sync()
+            
+            for record in records:
+                self._apply(day, record['person_name'], record['timestamp'])
+            self._event_counts[date] += len(records)
+    
+    def _apply(self, day, person_name, timestamp):
+        """Apply one check-in to a day's index"""
+        entry = day.get(person_name)
+        if entry is None:
+            # First check-in today: [timestamp, checkout_time, marks]
+            day[person_name] = [timestamp, None, 1]
+        else:
+            # Already marked, update check-out time
+            entry[1] = timestamp
+            entry[2] += 1
+    
+    def _journal_file(self, date):
+        """Append-only journal of a day's check-ins"""
+        return self.logs_dir / f"attendance_{date}.jsonl"
+    
+    def _legacy_file(self, date):
+        """Whole-day JSON file written by earlier versions"""
+        return self.logs_dir / f"attendance_{date}.json"
+    
+    def _load_day(self, date):
+        """Index for a day, built from its files on first use"""
+        day = self._days.get(date)
+        if day is not None:
+            self._days.move_to_end(date)
+            return day
+        
+        day = {}
+        events = 0
+        
+        # Days logged before the journal existed
+        legacy_file = self._legacy_file(date)
+        if legacy_file.exists():
+            with open(legacy_file, 'r') as f:
+                for log in json.load(f):
+                    # One mark per entry, as those versions counted them; the
+                    # check-out time only moves the entry's check-out
+                    self._apply(day, log['person_name'], log['timestamp'])
+                    checkout_time = log.get('checkout_time')
+                    entry = day[log['person_name']]
+                    if checkout_time and (entry[1] is None or checkout_time > entry[1]):
+                        entry[1] = checkout_time
+                    events += 1
+        
+        journal_file = self._journal_file(date)
+        if journal_file.exists():
+            with open(journal_file, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn final line after a crash
+                        continue
+                    self._apply(day, record['person_name'], record['timestamp'])
+                    events += 1
+        
+        self._days[date] = day
+        self._event_counts[date] = events
+        self._evict_days()
+        return day
+    
+    def _evict_days(self):
+        """Drop the least recently used day indexes beyond CACHED_DAYS"""
+        for date in list(self._days):
+            if len(self._days) <= CACHED_DAYS + 1:
+                break
+            if date != self._journal_date:
+                del self._days[date]
+                del self._event_counts[date]
+    
+    def _open_journal(self, date):
+        """Append handle for a day's journal"""
+        if self._journal_date != date:
+            if self._journal is not None:
+                self._sync()
+                self._journal.close()
+            journal_file = self._journal_file(date)
+            self._journal = open(journal_file, 'a')
+            self._journal_date = date
+            if self._journal.tell():
+                # A line torn by a crash must not swallow the next check-in
+                with open(journal_file, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        self._journal.write('\n')
+        return self._journal
+    
+    def _sync(self):
+        """fsync pending journal writes"""
+        if self._dirty and self._journal is not None:
+            os.fsync(self._journal.fileno())
+            self._dirty = False
+    
+    def _sync_loop(self):
+        """Batch fsyncs: at most one per ATTENDANCE_FSYNC_INTERVAL"""
+        while not self._stop.wait(config.ATTENDANCE_FSYNC_INTERVAL):
+            with self._lock:
+                self._sync()
+    
+    def day_logs(self, date, person_name=None):
+        """All entries of one day, optionally for one person"""
+        with self._lock:
+            day = self._load_day(date)
+            if person_name:
+                entry = day.get(person_name)
+                return [to_log(person_name, entry[0], entry[1])] if entry else []
+            return [to_log(name, entry[0], entry[1]) for name, entry in day.items()]
+    
+    def day_entries(self, date):
+        """Raw (person_name, timestamp, checkout_time, marks) entries of a day"""
+        with self._lock:
+            day = self._load_day(date)
+            return [(name, *entry) for name, entry in day.items()]
+    
+    def marked_count(self, date):
+        """Number of check-ins on a day"""
+        with self._lock:
+            self._load_day(date)
+            return self._event_counts[date]
+    
+    def dates(self):
+        """Every date with stored attendance, ascending"""
+        dates = set()
+        for path in self.logs_dir.glob("attendance_*.json*"):
+            if path.suffix in ('.json', '.jsonl'):
+                dates.add(path.stem[len("attendance_"):])
+        return sorted(dates)
+    
+    def query(self, start_date=None, end_date=None, person_name=None, page=1, page_size=100):
+        """Entries across a date range (scans each day in the range)"""
+        logs = []
+        for date in self.dates():
+            if (start_date and date < start_date) or (end_date and date > end_date):
+                continue
+            logs.extend(dict(log, date=date) for log in self.day_logs(date, person_name))
+        return {'logs': paginate(logs, page, page_size), 'total': len(logs)}
+    
+    def close(self):
+        """Flush the journal and stop background work"""
+        self._stop.set()
+        with self._lock:
+            self._sync()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+                self._journal_date = None
+
+
+class SQLiteStorage:
+    """SQLite database in WAL mode, indexed by date and by person"""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS attendance (
+            date TEXT NOT NULL,
+            person_name TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            checkout_time TEXT,
+            marks INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (date, person_name)
+        );
+        CREATE INDEX IF NOT EXISTS idx_attendance_person ON attendance (person_name, date);
+    """
+    
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._conn().executescript(self.SCHEMA)
+    
+    def _conn(self):
+        """Connection for the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def record(self, date, person_names, timestamp):
+        """Upsert check-ins in one transaction"""
+        self.import_entries(
+            (date, name, timestamp, None, 1) for name in person_names
+        )
+    
+    def import_entries(self, rows, replace=False):
+        """
+        Upsert (date, person_name, timestamp, checkout_time, marks) rows in
+        one transaction. With replace=True existing entries are overwritten
+        instead of merged, so re-running a migration is idempotent.
+        """
+        rows = list(rows)
+        if replace:
+            with self._write_lock:
+                conn = self._conn()
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO attendance VALUES (?, ?, ?, ?, ?)", rows
+                    )
+            return
+        
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO attendance (date, person_name, timestamp, checkout_time, marks)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (date, person_name) DO UPDATE SET
+                        checkout_time = MAX(COALESCE(checkout_time, ''),
+                                            COALESCE(excluded.checkout_time, excluded.timestamp)),
+                        timestamp = MIN(timestamp, excluded.timestamp),
+                        marks = marks + excluded.marks
+                    """,
+                    rows
+                )
+    
+    def day_logs(self, date, person_name=None):
+        """All entries of one day, optionally for one person"""
+        sql = "SELECT person_name, timestamp, checkout_time FROM attendance WHERE date = ?"
+        params = [date]
+        if person_name:
+            sql += " AND person_name = ?"
+            params.append(person_name)
+        sql += " ORDER BY timestamp"
+        return [to_log(*row) for row in self._conn().execute(sql, params)]
+    
+    def marked_count(self, date):
+        """Number of check-ins on a day"""
+        row = self._conn().execute(
+            "SELECT COALESCE(SUM(marks), 0) FROM attendance WHERE date = ?", (date,)
+        ).fetchone()
+        return row[0]
+    
+    def query(self, start_date=None, end_date=None, person_name=None, page=1, page_size=100):
+        """Entries across a date range, paginated in SQL"""
+        where = []
+        params = []
+        if start_date:
+            where.append("date >= ?")
+            params.append(start_date)
+        if end_date:
+            where.append("date <= ?")
+            params.append(end_date)
+        if person_name:
+            where.append("person_name = ?")
+            params.append(person_name)
+        clause = (" WHERE " + " AND ".join(where)) if where else ""
+        
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM attendance{clause}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT person_name, timestamp, checkout_time, date FROM attendance{clause}"
+            " ORDER BY date, timestamp LIMIT ? OFFSET ?",
+            params + [page_size, (page - 1) * page_size]
+        )
+        return {'logs': [to_log(*row) for row in rows], 'total': total}
+    
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,262 @@
+"""
+Benchmark
+Measures throughput and latency percentiles of the hot paths (recognition,
+enrollment, training and attendance logging) against synthetic data at a
+realistic scale: galleries of random encodings, synthetic frames, and a day
+log pre-populated with check-ins. Runs in whichever mode is installed
+(face_recognition, or the OpenCV fallback).
+
+Synthetic frames contain no detectable face, so recognize_face and
+add_image_to_person then measure decoding and detection (the rejection
+path); matching and the enrollment commit are measured on their own, and
+--frames with a folder of real photos measures the full path.
+
+Usage:
+    python backend/benchmark.py
+    python backend/benchmark.py --gallery 1000,10000,100000 --save baseline.json
+    python backend/benchmark.py --baseline baseline.json --tolerance 0.2
+"""
+
+import argparse
+import base64
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from face_encoder import FACE_RECOGNITION_AVAILABLE
+from sample_frames import synthetic_frames, load_frames, frame_size
+from face_recognition_handler import FaceRecognitionHandler
+from attendance_logger import AttendanceLogger
+
+# Encodings enrolled per synthetic person
+ENCODINGS_PER_PERSON = 5
+
+class _Upload:
+    """Stands in for an uploaded file (werkzeug FileStorage)"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.data)
+
+
+def random_encodings(count, seed=0):
+    """Encodings shaped like the installed mode's: dlib 128-d, or 256-bin histograms"""
+    rng = np.random.default_rng(seed)
+    if FACE_RECOGNITION_AVAILABLE:
+        return rng.normal(0.0, 0.1, (count, 128)).astype(np.float32)
+    hist = rng.gamma(1.0, 1.0, (count, 256)).astype(np.float32)
+    return hist / np.linalg.norm(hist, axis=1, keepdims=True)
+
+def populate_gallery(handler, size):
+    """Enroll `size` random encodings, ENCODINGS_PER_PERSON per person, in one commit"""
+    encodings = random_encodings(size)
+    people = []
+    for start in range(0, size, ENCODINGS_PER_PERSON):
+        rows = encodings[start:start + ENCODINGS_PER_PERSON]
+        person = f"person_{start // ENCODINGS_PER_PERSON}"
+        people.append((person, [(f"synthetic/{person}/{i}.jpg", row) for i, row in enumerate(rows)]))
+    handler.enroll_many(people)
+
+def populate_logs(logger, entries, persons):
+    """Today's log with `entries` check-ins of `persons` different people"""
+    names = [f"person_{i % persons}" for i in range(entries)]
+    for start in range(0, entries, 1000):
+        logger.log_attendance_many(names[start:start + 1000])
+
+def measure(name, operation, iterations, warmup=3):
+    """
+    Run operation(i) `iterations` times after `warmup` untimed calls; returns
+    a result row. ValueErrors (such as "No face detected") are counted, not raised.
+    """
+    for i in range(warmup):
+        try:
+            operation(i)
+        except ValueError:
+            pass
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        start = time.perf_counter()
+        try:
+            operation(i)
+        except ValueError:
+            errors += 1
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    total = time.perf_counter() - started
+
+    latencies = np.array(latencies)
+    return {
+        'operation': name,
+        'iterations': iterations,
+        'errors': errors,
+        'ops_per_s': iterations / total if total > 0 else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max())
+    }
+
+def recognition_suite(work_dir, size, frames, iterations):
+    """Recognition, enrollment and training against a gallery of `size` encodings"""
+    handler = FaceRecognitionHandler(work_dir / f"models_{size}")
+    try:
+        populate_gallery(handler, size)
+        queries = random_encodings(iterations + 3, seed=1)
+        data_urls = ["data:image/jpeg;base64," + base64.b64encode(f).decode() for f in frames]
+        person_id = next(iter(handler.persons_data))
+        image_dir = work_dir / "commit_images"
+        image_dir.mkdir(exist_ok=True)
+
+        def recognize(i):
+            handler.recognize_face(data_urls[i % len(data_urls)])
+
+        def match(i):
+            handler._match(queries[i])
+
+        def add_image(i):
+            # A different image every time, so the encoding cache never answers
+            frame = frames[i % len(frames)]
+            handler.add_image_to_person(person_id, _Upload(frame + i.to_bytes(4, 'little')))
+
+        def enroll_commit(i):
+            handler._enroll_encoding(person_id, image_dir / f"{i}.jpg", queries[i])
+
+        results = [
+            measure(f"recognize_face@{size}", recognize, iterations),
+            measure(f"match@{size}", match, iterations),
+            measure(f"add_image_to_person@{size}", add_image, max(1, iterations // 4)),
+            measure(f"enroll_commit@{size}", enroll_commit, max(1, iterations // 4)),
+            measure(f"train_model@{size}", lambda i: handler.train_model(), 3, warmup=1)
+        ]
+    finally:
+        handler.close()
+    return results
+
+def logging_suite(work_dir, storage, entries, iterations):
+    """Attendance logging and statistics against a day of `entries` check-ins"""
+    logs_dir = work_dir / f"logs_{storage}"
+    logger = AttendanceLogger(logs_dir, storage=storage)
+    try:
+        populate_logs(logger, entries, max(1, entries // 20))
+        logger.get_statistics()
+
+        def log(i):
+            logger.log_attendance(f"visitor_{i}")
+
+        def cold_statistics(i):
+            # A fresh logger builds today's statistics from storage
+            fresh = AttendanceLogger(logs_dir, storage=storage)
+            try:
+                fresh.get_statistics()
+            finally:
+                fresh.close()
+
+        results = [
+            measure(f"log_attendance[{storage}]", log, iterations),
+            measure(f"get_statistics[{storage}]", lambda i: logger.get_statistics(), iterations),
+            measure(f"get_statistics_cold[{storage}]", cold_statistics, max(1, iterations // 20), warmup=1),
+            measure(f"get_logs[{storage}]", lambda i: logger.get_logs(), max(1, iterations // 20), warmup=1)
+        ]
+    finally:
+        logger.close()
+    return results
+
+def compare(results, baseline, tolerance):
+    """Attach the baseline p50 to each result; returns the names of regressions"""
+    previous = {row['operation']: row for row in baseline.get('results', [])}
+    regressions = []
+    for row in results:
+        before = previous.get(row['operation'])
+        if before is None or before['p50_ms'] <= 0:
+            continue
+        row['baseline_p50_ms'] = before['p50_ms']
+        row['change'] = row['p50_ms'] / before['p50_ms'] - 1.0
+        if row['change'] > tolerance:
+            regressions.append(row['operation'])
+    return regressions
+
+def print_results(results, mode):
+    """Print the results as a table"""
+    print(f"Mode: {mode}")
+    print(f"{'operation':<34}{'n':>6}{'err':>5}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'max ms':>10}{'vs base':>9}")
+    for row in results:
+        change = f"{row['change'] * 100:+.0f}%" if 'change' in row else "-"
+        print(f"{row['operation']:<34}{row['iterations']:>6}{row['errors']:>5}{row['ops_per_s']:>10.1f}"
+              f"{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['p99_ms']:>10.3f}{row['max_ms']:>10.3f}"
+              f"{change:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recognition, enrollment and logging")
+    parser.add_argument('--gallery', default="1000,10000", help="Comma-separated synthetic gallery sizes")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--frames', help="Folder of photos to use instead of synthetic frames")
+    parser.add_argument('--frame-size', default="640x480", help="Synthetic frame size, WxH")
+    parser.add_argument('--log-entries', type=int, default=10000, help="Check-ins already in today's log")
+    parser.add_argument('--storage', default="journal,sqlite", help="Attendance storage engines to measure")
+    parser.add_argument('--only', choices=['recognition', 'logging'], help="Run one suite only")
+    parser.add_argument('--save', help="Write the results to this JSON file (e.g. a baseline)")
+    parser.add_argument('--baseline', help="Compare p50 latencies against a saved run")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Slowdown against the baseline reported as a regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    mode = "face_recognition" if FACE_RECOGNITION_AVAILABLE else "opencv"
+    if args.frames:
+        frames = load_frames(args.frames)
+        if not frames:
+            raise SystemExit(f"No images found in {args.frames}")
+    else:
+        frames = synthetic_frames(16, *frame_size(args.frame_size))
+
+    work_dir = Path(tempfile.mkdtemp(prefix="attendance_bench_"))
+    results = []
+    try:
+        if args.only != 'logging':
+            for size in (int(s) for s in args.gallery.split(',')):
+                results.extend(recognition_suite(work_dir, size, frames, args.iterations))
+        if args.only != 'recognition':
+            for storage in args.storage.split(','):
+                results.extend(logging_suite(work_dir, storage, args.log_entries, args.iterations))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('mode') != mode:
+            print(f"Note: baseline was measured in {baseline.get('mode')} mode")
+        regressions = compare(results, baseline, args.tolerance)
+
+    print_results(results, mode)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'mode': mode,
+                'created': datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'results': results
+            }, f, indent=2)
+
+    if regressions:
+        print(f"Slower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
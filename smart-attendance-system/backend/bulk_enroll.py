@@ -0,0 +1,256 @@
+"""
+Bulk Enroll
+Enrolls every person of a dataset directory laid out as
+datasets/<name>/<person>/<image>.jpg: images are encoded in parallel
+worker processes, then all new persons and encodings are committed in one
+write. Images that are already enrolled are skipped, so re-running an
+import only adds what is new, and images whose content was encoded before
+(see encoding_cache.py) are not encoded again.
+
+Usage:
+    python backend/bulk_enroll.py datasets/lfw
+    python backend/bulk_enroll.py datasets/lfw --workers 8
+
+Also available while the server runs as POST /api/datasets/<name>/enroll.
+Do not run the CLI against the models directory of a running server.
+"""
+
+import argparse
+import os
+from concurrent.futures import as_completed
+from pathlib import Path
+
+import config
+from encoding_cache import content_key
+from dataset_import import IMAGE_EXTENSIONS
+from encoding_pool import encode_file, worker_executor
+
+# Failures listed in the result; the rest are only counted
+MAX_REPORTED_FAILURES = 100
+
+def scan_dataset(dataset_dir):
+    """(person name, [image paths]) for each person folder, sorted by name"""
+    people = []
+    with os.scandir(dataset_dir) as entries:
+        for entry in entries:
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            with os.scandir(entry.path) as files:
+                images = sorted(
+                    os.path.abspath(f.path) for f in files
+                    if f.is_file() and f.name.lower().endswith(IMAGE_EXTENSIONS)
+                )
+            if images:
+                people.append((entry.name, images))
+    people.sort()
+    return people
+
+class Enrollment:
+    """
+    Enrolls images as they are added: images seen before (under any path)
+    come from the encoding cache, the rest are encoded in worker processes,
+    once per distinct content, while more images are added. Nothing is
+    committed until finish().
+    """
+
+    def __init__(self, face_handler, workers=None, total=None):
+        self.face_handler = face_handler
+        self.cache = face_handler.encoding_cache
+        self.workers = max(1, workers or config.ENROLL_WORKERS)
+        self.total = total
+        self.enrolled = face_handler.enrolled_images()
+        self.encoded = {}
+        self.failures = []
+        self.done = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cached = 0
+        self.skipped = 0
+        self._pending = {}
+        self._futures = {}
+        self._executor = None
+
+    def is_enrolled(self, image):
+        return os.path.abspath(image) in self.enrolled
+
+    def add(self, name, image, image_data=None):
+        """Queue one image of a person; returns the progress events now ready"""
+        image = os.path.abspath(image)
+        if image in self.enrolled:
+            self.skipped += 1
+            return self.poll()
+        self.encoded.setdefault(name, [])
+        try:
+            key = content_key(image_data if image_data is not None else Path(image).read_bytes())
+        except OSError as e:
+            return [self._finish(name, image, None, str(e), False)] + self.poll()
+
+        found, encoding = self.cache.get(key)
+        if found:
+            self.cached += 1
+            return [self._finish(name, image, encoding, None, True)] + self.poll()
+
+        # Identical content already on its way to a worker is encoded once
+        self._pending.setdefault(key, []).append((name, image))
+        if key not in self._futures:
+            if self._executor is None:
+                self._executor = worker_executor(self.workers)
+            self._futures[key] = self._executor.submit(encode_file, image)
+        return self.poll()
+
+    def poll(self):
+        """Progress events of images encoded so far"""
+        events = []
+        for key in [key for key, future in self._futures.items() if future.done()]:
+            events.extend(self._complete(key))
+        return events
+
+    def finish(self):
+        """
+        Wait for the remaining images, commit everything, and yield their
+        progress events followed by the {"type": "result"} event
+        """
+        completed = False
+        try:
+            keys = {future: key for key, future in self._futures.items()}
+            for future in as_completed(keys):
+                yield from self._complete(keys[future])
+            completed = True
+        finally:
+            if self._executor is not None:
+                # Only wait for the workers to exit when not abandoned midway
+                self._executor.shutdown(wait=completed, cancel_futures=True)
+
+        summary = self.face_handler.enroll_many(list(self.encoded.items()))
+        self.cache.save()
+        yield {
+            "type": "result",
+            **summary,
+            "images_failed": self.failed,
+            "images_rejected": self.rejected,
+            "images_skipped": self.skipped,
+            "images_cached": self.cached,
+            "failures": self.failures
+        }
+
+    def close(self):
+        """Abandon the enrollment without committing"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _complete(self, key):
+        try:
+            encoding, error, rejected = self._futures.pop(key).result()
+        except Exception as e:
+            encoding, error, rejected = None, str(e), None
+        if error is None:
+            self.cache.put(key, encoding)
+        return [self._finish(name, image, encoding, error, False, rejected)
+                for name, image in self._pending.pop(key)]
+
+    def _finish(self, name, image, encoding, error, cached, rejected=None):
+        self.done += 1
+        if encoding is not None:
+            self.encoded[name].append((image, encoding))
+            status = "enrolled"
+        else:
+            if rejected is not None:
+                # A face too poor to encode (see face_quality.py)
+                self.rejected += 1
+                self.face_handler.count_rejection(rejected)
+                status = "rejected"
+            else:
+                self.failed += 1
+                status = "error" if error else "no_face"
+            if len(self.failures) < MAX_REPORTED_FAILURES:
+                self.failures.append({"image": image, "reason": error or "No face detected"})
+        return {"type": "progress", "done": self.done, "total": self.total,
+                "person": name, "image": image, "status": status, "cached": cached}
+
+
+def enroll_dataset(face_handler, dataset_dir, workers=None):
+    """
+    Enroll a dataset directory. Yields a {"type": "start"} event, one
+    {"type": "progress"} event per image as it is encoded, then a
+    {"type": "result"} event once everything is committed. Closing the
+    generator early commits nothing.
+    """
+    dataset_dir = Path(dataset_dir)
+    if not dataset_dir.is_dir():
+        raise ValueError(f"Dataset not found: {dataset_dir}")
+
+    enrollment = Enrollment(face_handler, workers)
+    people = []
+    skipped = 0
+    for name, images in scan_dataset(dataset_dir):
+        new_images = [image for image in images if not enrollment.is_enrolled(image)]
+        skipped += len(images) - len(new_images)
+        if new_images:
+            people.append((name, new_images))
+
+    enrollment.total = sum(len(images) for _, images in people)
+    enrollment.skipped = skipped
+    yield {"type": "start", "dataset": dataset_dir.name, "persons": len(people),
+           "images": enrollment.total, "already_enrolled": skipped}
+
+    try:
+        for name, images in people:
+            for image in images:
+                yield from enrollment.add(name, image)
+        yield from enrollment.finish()
+    finally:
+        enrollment.close()
+
+def import_archive(face_handler, importer, stream, enroll=False, workers=None):
+    """
+    Extract a dataset archive as it is received (see dataset_import.py),
+    enrolling its images while the rest still arrives when `enroll` is set.
+    Yields {"type": "extracted"} events, one {"type": "imported"} event once
+    the archive is read, then the enrollment events.
+    """
+    enrollment = Enrollment(face_handler, workers) if enroll else None
+    try:
+        for person, image_path, image_data in importer.extract(stream):
+            yield {"type": "extracted", "files": importer.files, "bytes": importer.bytes,
+                   "person": person, "image": str(image_path)}
+            if enrollment is not None:
+                yield from enrollment.add(person, image_path, image_data)
+        yield {"type": "imported", "dataset": importer.dataset_path.name,
+               "path": str(importer.dataset_path), "files": importer.files,
+               "bytes": importer.bytes, "skipped": importer.skipped}
+        if enrollment is not None:
+            yield from enrollment.finish()
+    finally:
+        if enrollment is not None:
+            enrollment.close()
+
+def main():
+    base_dir = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser(description="Enroll every person of a dataset directory")
+    parser.add_argument('dataset', help="Dataset directory (one folder of images per person)")
+    parser.add_argument('--models-dir', default=str(base_dir / "models"))
+    parser.add_argument('--workers', type=int, default=config.ENROLL_WORKERS)
+    args = parser.parse_args()
+
+    # Imported here: encoding workers re-import this module and only need the encoder
+    from face_recognition_handler import FaceRecognitionHandler
+    face_handler = FaceRecognitionHandler(args.models_dir)
+    try:
+        for event in enroll_dataset(face_handler, args.dataset, args.workers):
+            if event["type"] == "start":
+                print(f"{event['persons']} persons, {event['images']} new images "
+                      f"({event['already_enrolled']} already enrolled)")
+            elif event["type"] == "progress":
+                if event["done"] % 50 == 0 or event["done"] == event["total"]:
+                    print(f"{event['done']}/{event['total']} encoded")
+            else:
+                for failure in event["failures"]:
+                    print(f"  skipped {failure['image']}: {failure['reason']}")
+                print(f"Added {event['persons_added']} persons, updated {event['persons_updated']}, "
+                      f"enrolled {event['images_enrolled']} images ({event['images_cached']} cached), "
+                      f"{event['images_failed']} failed, {event['images_rejected']} rejected as poor quality")
+    finally:
+        face_handler.close()
+
+if __name__ == '__main__':
+    main()
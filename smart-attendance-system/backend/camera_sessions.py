@@ -0,0 +1,136 @@
+"""
+Camera Sessions
+One session per camera stream. Each session keeps the camera's face tracks
+(see face_tracker.py), so a person in front of the camera is logged once per
+track instead of once per frame, and not again for the same identity until
+a cooldown has passed.
+"""
+
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import config
+
+class CameraSession:
+    """Tracks and logging state of one camera"""
+
+    def __init__(self, session_id, name, tracker, cooldown):
+        self.id = session_id
+        self.name = name
+        self.tracker = tracker
+        self.cooldown = cooldown
+        self.created = datetime.now()
+        self.last_seen = time.monotonic()
+        self.frames = 0
+        self.logged = 0
+        # (track id, name) pairs already logged, for live tracks only
+        self._logged_tracks = set()
+        # name -> monotonic time it was last logged by this camera
+        self._last_logged = {}
+        self._lock = threading.Lock()
+
+    def process(self, handler, image_data, width=None, height=None):
+        """
+        Recognize one frame; returns (faces, persons to log, timings).
+        Each face gets "logged": True on the frame its identity is logged.
+        """
+        faces, timings = handler.recognize_stream(self.tracker, image_data, width, height)
+
+        with self._lock:
+            now = time.monotonic()
+            self.last_seen = now
+            self.frames += 1
+
+            live = {face["track_id"] for face in faces}
+            self._logged_tracks = {key for key in self._logged_tracks if key[0] in live}
+            self._last_logged = {
+                name: at for name, at in self._last_logged.items()
+                if now - at < self.cooldown
+            }
+
+            persons = []
+            for face in faces:
+                face["logged"] = False
+                name = face["name"]
+                if not name:
+                    continue
+                key = (face["track_id"], name)
+                if key in self._logged_tracks:
+                    continue
+                self._logged_tracks.add(key)
+                if name in self._last_logged or name in persons:
+                    # Same person on a new track within the cooldown
+                    continue
+                self._last_logged[name] = now
+                persons.append(name)
+                face["logged"] = True
+            self.logged += len(persons)
+            return faces, persons, timings
+
+    def info(self):
+        """Summary for the API"""
+        return {
+            "session_id": self.id,
+            "name": self.name,
+            "created": self.created.isoformat(),
+            "frames": self.frames,
+            "logged": self.logged,
+            "tracks": len(self.tracker.tracks),
+            "idle_seconds": round(time.monotonic() - self.last_seen, 1)
+        }
+
+
+class SessionManager:
+    """Open camera sessions; sessions idle for SESSION_IDLE_TIMEOUT are closed"""
+
+    def __init__(self, handler, idle_timeout=None, cooldown=None, max_sessions=None):
+        self.handler = handler
+        self.idle_timeout = idle_timeout if idle_timeout is not None else config.SESSION_IDLE_TIMEOUT
+        self.cooldown = cooldown if cooldown is not None else config.SESSION_COOLDOWN
+        self.max_sessions = max_sessions if max_sessions is not None else config.SESSION_MAX
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, name=None, **tracker_options):
+        """Open a session; tracker options override the TRACK_* settings"""
+        with self._lock:
+            self._expire()
+            if len(self._sessions) >= self.max_sessions:
+                raise RuntimeError("Too many camera sessions")
+            session_id = uuid.uuid4().hex
+            session = CameraSession(
+                session_id, name or session_id[:8],
+                self.handler.create_tracker(**tracker_options), self.cooldown
+            )
+            self._sessions[session_id] = session
+            return session
+
+    def get(self, session_id):
+        """Open session by id"""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+        if session is None:
+            raise KeyError(f"Session {session_id} not found")
+        return session
+
+    def list(self):
+        """Every open session"""
+        with self._lock:
+            self._expire()
+            return list(self._sessions.values())
+
+    def close(self, session_id):
+        """Close a session"""
+        with self._lock:
+            if self._sessions.pop(session_id, None) is None:
+                raise KeyError(f"Session {session_id} not found")
+
+    def _expire(self):
+        """Drop idle sessions (caller holds the lock)"""
+        now = time.monotonic()
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_seen > self.idle_timeout:
+                del self._sessions[session_id]
@@ -0,0 +1,131 @@
+"""
+Configuration
+Reads settings from the environment (and .env when python-dotenv is installed)
+"""
+
+import os
+from pathlib import Path
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv(Path(__file__).parent.parent / ".env")
+except ImportError:
+    pass
+
+def _get_int(name, default):
+    """Read an integer setting"""
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+def _get_bool(name, default):
+    """Read a true/false setting"""
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+# Directory holding models/, datasets/ and attendance_logs/ (default: the
+# project directory)
+DATA_DIR = Path(os.environ.get("DATA_DIR") or Path(__file__).parent.parent)
+
+# Gallery index: 'flat' (exact brute force) or 'ivf' (approximate, inverted file)
+FACE_INDEX_TYPE = os.environ.get("FACE_INDEX_TYPE", "flat").lower()
+# Number of IVF clusters; 0 picks sqrt(gallery size)
+FACE_INDEX_NLIST = _get_int("FACE_INDEX_NLIST", 0)
+# Number of IVF clusters scanned per query
+FACE_INDEX_NPROBE = _get_int("FACE_INDEX_NPROBE", 8)
+
+# Threads used to decode and encode frames of a batch request
+BATCH_WORKERS = _get_int("BATCH_WORKERS", os.cpu_count() or 1)
+
+# Background gallery compaction: check every N seconds (0 disables) and compact
+# once the gallery change log holds this many enrollments or removals, or this
+# fraction of rows is deleted. Compaction also folds the change logs into
+# gallery.json and persons.json
+GALLERY_COMPACT_INTERVAL = _get_int("GALLERY_COMPACT_INTERVAL", 60)
+GALLERY_COMPACT_RECORDS = _get_int("GALLERY_COMPACT_RECORDS", 500)
+GALLERY_COMPACT_DEAD_RATIO = float(os.environ.get("GALLERY_COMPACT_DEAD_RATIO", "0.2"))
+
+# Attendance journal: seconds between fsyncs of appended check-ins
+ATTENDANCE_FSYNC_INTERVAL = float(os.environ.get("ATTENDANCE_FSYNC_INTERVAL", "1.0"))
+
+# Attendance storage engine: 'journal' (per-day files) or 'sqlite'
+ATTENDANCE_STORAGE = os.environ.get("ATTENDANCE_STORAGE", "journal").lower()
+# SQLite database file name, inside the attendance logs directory
+ATTENDANCE_DB = os.environ.get("ATTENDANCE_DB", "attendance.db")
+
+# Live attendance stream: events buffered per client before the oldest are
+# dropped, seconds between keepalives, and the maximum number of clients
+STREAM_BUFFER_SIZE = _get_int("STREAM_BUFFER_SIZE", 100)
+STREAM_KEEPALIVE = _get_int("STREAM_KEEPALIVE", 15)
+STREAM_MAX_CLIENTS = _get_int("STREAM_MAX_CLIENTS", 100)
+
+# Stream mode (face tracking): detection runs on a copy scaled by this factor
+# (1 = full resolution), once every N frames; in between faces are followed
+# by template matching (tracks scoring below TRACK_MIN_SCORE are lost) and
+# re-encoded when their box overlaps the encoded one by less than TRACK_DRIFT_IOU
+TRACK_DETECT_SCALE = float(os.environ.get("TRACK_DETECT_SCALE", "0.5"))
+TRACK_DETECT_INTERVAL = _get_int("TRACK_DETECT_INTERVAL", 5)
+TRACK_MIN_SCORE = float(os.environ.get("TRACK_MIN_SCORE", "0.5"))
+TRACK_DRIFT_IOU = float(os.environ.get("TRACK_DRIFT_IOU", "0.6"))
+
+# Camera sessions: seconds before the same person is logged again by one
+# camera, seconds of inactivity before a session is closed, and the most
+# sessions open at once
+SESSION_COOLDOWN = _get_int("SESSION_COOLDOWN", 300)
+SESSION_IDLE_TIMEOUT = _get_int("SESSION_IDLE_TIMEOUT", 300)
+SESSION_MAX = _get_int("SESSION_MAX", 32)
+
+# Encoding worker processes for recognition requests (0 = encode in the
+# request thread), and how many frames may wait for a free worker before
+# requests are refused with 429
+ENCODE_WORKERS = _get_int("ENCODE_WORKERS", 0)
+ENCODE_QUEUE_SIZE = _get_int("ENCODE_QUEUE_SIZE", 16)
+
+# Server address for serve.py
+SERVER_HOST = os.environ.get("FLASK_HOST", "0.0.0.0")
+SERVER_PORT = _get_int("FLASK_PORT", 5000)
+# ASGI mode: threads handling recognition and enrollment requests, and
+# threads handling every other request
+SERVER_RECOGNITION_THREADS = _get_int("SERVER_RECOGNITION_THREADS", 4)
+SERVER_THREADS = _get_int("SERVER_THREADS", 16)
+
+# Worker processes encoding images for bulk enrollment
+ENROLL_WORKERS = _get_int("ENROLL_WORKERS", os.cpu_count() or 1)
+
+# Enrollment encodings cached by image content (models/encoding_cache.npz),
+# most recently used first; 0 disables the cache
+ENCODING_CACHE_SIZE = _get_int("ENCODING_CACHE_SIZE", 20000)
+
+# Dataset archive import: limits on the total extracted size (MB), the size
+# of one image (MB) and the number of images
+DATASET_IMPORT_MAX_MB = _get_int("DATASET_IMPORT_MAX_MB", 4096)
+DATASET_IMPORT_MAX_FILE_MB = _get_int("DATASET_IMPORT_MAX_FILE_MB", 20)
+DATASET_IMPORT_MAX_FILES = _get_int("DATASET_IMPORT_MAX_FILES", 200000)
+
+# Dataset downloads: base URL of a mirror serving the catalog's archives by
+# file name (e.g. a local server), and retries of a dropped download (each
+# resumes where the last one stopped)
+DATASET_MIRROR_URL = os.environ.get("DATASET_MIRROR_URL", "")
+DATASET_DOWNLOAD_RETRIES = _get_int("DATASET_DOWNLOAD_RETRIES", 5)
+# Download archives that have no known SHA-256 (in the catalog or published
+# as <archive>.sha256) without verifying them
+DATASET_ALLOW_UNVERIFIED = _get_bool("DATASET_ALLOW_UNVERIFIED", False)
+
+# Per-stage timers and counters served on /metrics (Prometheus text format)
+METRICS_ENABLED = _get_bool("METRICS_ENABLED", False)
+
+# Load libraries and models, start encoding workers and page in the gallery
+# in the background at startup, instead of on the first requests
+WARMUP_ON_START = _get_bool("WARMUP_ON_START", True)
+
+# Pre-encoding face quality checks (see face_quality.py); each threshold 0
+# disables its check: shortest face side (px), sharpness (variance of the
+# Laplacian), mean brightness range (0-255) and sideways turn (nose offset
+# from the eyes' midpoint, in eye distances; face_recognition mode only)
+QUALITY_GATE = _get_bool("QUALITY_GATE", True)
+QUALITY_MIN_FACE_SIZE = _get_int("QUALITY_MIN_FACE_SIZE", 40)
+QUALITY_MIN_SHARPNESS = float(os.environ.get("QUALITY_MIN_SHARPNESS", "25"))
+QUALITY_MIN_BRIGHTNESS = float(os.environ.get("QUALITY_MIN_BRIGHTNESS", "40"))
+QUALITY_MAX_BRIGHTNESS = float(os.environ.get("QUALITY_MAX_BRIGHTNESS", "220"))
+QUALITY_MAX_POSE = float(os.environ.get("QUALITY_MAX_POSE", "0.4"))
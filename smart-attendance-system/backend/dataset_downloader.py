@@ -4,17 +4,36 @@ Handles downloading and managing datasets
 """
 
 import os
+import re
 import json
-import requests
+import time
+import hashlib
+from datetime import datetime
 from pathlib import Path
-from zipfile import ZipFile
 import shutil
+import threading
+
+import config
+from dataset_import import ArchiveImporter, IMAGE_EXTENSIONS
+
+# Dataset names become directory names
+DATASET_NAME = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+
+# Downloads are written and hashed in chunks of this size
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Seconds to wait for a connection, and between bytes of a response
+DOWNLOAD_TIMEOUT = (10, 60)
 
 class DatasetDownloader:
     def __init__(self, datasets_dir):
         self.datasets_dir = Path(datasets_dir)
         self.datasets_dir.mkdir(exist_ok=True)
         self.metadata_file = self.datasets_dir / "metadata.json"
+        self._metadata_lock = threading.Lock()
+        # Archives being downloaded (or kept for a retried extraction)
+        self.downloads_dir = self.datasets_dir / ".downloads"
+        self._downloading = set()
+        self._downloading_lock = threading.Lock()
     
     def get_available_datasets(self):
         """Get list of available datasets"""
@@ -25,6 +44,10 @@ class DatasetDownloader:
                 "description": "13,000+ labeled faces from the web",
                 "size": "~200MB",
                 "source": "http://vis-www.cs.umass.edu/lfw/lfw.tgz",
+                "archive": "lfw.tgz",
+                # The original host is offline; same archive, as mirrored for scikit-learn
+                "url": "https://ndownloader.figshare.com/files/5976018",
+                "sha256": "055f7d9c632d7370e6fb4afc7468d40f970c34a80d4c6f50ffec63f5a8d536c0",
                 "people_count": 5749
             },
             {
@@ -33,6 +56,8 @@ class DatasetDownloader:
                 "description": "High resolution face dataset",
                 "size": "~500MB",
                 "source": "https://www.robots.ox.ac.uk/~vgg/data/vgg_face2/",
+                # Requires registration: only downloadable from DATASET_MIRROR_URL
+                "archive": "vggface2_subset.tar.gz",
                 "people_count": 1000
             },
             {
@@ -46,7 +71,11 @@ class DatasetDownloader:
         ]
     
     def download_dataset(self, dataset_name):
-        """Download a dataset"""
+        """
+        Download a dataset: its archive is fetched in chunks (resuming an
+        interrupted download), verified against its SHA-256, and extracted
+        as it is read from disk
+        """
         datasets = {d['id']: d for d in self.get_available_datasets()}
         
         if dataset_name not in datasets:
@@ -58,43 +87,139 @@ class DatasetDownloader:
         if dataset_path.exists():
             return str(dataset_path)
         
-        dataset_path.mkdir(exist_ok=True)
-        
-        # For demonstration, create sample directory structure
-        if dataset_name == "lfw":
-            self._create_sample_lfw_structure(dataset_path)
-        elif dataset_name == "vggface2_subset":
-            self._create_sample_vggface_structure(dataset_path)
-        elif dataset_name == "face_emoji":
+        url = self._archive_url(dataset)
+        if url is None:
+            if dataset_name != "face_emoji":
+                raise ValueError(
+                    f"{dataset['name']} cannot be downloaded automatically: get it from "
+                    f"{dataset['source']} and import it, or set DATASET_MIRROR_URL"
+                )
+            # Generated locally, for testing
+            dataset_path.mkdir(exist_ok=True)
             self._create_sample_emoji_structure(dataset_path)
+        else:
+            with self._downloading_lock:
+                if dataset_name in self._downloading:
+                    raise ValueError(f"{dataset['name']} is already being downloaded")
+                self._downloading.add(dataset_name)
+            try:
+                self._download_and_extract(dataset, url, dataset_path)
+            finally:
+                with self._downloading_lock:
+                    self._downloading.discard(dataset_name)
         
         # Save metadata
         self._save_dataset_metadata(dataset_name, dataset)
         
         return str(dataset_path)
     
-    def _create_sample_lfw_structure(self, path):
-        """Create sample LFW dataset structure"""
-        people = ["David_Beckham", "George_Bush", "Margaret_Thatcher", "Kofi_Annan"]
+    def _archive_url(self, dataset):
+        """Where to download a dataset's archive from, or None"""
+        if dataset.get('archive') and config.DATASET_MIRROR_URL:
+            return f"{config.DATASET_MIRROR_URL.rstrip('/')}/{dataset['archive']}"
+        return dataset.get('url')
+    
+    def _download_and_extract(self, dataset, url, dataset_path):
+        """Download, verify and extract a dataset archive into dataset_path"""
+        self.downloads_dir.mkdir(exist_ok=True)
+        archive_path = self.downloads_dir / dataset['archive']
         
-        for person in people:
-            person_dir = path / person
-            person_dir.mkdir(exist_ok=True)
-            
-            # Create placeholder files
-            for i in range(3):
-                (person_dir / f"{person}_0001_{i}.jpg").touch()
+        # A verified archive is kept until it has been extracted
+        if not archive_path.exists():
+            expected = dataset.get('sha256') or self._published_checksum(url)
+            if not expected:
+                if not config.DATASET_ALLOW_UNVERIFIED:
+                    raise ValueError(
+                        f"No checksum is known for {dataset['archive']}: publish it as "
+                        f"{dataset['archive']}.sha256, or set DATASET_ALLOW_UNVERIFIED=True"
+                    )
+                print(f"Warning: {dataset['archive']} has no known checksum and is not verified")
+            part_path = archive_path.with_name(archive_path.name + ".part")
+            digest = self._fetch(url, part_path)
+            if expected and digest != expected.lower():
+                part_path.unlink()
+                raise ValueError(f"Checksum mismatch for {dataset['archive']}, download it again")
+            os.replace(part_path, archive_path)
+        
+        # Extracted next to the datasets and moved in place when complete, so
+        # a failed extraction never looks like a downloaded dataset
+        staging_path = self.downloads_dir / dataset['id']
+        shutil.rmtree(staging_path, ignore_errors=True)
+        try:
+            importer = self._importer(staging_path)
+            with open(archive_path, 'rb') as f:
+                for _ in importer.extract(f):
+                    pass
+            os.replace(staging_path, dataset_path)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+        archive_path.unlink()
     
-    def _create_sample_vggface_structure(self, path):
-        """Create sample VGGFace structure"""
-        people = [f"person_{i:04d}" for i in range(100, 110)]
+    def _fetch(self, url, part_path):
+        """
+        Download url into part_path in chunks, resuming from what an earlier
+        attempt left there (HTTP Range) and retrying dropped connections up
+        to DATASET_DOWNLOAD_RETRIES times. Returns the SHA-256 of the file.
+        """
+        # Imported here: only downloads need it, and it is slow to import
+        import requests
         
-        for person in people:
-            person_dir = path / person
-            person_dir.mkdir(exist_ok=True)
-            
-            for i in range(3):
-                (person_dir / f"{person}_{i}.jpg").touch()
+        digest = hashlib.sha256()
+        offset = 0
+        if part_path.exists():
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    offset += len(chunk)
+        
+        failures = 0
+        while True:
+            # Identity: ranges count stored bytes, which a decoded body would not match
+            headers = {'Accept-Encoding': 'identity'}
+            if offset:
+                headers['Range'] = f"bytes={offset}-"
+            try:
+                with requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                    if response.status_code == 416:
+                        # Nothing left past offset: complete, unless the file changed
+                        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                        if total.isdigit() and int(total) == offset:
+                            return digest.hexdigest()
+                        digest, offset = hashlib.sha256(), 0
+                        part_path.unlink()
+                        continue
+                    response.raise_for_status()
+                    if offset and response.status_code != 206:
+                        # The server ignored the range: start over
+                        digest, offset = hashlib.sha256(), 0
+                    
+                    length = response.headers.get('Content-Length')
+                    expected_end = offset + int(length) if length and length.isdigit() else None
+                    with open(part_path, 'ab' if offset else 'wb') as f:
+                        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                            digest.update(chunk)
+                            offset += len(chunk)
+                    if expected_end is not None and offset < expected_end:
+                        raise requests.ConnectionError("Connection closed before the download completed")
+                    return digest.hexdigest()
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                failures += 1
+                if failures > config.DATASET_DOWNLOAD_RETRIES:
+                    raise ValueError(f"Download failed, retry to resume it: {str(e)}")
+                time.sleep(min(2 ** (failures - 1), 30))
+    
+    def _published_checksum(self, url):
+        """SHA-256 published next to an archive as <url>.sha256, or None"""
+        import requests
+        
+        try:
+            response = requests.get(url + ".sha256", timeout=DOWNLOAD_TIMEOUT)
+        except requests.RequestException:
+            return None
+        if response.status_code != 200 or not response.text.split():
+            return None
+        return response.text.split()[0].lower()
     
     def _create_sample_emoji_structure(self, path):
         """Create sample emoji face structure"""
@@ -107,58 +232,131 @@ class DatasetDownloader:
             for i in range(5):
                 (face_dir / f"{face_type}_{i}.jpg").touch()
     
-    def _save_dataset_metadata(self, dataset_name, dataset_info):
-        """Save dataset metadata"""
-        metadata = {}
-        
+    def _load_metadata(self):
+        """Saved metadata of every dataset"""
         if self.metadata_file.exists():
             with open(self.metadata_file, 'r') as f:
-                metadata = json.load(f)
-        
-        metadata[dataset_name] = {
+                return json.load(f)
+        return {}
+    
+    def _update_metadata(self, dataset_name, update):
+        """Apply update(entry) to one dataset's metadata and save atomically"""
+        with self._metadata_lock:
+            metadata = self._load_metadata()
+            metadata[dataset_name] = update(metadata.get(dataset_name, {}))
+            temp_file = self.metadata_file.with_suffix('.tmp')
+            with open(temp_file, 'w') as f:
+                json.dump(metadata, f, indent=2)
+            os.replace(temp_file, self.metadata_file)
+    
+    def _save_dataset_metadata(self, dataset_name, dataset_info):
+        """Save dataset metadata"""
+        self._update_metadata(dataset_name, lambda entry: {
             **dataset_info,
-            'downloaded_at': str(Path.ctime(self.datasets_dir / dataset_name))
-        }
-        
-        with open(self.metadata_file, 'w') as f:
-            json.dump(metadata, f, indent=2)
+            'downloaded_at': datetime.fromtimestamp(os.path.getctime(self.datasets_dir / dataset_name)).isoformat()
+        })
+    
+    def create_importer(self, dataset_name):
+        """Importer extracting an archive stream into a dataset (see dataset_import.py)"""
+        if not dataset_name or not DATASET_NAME.match(dataset_name):
+            raise ValueError(f"Invalid dataset name: {dataset_name}")
+        return self._importer(self.datasets_dir / dataset_name)
+    
+    def _importer(self, dataset_path):
+        """Archive importer into a directory, with the configured limits"""
+        return ArchiveImporter(
+            dataset_path,
+            max_bytes=config.DATASET_IMPORT_MAX_MB * 1024 * 1024,
+            max_file_bytes=config.DATASET_IMPORT_MAX_FILE_MB * 1024 * 1024,
+            max_files=config.DATASET_IMPORT_MAX_FILES
+        )
+    
+    def record_import(self, importer):
+        """Save metadata of an imported dataset"""
+        dataset_name = importer.dataset_path.name
+        self._save_dataset_metadata(dataset_name, {
+            "id": dataset_name,
+            "name": dataset_name,
+            "source": "local",
+            "image_count": importer.files
+        })
     
     def import_local_dataset(self, file):
-        """Import local dataset from zip file"""
-        import tempfile
+        """Import local dataset from an archive, extracting it as it is read"""
+        dataset_name = file.filename.split('.')[0]
+        importer = self.create_importer(dataset_name)
+        for _ in importer.extract(file.stream):
+            pass
+        self.record_import(importer)
         
-        # Create temporary directory
-        with tempfile.TemporaryDirectory() as temp_dir:
-            zip_path = Path(temp_dir) / file.filename
-            file.save(str(zip_path))
-            
-            # Extract and move to datasets directory
-            dataset_name = file.filename.split('.')[0]
-            dataset_path = self.datasets_dir / dataset_name
-            
-            with ZipFile(str(zip_path), 'r') as zf:
-                zf.extractall(str(dataset_path))
-        
-        return str(dataset_path)
+        return str(importer.dataset_path)
     
-    def get_dataset_info(self, dataset_name):
-        """Get info about downloaded dataset"""
+    def _scan_inventory(self, dataset_path):
+        """Counts and sizes of a dataset tree, in one scandir pass"""
+        people_count = 0
+        image_count = 0
+        size = 0
+        # Directory mtimes, to tell later whether anything was added or removed
+        dirs = {}
+        stack = [('', dataset_path)]
+        while stack:
+            relative, path = stack.pop()
+            dirs[relative] = os.stat(path).st_mtime_ns
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not relative:
+                            people_count += 1
+                        stack.append((f"{relative}/{entry.name}" if relative else entry.name, entry.path))
+                    elif entry.is_file(follow_symlinks=False):
+                        size += entry.stat(follow_symlinks=False).st_size
+                        if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                            image_count += 1
+        return {
+            'people_count': people_count,
+            'image_count': image_count,
+            'size_bytes': size,
+            'dirs': dirs
+        }
+    
+    def _inventory_current(self, dataset_path, inventory):
+        """Whether no directory of the dataset changed since it was scanned"""
+        root = str(dataset_path)
+        for relative, mtime in inventory.get('dirs', {}).items():
+            try:
+                if os.stat(os.path.join(root, relative)).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return bool(inventory.get('dirs'))
+    
+    def get_dataset_info(self, dataset_name, refresh=False):
+        """
+        Get info about downloaded dataset. Counts come from the inventory
+        cached in metadata.json while no directory of the dataset has
+        changed; otherwise (or with refresh) the tree is scanned again.
+        """
         dataset_path = self.datasets_dir / dataset_name
         
-        if not dataset_path.exists():
+        if not DATASET_NAME.match(dataset_name) or not dataset_path.is_dir():
             return None
         
-        # Count directories (people)
-        people_count = len([d for d in dataset_path.iterdir() if d.is_dir()])
-        
-        # Count images
-        image_count = len(list(dataset_path.rglob('*.jpg'))) + \
-                     len(list(dataset_path.rglob('*.png')))
+        inventory = self._load_metadata().get(dataset_name, {}).get('inventory')
+        if refresh or inventory is None or not self._inventory_current(dataset_path, inventory):
+            inventory = self._scan_inventory(dataset_path)
+            self._update_metadata(dataset_name, lambda entry: {**entry, 'inventory': inventory})
         
         return {
             'name': dataset_name,
             'path': str(dataset_path),
-            'people_count': people_count,
-            'image_count': image_count,
-            'size_mb': round(sum(f.stat().st_size for f in dataset_path.rglob('*')) / (1024 * 1024), 2)
+            'people_count': inventory['people_count'],
+            'image_count': inventory['image_count'],
+            'size_mb': round(inventory['size_bytes'] / (1024 * 1024), 2)
         }
+    
+    def list_datasets(self):
+        """Info about every downloaded dataset"""
+        with os.scandir(self.datasets_dir) as entries:
+            names = sorted(entry.name for entry in entries
+                           if entry.is_dir() and DATASET_NAME.match(entry.name))
+        return [info for info in map(self.get_dataset_info, names) if info is not None]
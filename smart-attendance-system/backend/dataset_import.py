@@ -0,0 +1,295 @@
+"""
+Dataset Import
+Extracts a dataset archive (zip, tar, tar.gz, tar.bz2, tar.xz) while it is
+being received: members are read from the stream one after another and
+written straight to the dataset directory, so the archive itself is never
+stored and nothing waits for the upload to finish.
+
+Only images are extracted, as <dataset>/<person>/<file> where <person> is
+the folder holding the image in the archive. Member names are sanitized
+(no absolute paths, no "..", no hidden files, no links or devices), and
+the total extracted size, the size of each image and the number of files
+are limited.
+"""
+
+import shutil
+import struct
+import tarfile
+import zlib
+from pathlib import PurePosixPath
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+CHUNK_SIZE = 64 * 1024
+
+_ZIP_LOCAL = b'PK\x03\x04'
+_ZIP_DESCRIPTOR = b'PK\x07\x08'
+# Central directory, zip64 end records and end of central directory:
+# every member has been read by then
+_ZIP_END = (b'PK\x01\x02', b'PK\x06\x06', b'PK\x06\x07', b'PK\x05\x06')
+_ZIP_HEADER = struct.Struct('<HHHHHIIIHH')
+
+class _StreamReader:
+    """Reads exact byte counts from a stream, with push-back"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._buffer = b''
+
+    def read(self, size):
+        """Up to `size` bytes; b'' at the end of the stream"""
+        if self._buffer:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+            return data
+        return self.stream.read(size)
+
+    def read_exact(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.read(size - len(data))
+            if not chunk:
+                raise ValueError("Archive is truncated")
+            data += chunk
+        return data
+
+    def unread(self, data):
+        self._buffer = data + self._buffer
+
+    def drain(self):
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+def _zip64_sizes(extra, compressed, uncompressed):
+    """Sizes from the zip64 extra field, for sizes stored as 0xFFFFFFFF"""
+    position = 0
+    while position + 4 <= len(extra):
+        tag, length = struct.unpack_from('<HH', extra, position)
+        if tag == 0x0001:
+            values = extra[position + 4:position + 4 + length]
+            offset = 0
+            if uncompressed == 0xFFFFFFFF:
+                uncompressed, = struct.unpack_from('<Q', values, offset)
+                offset += 8
+            if compressed == 0xFFFFFFFF:
+                compressed, = struct.unpack_from('<Q', values, offset)
+            return compressed, uncompressed, True
+        position += 4 + length
+    return compressed, uncompressed, False
+
+
+def _zip_members(reader):
+    """
+    (name, chunks) for each file of a zip read front to back from its local
+    headers; the central directory at the end is not needed
+    """
+    while True:
+        signature = reader.read_exact(4)
+        if signature in _ZIP_END:
+            reader.drain()
+            return
+        if signature != _ZIP_LOCAL:
+            raise ValueError("Not a zip archive, or the archive is corrupt")
+
+        (_, flags, method, _, _, crc, compressed, uncompressed,
+         name_length, extra_length) = _ZIP_HEADER.unpack(reader.read_exact(_ZIP_HEADER.size))
+        raw_name = reader.read_exact(name_length)
+        extra = reader.read_exact(extra_length)
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437', errors='replace')
+        compressed, uncompressed, zip64 = _zip64_sizes(extra, compressed, uncompressed)
+        has_descriptor = bool(flags & 0x08)
+
+        if flags & 0x01:
+            raise ValueError(f"Encrypted archives are not supported ({name})")
+        if method not in (0, 8):
+            if has_descriptor:
+                raise ValueError(f"Unsupported compression method {method} ({name})")
+            # Skipped without reading, its size is known
+            while compressed > 0:
+                compressed -= len(reader.read_exact(min(compressed, CHUNK_SIZE)))
+            continue
+        if method == 0 and has_descriptor:
+            raise ValueError(f"Stored entries without sizes are not supported ({name}), re-create the archive")
+
+        if method == 0:
+            chunks = _stored_chunks(reader, compressed)
+        else:
+            chunks = _deflated_chunks(reader, None if has_descriptor else compressed)
+        member = _checked_chunks(reader, name, chunks, crc, has_descriptor, zip64)
+
+        yield name, member
+        # Whatever the consumer did not read
+        for _ in member:
+            pass
+
+
+def _stored_chunks(reader, size):
+    while size > 0:
+        data = reader.read_exact(min(size, CHUNK_SIZE))
+        size -= len(data)
+        yield data
+
+
+def _deflated_chunks(reader, size):
+    """Inflate a member; with size None, until the deflate stream ends"""
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    while not inflater.eof:
+        read_size = CHUNK_SIZE if size is None else min(size, CHUNK_SIZE)
+        data = reader.read(read_size) if read_size else b''
+        if not data:
+            raise ValueError("Archive is truncated")
+        if size is not None:
+            size -= len(data)
+        # Bounded output, so a small member cannot inflate to gigabytes at once
+        output = inflater.decompress(data, CHUNK_SIZE)
+        while True:
+            if output:
+                yield output
+            if not inflater.unconsumed_tail:
+                break
+            output = inflater.decompress(inflater.unconsumed_tail, CHUNK_SIZE)
+    reader.unread(inflater.unused_data)
+
+
+def _checked_chunks(reader, name, chunks, crc, has_descriptor, zip64):
+    """
+    Pass a member's chunks through, then check its checksum before the
+    last chunk is handed over, so a corrupt member is never written whole
+    """
+    checksum = 0
+    previous = None
+    for chunk in chunks:
+        checksum = zlib.crc32(chunk, checksum)
+        if previous is not None:
+            yield previous
+        previous = chunk
+
+    if has_descriptor:
+        descriptor = reader.read_exact(4)
+        if descriptor == _ZIP_DESCRIPTOR:
+            descriptor = reader.read_exact(4)
+        crc, = struct.unpack('<I', descriptor)
+        reader.read_exact(16 if zip64 else 8)
+    if checksum != crc:
+        raise ValueError(f"Checksum mismatch in archive ({name})")
+    if previous is not None:
+        yield previous
+
+
+def _tar_members(reader):
+    """(name, chunks) for each regular file of a (compressed) tar stream"""
+    try:
+        with tarfile.open(fileobj=reader, mode='r|*') as archive:
+            for member in archive:
+                # Links, devices and directories are never extracted
+                if not member.isfile():
+                    continue
+                source = archive.extractfile(member)
+                yield member.name, iter(lambda: source.read(CHUNK_SIZE), b'')
+    except (tarfile.TarError, EOFError) as e:
+        raise ValueError(f"Not a zip or tar archive, or the archive is corrupt ({str(e)})")
+
+
+def archive_members(stream):
+    """(name, chunks) for each file of a zip or tar archive read from a stream"""
+    reader = _StreamReader(stream)
+    # A whole block: tarfile detects the compression (bz2 and xz magic
+    # numbers are longer than a zip signature) from a single first read
+    head = b''
+    while len(head) < tarfile.BLOCKSIZE:
+        chunk = reader.read(tarfile.BLOCKSIZE - len(head))
+        if not chunk:
+            break
+        head += chunk
+    reader.unread(head)
+    if not head:
+        raise ValueError("Archive is empty")
+    if head[:4] == _ZIP_LOCAL or head[:4] in _ZIP_END:
+        return _zip_members(reader)
+    return _tar_members(reader)
+
+
+def image_destination(member_name):
+    """
+    (person, file name) for an image member of an archive, or None when the
+    member is not an image in a person folder or its name is unsafe
+    """
+    parts = [part for part in PurePosixPath(member_name.replace('\\', '/')).parts
+             if part not in ('', '.', '/')]
+    if len(parts) < 2 or '..' in parts:
+        return None
+    if any(part.startswith('.') or part == '__MACOSX' for part in parts):
+        return None
+    person, file_name = parts[-2], parts[-1]
+    if '\0' in member_name or not file_name.lower().endswith(IMAGE_EXTENSIONS):
+        return None
+    return person, file_name
+
+
+class ArchiveImporter:
+    """Extracts the images of one archive stream into a dataset directory"""
+
+    def __init__(self, dataset_path, max_bytes, max_file_bytes, max_files):
+        self.dataset_path = dataset_path
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.files = 0
+        self.bytes = 0
+        self.skipped = 0
+
+    def extract(self, stream):
+        """
+        Extract images as they arrive; yields (person, image path, image
+        bytes) for each one written. Raises ValueError for a corrupt
+        archive or one past the limits; images written so far are kept.
+        """
+        created = not self.dataset_path.exists()
+        self.dataset_path.mkdir(exist_ok=True)
+        try:
+            yield from self._extract(stream)
+        except Exception:
+            # Nothing worth keeping from an archive that failed straight away
+            if created and self.files == 0:
+                shutil.rmtree(self.dataset_path, ignore_errors=True)
+            raise
+
+    def _extract(self, stream):
+        root = self.dataset_path.resolve()
+        for name, chunks in archive_members(stream):
+            if name.endswith('/'):
+                continue
+            destination = image_destination(name)
+            data = self._read(chunks, destination is not None)
+            if destination is None or data is None:
+                self.skipped += 1
+                continue
+
+            if self.files >= self.max_files:
+                raise ValueError(f"Archive has more than {self.max_files} images")
+            person, file_name = destination
+            person_dir = self.dataset_path / person
+            person_dir.mkdir(exist_ok=True)
+            image_path = person_dir / file_name
+            if image_path.resolve().parent.parent != root:
+                self.skipped += 1
+                continue
+            with open(image_path, 'wb') as f:
+                f.write(data)
+            self.files += 1
+            yield person, image_path, data
+
+    def _read(self, chunks, keep):
+        """Member contents (None when skipped or too large), counted against the limits"""
+        parts = []
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            self.bytes += len(chunk)
+            if self.bytes > self.max_bytes:
+                raise ValueError(f"Archive expands to more than {self.max_bytes // (1024 * 1024)} MB")
+            if keep and size <= self.max_file_bytes:
+                parts.append(chunk)
+            else:
+                keep = False
+        return b''.join(parts) if keep else None
@@ -0,0 +1,116 @@
+"""
+Encoding Cache
+Content-addressed cache of enrollment encodings: the hash of an image's
+bytes maps to its encoding (or to "no face"), so an image that was seen
+before, under any file name, is not encoded again. Entries are evicted
+least recently used first, and the cache is saved under the models
+directory (models/encoding_cache.npz).
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+def content_key(image_data):
+    """Cache key of an image: a hash of its bytes"""
+    return hashlib.blake2b(image_data, digest_size=16).digest()
+
+
+class EncodingCache:
+    """Size-bounded LRU map of content key -> encoding (None: no face)"""
+
+    def __init__(self, path, max_entries, mode):
+        self.path = path
+        self.max_entries = max_entries
+        # Encodings of one mode (dlib or histogram) are useless in the other
+        self.mode = mode
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """(True, encoding or None) for a cached image, (False, None) otherwise"""
+        if self.max_entries <= 0:
+            return False, None
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, self._entries[key]
+
+    def put(self, key, encoding):
+        """Remember the encoding of an image (None when it has no face)"""
+        if self.max_entries <= 0:
+            return
+        if encoding is not None:
+            encoding = np.asarray(encoding, dtype=np.float32)
+        with self._lock:
+            self._entries[key] = encoding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def _load(self):
+        """Read the saved cache; a missing, stale or unreadable file starts empty"""
+        if self.max_entries <= 0 or not self.path.exists():
+            return
+        try:
+            with np.load(str(self.path)) as data:
+                if str(data['mode']) != self.mode:
+                    return
+                keys = data['keys']
+                encodings = data['encodings']
+                has_face = data['has_face']
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Note: ignoring unreadable encoding cache: {str(e)}")
+            return
+
+        # Saved oldest first, so the most recently used entries are kept
+        start = max(0, len(keys) - self.max_entries)
+        for key, encoding, face in zip(keys[start:], encodings[start:], has_face[start:]):
+            self._entries[key.tobytes()] = encoding if face else None
+
+    def save(self):
+        """Write the cache if it changed since the last save"""
+        with self._save_lock:
+            self._write()
+
+    def _write(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = list(self._entries.items())
+            self._dirty = False
+
+        dim = next((len(e) for _, e in entries if e is not None), 0)
+        # Raw bytes: fixed-width byte strings would lose trailing zero bytes
+        keys = np.frombuffer(b''.join(key for key, _ in entries), dtype=np.uint8).reshape(len(entries), 16)
+        encodings = np.zeros((len(entries), dim), dtype=np.float32)
+        has_face = np.zeros(len(entries), dtype=bool)
+        for row, (_, encoding) in enumerate(entries):
+            if encoding is not None:
+                encodings[row] = encoding
+                has_face[row] = True
+
+        temp_file = self.path.with_suffix('.tmp')
+        try:
+            with open(temp_file, 'wb') as f:
+                np.savez(f, mode=self.mode, keys=keys, encodings=encodings, has_face=has_face)
+            os.replace(temp_file, self.path)
+        except OSError:
+            with self._lock:
+                self._dirty = True
+            raise
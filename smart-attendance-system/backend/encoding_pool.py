@@ -0,0 +1,115 @@
+"""
+Encoding Pool
+Runs frame decoding, face detection and encoding (CPU-bound and holding the
+GIL for long stretches under dlib) in a pool of worker processes, so one
+server uses every core.
+
+Workers only turn frames into encodings; matching stays in the server
+process, against its single memory-mapped gallery, so nothing needs to be
+copied to the workers when persons are enrolled. Requests beyond the pool
+size plus ENCODE_QUEUE_SIZE are refused with PoolBusy rather than queued
+without bound.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from face_encoder import FaceEncoder
+from face_quality import FaceRejected
+
+class PoolBusy(RuntimeError):
+    """Every worker and queue slot is taken"""
+
+
+_encoder = None
+
+def _init_worker():
+    """Build and warm the worker's encoder once, when the process starts"""
+    global _encoder
+    _encoder = FaceEncoder()
+    _encoder.warmup()
+
+def _process(image_data, width, height, first):
+    return _encoder.process(image_data, width, height, first)
+
+def encode_file(path):
+    """
+    Worker task: (enrollment encoding or None, error message or None,
+    quality rejection reason or None)
+    """
+    try:
+        return _encoder.encode_file(path), None, None
+    except FaceRejected as e:
+        return None, str(e), e.reason
+    except Exception as e:
+        return None, str(e), None
+
+def worker_executor(workers):
+    """Process pool whose workers each hold a FaceEncoder"""
+    # spawn: forking a server that already runs threads is unsafe
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker
+    )
+
+
+class EncodingPool:
+    """Worker processes behind a bounded number of in-flight frames"""
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self._executor = worker_executor(workers)
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._in_flight = 0
+        self._count_lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def submit_many(self, frames, first=False):
+        """
+        Queue (image_data, width, height) frames; returns one future per
+        frame resolving to (boxes, encodings, rejected, timings) as
+        returned by FaceEncoder.process. Raises PoolBusy,
+        without queueing any of them, when there is no room for all.
+        """
+        taken = 0
+        for _ in frames:
+            if not self._slots.acquire(blocking=False):
+                for _ in range(taken):
+                    self._slots.release()
+                raise PoolBusy("Encoding workers are busy, retry shortly")
+            taken += 1
+
+        futures = []
+        try:
+            for image_data, width, height in frames:
+                future = self._executor.submit(_process, image_data, width, height, first)
+                self._track(1)
+                future.add_done_callback(self._release)
+                futures.append(future)
+                taken -= 1
+        finally:
+            for _ in range(taken):
+                self._slots.release()
+        return futures
+
+    def run(self, image_data, width=None, height=None, first=False):
+        """Encode one frame in a worker and wait for it"""
+        return self.submit_many([(image_data, width, height)], first)[0].result()
+
+    def _track(self, delta):
+        with self._count_lock:
+            self._in_flight += delta
+
+    def _release(self, future):
+        self._track(-1)
+        self._slots.release()
+
+    def close(self):
+        """Stop the workers"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,88 @@
+"""
+Event Stream
+Fan-out of attendance events to live subscribers (server-sent events)
+"""
+
+import json
+import queue
+import threading
+
+class Subscription:
+    """One subscriber's bounded event buffer"""
+
+    def __init__(self, buffer_size, on_push=None):
+        self.events = queue.Queue(maxsize=buffer_size)
+        self.overflowed = False
+        # Called after each push, e.g. to wake an event loop waiting for events
+        self.on_push = on_push
+
+    def push(self, event):
+        """Queue an event without blocking; drops the oldest one when full"""
+        while True:
+            try:
+                self.events.put_nowait(event)
+                break
+            except queue.Full:
+                try:
+                    self.events.get_nowait()
+                    self.overflowed = True
+                except queue.Empty:
+                    pass
+        if self.on_push is not None:
+            self.on_push()
+
+    def get(self, timeout):
+        """Next event, or None after `timeout` seconds"""
+        try:
+            event = self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if self.overflowed:
+            # Events were dropped: tell the client to refetch current state
+            self.overflowed = False
+            return ('resync', {})
+        return event
+
+
+class EventBroadcaster:
+    """
+    Publishes events to every subscriber. Publishing never blocks: each
+    subscriber has a bounded buffer, and a slow client loses its oldest
+    events (and is sent a 'resync') instead of holding up the publisher.
+    """
+
+    def __init__(self, buffer_size=100, max_subscribers=100):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, on_push=None):
+        """Register a new subscriber"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise RuntimeError("Too many event stream subscribers")
+            subscription = Subscription(self.buffer_size, on_push)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscriber"""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event_type, data):
+        """Send an event to every subscriber"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push((event_type, data))
+
+
+def format_sse(event_type, data):
+    """Encode one server-sent event"""
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
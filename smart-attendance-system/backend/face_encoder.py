@@ -0,0 +1,302 @@
+"""
+Face Encoder
+Decoding, face detection and encoding of frames. Holds no gallery state, so
+it runs the same in the server and in encoding worker processes
+(see encoding_pool.py).
+
+OpenCV, Pillow and face_recognition (which loads dlib's models when
+imported) are imported on first use, and the Haar cascade is loaded on
+first use, so importing this module is cheap; warmup() loads them all ahead
+of the first frame.
+"""
+
+import importlib.util
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+
+from face_quality import QualityGate, FaceRejected
+from timing import elapsed_ms
+
+# face_recognition when installed, fallback to OpenCV-only mode; found
+# without importing it
+FACE_RECOGNITION_AVAILABLE = importlib.util.find_spec("face_recognition") is not None
+if not FACE_RECOGNITION_AVAILABLE:
+    print("Note: face_recognition not available. Using OpenCV face detection only.")
+
+# What encode_file() produces in this mode, so that encodings cached in
+# another mode (or by an older encoder) are not reused
+ENCODING_MODE = 'dlib' if FACE_RECOGNITION_AVAILABLE else 'face-histogram'
+
+# Blank frame encoded by warmup()
+_WARMUP_SIZE = 64
+
+class FaceEncoder:
+    """Turns frames into face boxes and encodings"""
+
+    def __init__(self):
+        self._cascade = None
+        self._cascade_lock = threading.Lock()
+        # Faces that will not match reliably are rejected before encoding
+        self.quality = QualityGate()
+
+    @property
+    def face_cascade(self):
+        """OpenCV face detector cascade, loaded on first use"""
+        if self._cascade is None:
+            with self._cascade_lock:
+                if self._cascade is None:
+                    import cv2
+                    self._cascade = cv2.CascadeClassifier(
+                        cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+                    )
+        return self._cascade
+
+    def warmup(self, timings=None):
+        """
+        Import the libraries, load the detector and models, and encode one
+        blank frame, so the first request does not wait for them. Stage
+        times in ms go in `timings` when given.
+        """
+        start = time.perf_counter()
+        import cv2
+        from PIL import Image
+        if FACE_RECOGNITION_AVAILABLE:
+            # Loads dlib's detector, landmark and encoding models
+            import face_recognition
+        if timings is not None:
+            timings['libraries_ms'] = elapsed_ms(start)
+
+        start = time.perf_counter()
+        if not FACE_RECOGNITION_AVAILABLE:
+            self.face_cascade
+        if timings is not None:
+            timings['detector_ms'] = elapsed_ms(start)
+
+        start = time.perf_counter()
+        shape = (_WARMUP_SIZE, _WARMUP_SIZE, 3) if FACE_RECOGNITION_AVAILABLE else (_WARMUP_SIZE, _WARMUP_SIZE)
+        image = np.zeros(shape, dtype=np.uint8)
+        self.detect(image)
+        self.encode_boxes(image, [(0, _WARMUP_SIZE - 1, _WARMUP_SIZE - 1, 0)])
+        if timings is not None:
+            timings['encode_ms'] = elapsed_ms(start)
+
+    def decode_bytes(self, image_data, timings=None):
+        """
+        Decode encoded image bytes (JPEG, PNG, ...) once, straight into the
+        layout the detector uses: RGB for dlib, grayscale for the cascade
+        """
+        start = time.perf_counter()
+        if FACE_RECOGNITION_AVAILABLE:
+            # PIL decodes to RGB, which is what dlib expects
+            from PIL import Image
+            image = np.asarray(Image.open(BytesIO(image_data)).convert('RGB'))
+        else:
+            # The cascade only needs luminance, which JPEG decodes to directly
+            import cv2
+            image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                raise ValueError("Could not decode image")
+        if timings is not None:
+            timings['decode_ms'] = elapsed_ms(start)
+            timings['convert_ms'] = 0.0
+        return image
+
+    def decode_raw(self, image_data, width, height, timings=None):
+        """Wrap packed 8-bit RGB pixels (height x width x 3) without copying"""
+        if width <= 0 or height <= 0 or len(image_data) != width * height * 3:
+            raise ValueError(f"Expected {width}x{height} RGB frame ({width * height * 3} bytes), got {len(image_data)} bytes")
+
+        start = time.perf_counter()
+        image = np.frombuffer(image_data, np.uint8).reshape(height, width, 3)
+        if timings is not None:
+            timings['decode_ms'] = elapsed_ms(start)
+
+        start = time.perf_counter()
+        if not FACE_RECOGNITION_AVAILABLE:
+            import cv2
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        if timings is not None:
+            timings['convert_ms'] = elapsed_ms(start)
+        return image
+
+    def decode_frame(self, image_data, width=None, height=None, timings=None):
+        """Decode a binary frame: packed RGB when width and height are given"""
+        if width is not None and height is not None:
+            return self.decode_raw(image_data, width, height, timings)
+        return self.decode_bytes(image_data, timings)
+
+    def detect(self, image):
+        """Face boxes as (top, right, bottom, left)"""
+        if FACE_RECOGNITION_AVAILABLE:
+            import face_recognition
+            return list(face_recognition.face_locations(image))
+
+        faces = self.face_cascade.detectMultiScale(image, 1.3, 5)
+        return [(int(y), int(x + w), int(y + h), int(x)) for (x, y, w, h) in faces]
+
+    def encode_boxes(self, image, boxes):
+        """Encodings of faces at known boxes, without detecting again"""
+        if not boxes:
+            return []
+        if FACE_RECOGNITION_AVAILABLE:
+            import face_recognition
+            return face_recognition.face_encodings(image, boxes)
+
+        # Fallback: histogram of each face region (enrollment and queries alike)
+        import cv2
+        encodings = []
+        for top, right, bottom, left in boxes:
+            hist = cv2.calcHist([image[top:bottom, left:right]], [0], None, [256], [0, 256])
+            encodings.append(cv2.normalize(hist, hist).flatten())
+        return encodings
+
+    def encode_all(self, image):
+        """Detect all faces; return boxes as (top, right, bottom, left) and encodings"""
+        boxes = self.detect(image)
+        return boxes, self.encode_boxes(image, boxes)
+
+    def _landmarks(self, image, box):
+        """Function returning the landmarks of the face at box, or None without face_recognition"""
+        if not FACE_RECOGNITION_AVAILABLE:
+            return None
+        import face_recognition
+
+        def landmarks():
+            found = face_recognition.face_landmarks(image, [box], model='small')
+            return found[0] if found else None
+        return landmarks
+
+    def check_quality(self, image, box, timings=None):
+        """Raise FaceRejected when the face at box is too poor to encode (see face_quality.py)"""
+        if not self.quality.enabled:
+            return
+        start = time.perf_counter()
+        try:
+            self.quality.check(image, box, self._landmarks(image, box))
+        finally:
+            if timings is not None:
+                timings['quality_ms'] = elapsed_ms(start)
+
+    def check_boxes(self, image, boxes, timings=None):
+        """
+        Split face boxes into those that pass the quality checks and
+        [(box, FaceRejected)] for the rest, which should not be encoded
+        """
+        if not self.quality.enabled or not boxes:
+            return boxes, []
+        start = time.perf_counter()
+        passed = []
+        rejected = []
+        for box in boxes:
+            try:
+                self.quality.check(image, box, self._landmarks(image, box))
+            except FaceRejected as e:
+                rejected.append((box, e))
+            else:
+                passed.append(box)
+        if timings is not None:
+            timings['quality_ms'] = elapsed_ms(start)
+        return passed, rejected
+
+    def encode_first(self, image, timings=None):
+        """
+        Encoding used to recognize a single face, or None without a face.
+        Raises FaceRejected when that face fails the quality checks.
+        Stage times and the number of faces found go in `timings` when given.
+        """
+        if FACE_RECOGNITION_AVAILABLE:
+            import face_recognition
+            try:
+                # Find faces using face_recognition; only the first is encoded
+                start = time.perf_counter()
+                face_locations = face_recognition.face_locations(image)
+                if timings is not None:
+                    timings['detect_ms'] = elapsed_ms(start)
+                    timings['faces'] = len(face_locations)
+                if not face_locations:
+                    return None
+                self.check_quality(image, face_locations[0], timings)
+                start = time.perf_counter()
+                face_encodings = face_recognition.face_encodings(image, face_locations[:1])
+                if timings is not None:
+                    timings['encode_ms'] = elapsed_ms(start)
+                return face_encodings[0] if face_encodings else None
+            except FaceRejected:
+                raise
+            except Exception as e:
+                print(f"Error in face recognition: {str(e)}")
+                return None
+
+        # Fallback to OpenCV detection
+        start = time.perf_counter()
+        faces = self.face_cascade.detectMultiScale(image, 1.3, 5)
+        if timings is not None:
+            timings['detect_ms'] = elapsed_ms(start)
+            timings['faces'] = len(faces)
+        if len(faces) == 0:
+            return None
+        x, y, w, h = (int(v) for v in faces[0])
+        box = (y, x + w, y + h, x)
+        self.check_quality(image, box, timings)
+
+        start = time.perf_counter()
+        encoding = self.encode_boxes(image, [box])[0]
+        if timings is not None:
+            timings['encode_ms'] = elapsed_ms(start)
+        return encoding
+
+    def encode_file(self, path):
+        """
+        Enrollment encoding of an image file, or None when it has no face.
+        Raises FaceRejected when the face fails the quality checks.
+        """
+        if FACE_RECOGNITION_AVAILABLE:
+            import face_recognition
+            image = face_recognition.load_image_file(str(path))
+            face_locations = face_recognition.face_locations(image)
+            if not face_locations:
+                return None
+            self.check_quality(image, face_locations[0])
+            face_encodings = face_recognition.face_encodings(image, face_locations[:1])
+            return face_encodings[0] if face_encodings else None
+
+        # Fallback to OpenCV detection
+        import cv2
+        gray = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError("Could not read image")
+        faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
+        if len(faces) == 0:
+            return None
+        x, y, w, h = (int(v) for v in faces[0])
+        box = (y, x + w, y + h, x)
+        self.check_quality(gray, box)
+        return self.encode_boxes(gray, [box])[0]
+
+    def process(self, image_data, width=None, height=None, first=False):
+        """
+        Decode one frame and encode its faces. Returns (boxes, encodings,
+        rejected, per-stage timings in ms): boxes and encodings of the faces
+        that passed the quality checks, and [(box, FaceRejected)] of those
+        that did not. With first=True, only the encoding used for
+        single-face recognition (boxes empty, and the number of faces found
+        in timings['faces']); a poor first face raises FaceRejected.
+        """
+        timings = {}
+        image = self.decode_frame(image_data, width, height, timings)
+
+        if first:
+            encoding = self.encode_first(image, timings)
+            return [], ([] if encoding is None else [encoding]), [], timings
+
+        start = time.perf_counter()
+        boxes = self.detect(image)
+        timings['detect_ms'] = elapsed_ms(start)
+        boxes, rejected = self.check_boxes(image, boxes, timings)
+        start = time.perf_counter()
+        encodings = self.encode_boxes(image, boxes)
+        timings['encode_ms'] = elapsed_ms(start)
+        return boxes, encodings, rejected, timings
@@ -0,0 +1,228 @@
+"""
+Face Index
+Pluggable nearest-neighbour indexes over a FaceGallery
+"""
+
+import numpy as np
+
+class FlatIndex:
+    """Exact brute-force search over every gallery row"""
+
+    kind = 'flat'
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+
+    def build(self):
+        """Nothing to precompute for exact search"""
+        return self
+
+    def add(self, start, end):
+        """Gallery rows [start, end) were appended; exact search sees them already"""
+
+    def search(self, encoding):
+        """Return (row index, distance) of the nearest gallery row"""
+        return self.gallery.search(encoding)
+
+    def search_batch(self, encodings):
+        """Nearest row for each encoding, in one matrix-matrix product"""
+        return self.gallery.search_batch(encodings)
+
+    def save(self, path, generation=0):
+        """Persist the index"""
+        np.savez(str(path), kind=self.kind, rows=len(self.gallery), generation=generation)
+
+    def _load(self, data):
+        """Restore state from a saved index file"""
+        return self
+
+
+class IVFIndex:
+    """
+    Inverted-file index: rows are clustered with k-means and a query only
+    scans the rows of the nprobe clusters whose centroids are closest.
+    Approximate; raise nprobe for recall, lower it for latency.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, gallery, nlist=0, nprobe=8, iterations=10, seed=0):
+        self.gallery = gallery
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = np.empty((0, 0), dtype=np.float32)
+        self.lists = []
+
+    def build(self):
+        """Cluster the gallery rows and fill the inverted lists"""
+        data = self.gallery.matrix
+        count = len(self.gallery)
+        if count == 0:
+            self.centroids = np.empty((0, 0), dtype=np.float32)
+            self.lists = []
+            return self
+
+        nlist = self.nlist or int(np.sqrt(count))
+        nlist = max(1, min(nlist, count))
+        rng = np.random.default_rng(self.seed)
+
+        # Train centroids on a bounded sample to keep build time predictable
+        sample_size = min(count, nlist * 256)
+        sample = data[rng.choice(count, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(self.iterations):
+            assign = self._nearest_centroids(sample, centroids, 1)[:, 0]
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        assign = self._nearest_centroids(data, self.centroids, 1)[:, 0]
+        order = np.argsort(assign, kind='stable').astype(np.int32)
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(nlist)]
+        return self
+
+    def add(self, start, end):
+        """Assign newly appended gallery rows [start, end) to their nearest clusters"""
+        if not self.lists:
+            self.build()
+            return
+        rows = np.arange(start, end, dtype=np.int32)
+        assign = self._nearest_centroids(self.gallery.matrix[start:end], self.centroids, 1)[:, 0]
+        for cluster in np.unique(assign):
+            self.lists[cluster] = np.concatenate([self.lists[cluster], rows[assign == cluster]])
+
+    @staticmethod
+    def _nearest_centroids(points, centroids, k):
+        """Indices of the k nearest centroids (squared L2) for each point"""
+        c_sq = np.einsum('ij,ij->i', centroids, centroids)
+        scores = c_sq[None, :] - 2.0 * (points @ centroids.T)
+        if k >= centroids.shape[0]:
+            return np.argsort(scores, axis=1)
+        return np.argpartition(scores, k - 1, axis=1)[:, :k]
+
+    def search(self, encoding):
+        """Return (row index, distance) of the nearest row in the probed clusters"""
+        if not self.lists:
+            return None, None
+        query = self.gallery._prepare_query(encoding)
+        probes = self._nearest_centroids(query[None, :], self.centroids, self.nprobe)[0]
+        rows = np.concatenate([self.lists[p] for p in probes])
+        if rows.size == 0:
+            return None, None
+        dists = self.gallery.distances(encoding, rows)
+        best = int(np.argmin(dists))
+        if not np.isfinite(dists[best]):
+            # Every probed row belongs to a removed person
+            return None, None
+        return int(rows[best]), float(dists[best])
+
+    def search_batch(self, encodings):
+        """
+        Nearest row for each encoding; each query probes its own clusters.
+        Centroid distances of all queries are one matrix product, then each
+        probed list is scored against every query probing it in one product.
+        """
+        count = len(encodings)
+        if not self.lists or count == 0:
+            return [None] * count, [None] * count
+        if count == 1:
+            row, dist = self.search(encodings[0])
+            return [row], [dist]
+        queries = np.asarray(encodings, dtype=np.float32).reshape(count, -1)
+        prepared = queries
+        if self.gallery.metric == 'cosine':
+            # Centroids are trained on normalized rows, as in _prepare_query
+            prepared = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-10)
+        probes = self._nearest_centroids(prepared, self.centroids, self.nprobe)
+
+        # (query, cluster) pairs grouped by cluster
+        pair_clusters = probes.ravel()
+        order = np.argsort(pair_clusters, kind='stable')
+        pair_queries = np.repeat(np.arange(count), probes.shape[1])[order]
+        clusters, starts = np.unique(pair_clusters[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+
+        best_rows = np.zeros(count, dtype=np.int64)
+        best_dists = np.full(count, np.inf)
+        for cluster, start, end in zip(clusters, starts, ends):
+            members = self.lists[cluster]
+            if members.size == 0:
+                continue
+            probing = pair_queries[start:end]
+            dists = self.gallery.distances_batch(queries[probing], members)
+            nearest = np.argmin(dists, axis=1)
+            nearest_dists = dists[np.arange(len(probing)), nearest]
+            better = nearest_dists < best_dists[probing]
+            best_rows[probing[better]] = members[nearest[better]]
+            best_dists[probing[better]] = nearest_dists[better]
+
+        # Queries whose probed lists only hold removed rows match nothing
+        found = np.isfinite(best_dists)
+        return (
+            [int(r) if f else None for r, f in zip(best_rows, found)],
+            [float(d) if f else None for d, f in zip(best_dists, found)]
+        )
+
+    def save(self, path, generation=0):
+        """Persist centroids and inverted lists"""
+        lengths = np.array([len(l) for l in self.lists], dtype=np.int64)
+        members = np.concatenate(self.lists) if self.lists else np.empty(0, dtype=np.int32)
+        np.savez(
+            str(path),
+            kind=self.kind,
+            rows=len(self.gallery),
+            generation=generation,
+            nprobe=self.nprobe,
+            centroids=self.centroids,
+            lengths=lengths,
+            members=members
+        )
+
+    def _load(self, data):
+        """Restore state from a saved index file"""
+        self.centroids = data['centroids']
+        self.nlist = self.centroids.shape[0]
+        bounds = np.concatenate([[0], np.cumsum(data['lengths'])])
+        members = data['members'].astype(np.int32)
+        self.lists = [members[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+        return self
+
+
+INDEX_TYPES = {
+    FlatIndex.kind: FlatIndex,
+    IVFIndex.kind: IVFIndex
+}
+
+def create_index(gallery, kind='flat', nlist=0, nprobe=8):
+    """Create an (unbuilt) index of the given kind"""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {kind}")
+    if kind == IVFIndex.kind:
+        return IVFIndex(gallery, nlist=nlist, nprobe=nprobe)
+    return FlatIndex(gallery)
+
+def load_index(path, gallery, generation=0, kind='flat', nlist=0, nprobe=8):
+    """
+    Load a saved index for this gallery generation. Rows appended to the
+    gallery after the index was saved are added to it. Returns None when the
+    file is missing, of another kind, or was built for other gallery data.
+    """
+    try:
+        with np.load(str(path)) as data:
+            rows = int(data['rows'])
+            if (str(data['kind']) != kind or int(data['generation']) != generation
+                    or rows > len(gallery)):
+                return None
+            index = create_index(gallery, kind, nlist, nprobe)._load(data)
+    except (OSError, KeyError, ValueError):
+        return None
+    if rows < len(gallery):
+        index.add(rows, len(gallery))
+    return index
@@ -0,0 +1,107 @@
+"""
+Face Quality
+Cheap checks on a detected face, run before it is encoded: a face that is
+too small, blurred, badly exposed or turned away will not match reliably,
+so it is rejected with a reason instead of spending an encoding on it (and,
+when enrolling, instead of adding a poor encoding to the gallery).
+
+Checks, cheapest first, each disabled by a threshold of 0:
+- size: the shorter side of the face box, in pixels
+- exposure: mean brightness of the face (0-255)
+- sharpness: variance of the Laplacian of the face scaled to SHARPNESS_WIDTH
+  pixels wide, so that the threshold does not depend on the face size
+- pose (face_recognition only): horizontal offset of the nose tip from the
+  midpoint of the eyes, as a fraction of the distance between the eyes;
+  about 0 for a frontal face
+"""
+
+import config
+
+# Faces are scaled to this width before measuring sharpness
+SHARPNESS_WIDTH = 96
+
+class FaceRejected(ValueError):
+    """A detected face too poor to encode"""
+
+    def __init__(self, reason, message):
+        super().__init__(reason, message)
+        self.reason = reason
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class QualityGate:
+    """Pre-encoding quality thresholds (defaults from config)"""
+
+    def __init__(self, min_size=None, min_sharpness=None, min_brightness=None,
+                 max_brightness=None, max_pose=None):
+        self.min_size = min_size if min_size is not None else config.QUALITY_MIN_FACE_SIZE
+        self.min_sharpness = min_sharpness if min_sharpness is not None else config.QUALITY_MIN_SHARPNESS
+        self.min_brightness = min_brightness if min_brightness is not None else config.QUALITY_MIN_BRIGHTNESS
+        self.max_brightness = max_brightness if max_brightness is not None else config.QUALITY_MAX_BRIGHTNESS
+        self.max_pose = max_pose if max_pose is not None else config.QUALITY_MAX_POSE
+        self.enabled = config.QUALITY_GATE and any((
+            self.min_size, self.min_sharpness, self.min_brightness, self.max_brightness, self.max_pose
+        ))
+
+    def check(self, image, box, landmarks=None):
+        """
+        Raise FaceRejected when the face at box (top, right, bottom, left)
+        of an RGB or grayscale image fails a check. `landmarks` is a
+        function returning the face's landmarks, called only for the pose
+        check (which is skipped without it).
+        """
+        if not self.enabled:
+            return
+        top, right, bottom, left = box
+        height, width = image.shape[:2]
+        top, bottom = max(0, top), min(height, bottom)
+        left, right = max(0, left), min(width, right)
+        size = min(bottom - top, right - left)
+        if size <= 0 or size < self.min_size:
+            raise FaceRejected("too_small", f"Face too small ({max(size, 0)} px, at least {self.min_size} px needed)")
+
+        import cv2
+        face = image[top:bottom, left:right]
+        if face.ndim == 3:
+            face = cv2.cvtColor(face, cv2.COLOR_RGB2GRAY)
+
+        if self.min_brightness or self.max_brightness:
+            brightness = float(face.mean())
+            if brightness < self.min_brightness:
+                raise FaceRejected("too_dark", f"Face too dark (brightness {brightness:.0f})")
+            if self.max_brightness and brightness > self.max_brightness:
+                raise FaceRejected("too_bright", f"Face too bright (brightness {brightness:.0f})")
+
+        if self.min_sharpness:
+            scale = SHARPNESS_WIDTH / face.shape[1]
+            scaled = cv2.resize(face, (SHARPNESS_WIDTH, max(1, int(round(face.shape[0] * scale)))),
+                                interpolation=cv2.INTER_AREA)
+            sharpness = float(cv2.Laplacian(scaled, cv2.CV_64F).var())
+            if sharpness < self.min_sharpness:
+                raise FaceRejected("blurry", f"Face too blurry (sharpness {sharpness:.0f})")
+
+        if self.max_pose and landmarks is not None:
+            turn = face_turn(landmarks())
+            if turn is not None and turn > self.max_pose:
+                raise FaceRejected("pose", f"Face turned away from the camera ({turn:.2f})")
+
+
+def face_turn(landmarks):
+    """
+    How far a face is turned sideways, from face_recognition landmarks
+    (the 5-point model's eyes and nose tip); None when they are missing
+    """
+    if not landmarks or not all(k in landmarks for k in ('left_eye', 'right_eye', 'nose_tip')):
+        return None
+    left_x = sum(x for x, _ in landmarks['left_eye']) / len(landmarks['left_eye'])
+    right_x = sum(x for x, _ in landmarks['right_eye']) / len(landmarks['right_eye'])
+    left_y = sum(y for _, y in landmarks['left_eye']) / len(landmarks['left_eye'])
+    right_y = sum(y for _, y in landmarks['right_eye']) / len(landmarks['right_eye'])
+    eye_distance = ((right_x - left_x) ** 2 + (right_y - left_y) ** 2) ** 0.5
+    if eye_distance == 0:
+        return None
+    nose_x = sum(x for x, _ in landmarks['nose_tip']) / len(landmarks['nose_tip'])
+    return abs(nose_x - (left_x + right_x) / 2) / eye_distance
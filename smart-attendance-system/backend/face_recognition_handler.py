@@ -3,78 +3,338 @@ Face Recognition Handler
 Handles face detection, encoding, and recognition
 """
 
-import cv2
 import numpy as np
 import os
 import json
-import pickle
 import base64
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from PIL import Image
-from io import BytesIO
 
-# Try to import face_recognition, fallback to OpenCV-only mode
-try:
-    import face_recognition
-    FACE_RECOGNITION_AVAILABLE = True
-except ImportError:
-    FACE_RECOGNITION_AVAILABLE = False
-    print("Note: face_recognition not available. Using OpenCV face detection only.")
+import config
+import metrics
+from gallery import FaceGallery
+from gallery_store import GalleryStore
+from face_index import create_index, load_index
+from face_encoder import FaceEncoder, FACE_RECOGNITION_AVAILABLE, ENCODING_MODE
+from face_quality import FaceRejected
+from encoding_pool import EncodingPool
+from encoding_cache import EncodingCache, content_key
+from face_tracker import FaceTracker
+from timing import elapsed_ms
+
+# Match thresholds, expressed as gallery distances
+# dlib: euclidean distance below 0.6; histogram: cosine similarity above 0.7
+DLIB_TOLERANCE = 0.6
+HISTOGRAM_TOLERANCE = 1.0 - 0.7
 
 class FaceRecognitionHandler:
     def __init__(self, models_dir):
         self.models_dir = Path(models_dir)
         self.models_dir.mkdir(exist_ok=True)
         self.persons_file = self.models_dir / "persons.json"
+        # Person changes since persons.json was written, folded in on compaction
+        self.persons_log = self.models_dir / "persons.log"
+        self._persons_log_torn = False
         self.encodings_file = self.models_dir / "encodings.pkl"
+        self.index_file = self.models_dir / "index.npz"
+        self.store = GalleryStore(self.models_dir)
         self.persons_data = self._load_persons_data()
-        self.known_encodings = []
-        self.known_names = []
+        self.metric = 'euclidean' if FACE_RECOGNITION_AVAILABLE else 'cosine'
+        self.tolerance = DLIB_TOLERANCE if FACE_RECOGNITION_AVAILABLE else HISTOGRAM_TOLERANCE
+        self.encoding_cache = EncodingCache(
+            self.models_dir / "encoding_cache.npz", config.ENCODING_CACHE_SIZE, ENCODING_MODE
+        )
+        self._lock = threading.RLock()
+        # Faces rejected by the quality checks, by reason
+        self.quality_rejections = {}
         self._load_encodings()
+        self._batch_pool = None
+        self._encoding_pool = None
+        self._stop = threading.Event()
+        self._start_compactor()
         
-        # Load OpenCV face detector cascade
-        self.face_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        )
+        self.encoder = FaceEncoder()
+        if metrics.ENABLED:
+            self._register_metrics()
     
     def _load_persons_data(self):
-        """Load persons data from file"""
+        """Load persons data from file, with the changes logged since it was written"""
+        persons_data = {}
         if self.persons_file.exists():
             with open(self.persons_file, 'r') as f:
-                return json.load(f)
-        return {}
+                persons_data = json.load(f)
+        if self.persons_log.exists():
+            with open(self.persons_log, 'r') as f:
+                for line in f:
+                    # A torn record must not be extended by the next one
+                    self._persons_log_torn = not line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn final line after a crash
+                        continue
+                    for person_id, data in record.items():
+                        if data is None:
+                            persons_data.pop(person_id, None)
+                        else:
+                            persons_data[person_id] = data
+        return persons_data
+    
+    def _log_persons(self, person_ids):
+        """
+        Append the current entries of these persons (null once deleted) to
+        persons.log, instead of rewriting persons.json for every change
+        """
+        record = {person_id: self.persons_data.get(person_id) for person_id in person_ids}
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            if self._persons_log_torn:
+                line = '\n' + line
+                self._persons_log_torn = False
+            with open(self.persons_log, 'a') as f:
+                f.write(line)
     
     def _save_persons_data(self):
-        """Save persons data to file"""
-        with open(self.persons_file, 'w') as f:
-            json.dump(self.persons_data, f, indent=2)
+        """Save persons data to file atomically, folding in and clearing persons.log"""
+        with self._lock:
+            temp_file = self.persons_file.with_suffix('.tmp')
+            with open(temp_file, 'w') as f:
+                json.dump(self.persons_data, f, indent=2)
+            os.replace(temp_file, self.persons_file)
+            if self.persons_log.exists():
+                self.persons_log.unlink()
+            self._persons_log_torn = False
     
     def _load_encodings(self):
-        """Load face encodings"""
-        if self.encodings_file.exists():
-            with open(self.encodings_file, 'rb') as f:
-                data = pickle.load(f)
-                self.known_encodings = data.get('encodings', [])
-                self.known_names = data.get('names', [])
-    
-    def _save_encodings(self):
-        """Save face encodings"""
-        data = {
-            'encodings': self.known_encodings,
-            'names': self.known_names
-        }
-        with open(self.encodings_file, 'wb') as f:
-            pickle.dump(data, f)
+        """
+        Map the saved gallery, migrating older storage formats on first start.
+        Raises ValueError when the saved gallery was made in the other mode
+        (with or without face_recognition), rather than replacing it.
+        """
+        self.gallery = self.store.load(self.metric)
+        if self.gallery is not None:
+            self._load_index()
+            self.store.remove_other_generations()
+            return
+        
+        if self.store.exists():
+            if self.store.saved_metric() == 'euclidean':
+                raise ValueError(
+                    f"The gallery in {self.models_dir} was made with face_recognition, which is not "
+                    "installed. Install it, or move the gallery.* files aside and re-upload images."
+                )
+            raise ValueError(
+                f"The gallery in {self.models_dir} was made in OpenCV-only mode. Move the gallery.* "
+                "files aside and re-upload images to use face_recognition."
+            )
+        
+        # Older versions kept encodings as float lists in persons.json (and a
+        # pickle snapshot plus change logs); move them into the mapped store,
+        # which also saves persons.json without them
+        self.gallery = self._gallery_from_persons_data()
+        for person in self.persons_data.values():
+            person.pop('encodings', None)
+        self._rewrite()
+        for old_file in [self.encodings_file, *self.models_dir.glob("encodings.*.log")]:
+            if old_file.exists():
+                old_file.unlink()
+    
+    def _gallery_from_persons_data(self):
+        """
+        In-memory gallery from encodings stored in persons data (older
+        format). Without face_recognition those are histograms of the whole
+        image, which do not match the face-crop histograms of queries: they
+        are left out and their persons flagged for re-enrollment.
+        """
+        encodings = []
+        names = []
+        keys = []
+        if ENCODING_MODE != 'dlib':
+            stale = [p for p in self.persons_data.values() if p.get('encodings')]
+            for person in stale:
+                person['reenroll'] = True
+            if stale:
+                print(
+                    f"Warning: {len(stale)} persons were enrolled with whole-image histograms, "
+                    "which no longer match; upload their images again"
+                )
+            return FaceGallery(metric=self.metric)
+        
+        for person_id, data in self.persons_data.items():
+            for encoding in data.get('encodings', []):
+                encodings.append(encoding)
+                names.append(data['name'])
+                keys.append(person_id)
+        
+        gallery = FaceGallery(metric=self.metric)
+        gallery.build(encodings, names, keys)
+        return gallery
+    
+    def _add_encodings(self, person_id, name, encodings):
+        """Append encodings for a person to the live gallery, its files and change log"""
+        with self._lock:
+            first_row, end_row = self.gallery.add(encodings, person_id, name)
+            self.index.add(first_row, end_row)
+            self.store.log_add(self.gallery, [person_id])
+    
+    def _remove_encodings(self, person_id):
+        """Tombstone a person's encodings; compaction drops the rows later"""
+        with self._lock:
+            label = self.gallery.label_of(person_id)
+            if self.gallery.remove(person_id):
+                self.store.log_remove(label)
+    
+    def _rewrite(self, keep_keys=None, timings=None):
+        """
+        Write the live rows to a new storage generation and switch to it;
+        the gallery and persons change logs are folded into their JSON files
+        """
+        with self._lock:
+            generation = self.store.generation + 1
+            start = time.perf_counter()
+            gallery = self.gallery.compact(self.store.create_storage(generation), keep_keys)
+            if timings is not None:
+                timings['compact_ms'] = elapsed_ms(start)
+            start = time.perf_counter()
+            index = self._create_index(gallery).build()
+            if timings is not None:
+                timings['index_ms'] = elapsed_ms(start)
+            start = time.perf_counter()
+            index.save(self.index_file, generation)
+            self.store.save(gallery, generation)
+            self._save_persons_data()
+            if timings is not None:
+                timings['save_ms'] = elapsed_ms(start)
+            self.gallery, self.index = gallery, index
+            self.store.remove_other_generations()
+    
+    def compact(self):
+        """Drop removed rows and refresh the saved index"""
+        timings = {} if metrics.ENABLED else None
+        start = time.perf_counter()
+        self._rewrite(timings=timings)
+        if timings is not None:
+            metrics.observe('compact', start, timings)
+    
+    def _needs_compaction(self):
+        """Whether logged changes or tombstones have accumulated enough to compact"""
+        dead = len(self.gallery) - self.gallery.live_count
+        return (
+            self.store.log_records >= config.GALLERY_COMPACT_RECORDS
+            or dead > config.GALLERY_COMPACT_DEAD_RATIO * max(len(self.gallery), 1)
+        )
+    
+    def _start_compactor(self):
+        """Start the background compaction thread"""
+        if config.GALLERY_COMPACT_INTERVAL <= 0:
+            return
+        thread = threading.Thread(target=self._compact_loop, daemon=True)
+        thread.start()
+    
+    def _compact_loop(self):
+        """Periodically compact the gallery when needed, and save the encoding cache"""
+        while not self._stop.wait(config.GALLERY_COMPACT_INTERVAL):
+            if self._needs_compaction():
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"Error compacting gallery: {str(e)}")
+            try:
+                self.encoding_cache.save()
+            except OSError as e:
+                print(f"Error saving encoding cache: {str(e)}")
+    
+    def warmup(self):
+        """
+        Load what the first requests would otherwise wait for: the encoder's
+        libraries and models (and one blank encode), the encoding workers
+        when enabled, and the gallery's pages. Returns per-stage timings in ms.
+        """
+        timings = {}
+        self.encoder.warmup(timings)
+        
+        pool = self.encoding_pool()
+        if pool is not None:
+            # Workers warm their own encoder as they start (see encoding_pool.py)
+            start = time.perf_counter()
+            pool.run(bytes(16 * 16 * 3), 16, 16)
+            timings['workers_ms'] = elapsed_ms(start)
+        
+        start = time.perf_counter()
+        index = self.index
+        if len(index.gallery):
+            # Read every row of the memory-mapped gallery, then search once
+            float(index.gallery.matrix[:len(index.gallery)].sum())
+            index.search(index.gallery.matrix[0])
+        timings['gallery_ms'] = elapsed_ms(start)
+        return timings
+    
+    def _register_metrics(self):
+        """Gallery, roster, encoding cache and worker pool gauges, read when scraped"""
+        cache = self.encoding_cache
+        metrics.GALLERY_ENCODINGS.set_function(lambda: {
+            ('live',): self.gallery.live_count,
+            ('removed',): len(self.gallery) - self.gallery.live_count
+        })
+        metrics.PERSONS.set_function(lambda: len(self.persons_data))
+        metrics.ENCODING_CACHE_ENTRIES.set_function(lambda: len(cache))
+        metrics.ENCODING_CACHE_REQUESTS.set_function(lambda: {('hit',): cache.hits, ('miss',): cache.misses})
+        metrics.QUALITY_REJECTIONS.set_function(
+            lambda: {(reason,): count for reason, count in list(self.quality_rejections.items())}
+        )
+        metrics.ENCODING_POOL_IN_FLIGHT.set_function(
+            lambda: self._encoding_pool.in_flight if self._encoding_pool is not None else 0
+        )
+    
+    def close(self):
+        """Stop background work"""
+        self._stop.set()
+        if self._encoding_pool is not None:
+            self._encoding_pool.close()
+        try:
+            self.encoding_cache.save()
+        except OSError as e:
+            print(f"Error saving encoding cache: {str(e)}")
+    
+    def _create_index(self, gallery=None):
+        """Create an unbuilt index of the configured type over a gallery"""
+        return create_index(
+            gallery if gallery is not None else self.gallery,
+            kind=config.FACE_INDEX_TYPE,
+            nlist=config.FACE_INDEX_NLIST,
+            nprobe=config.FACE_INDEX_NPROBE
+        )
+    
+    def _load_index(self):
+        """Load the saved gallery index, rebuilding it if missing or stale"""
+        self.index = load_index(
+            self.index_file,
+            self.gallery,
+            self.store.generation,
+            kind=config.FACE_INDEX_TYPE,
+            nlist=config.FACE_INDEX_NLIST,
+            nprobe=config.FACE_INDEX_NPROBE
+        )
+        if self.index is None:
+            self.index = self._create_index().build()
+    
+    def _new_person_id(self):
+        """Next unused person id"""
+        number = len(self.persons_data) + 1
+        while f"person_{number}" in self.persons_data:
+            number += 1
+        return f"person_{number}"
     
     def add_person(self, name):
         """Add new person"""
-        person_id = f"person_{len(self.persons_data) + 1}"
+        person_id = self._new_person_id()
         self.persons_data[person_id] = {
             "name": name,
-            "images": [],
-            "encodings": []
+            "images": []
         }
-        self._save_persons_data()
+        self._log_persons([person_id])
         return person_id
     
     def get_all_persons(self):
@@ -92,162 +352,406 @@ class FaceRecognitionHandler:
         """Delete a person"""
         if person_id in self.persons_data:
             del self.persons_data[person_id]
-            self._save_persons_data()
-            # Retrain model
-            self.train_model()
+            self._log_persons([person_id])
+            self._remove_encodings(person_id)
     
     def add_image_to_person(self, person_id, image_file):
         """Add image to person"""
         if person_id not in self.persons_data:
             raise ValueError(f"Person {person_id} not found")
         
+        timings = {} if metrics.ENABLED else None
+        operation_start = start = time.perf_counter()
+        
         # Save image
         image_id = f"img_{len(self.persons_data[person_id]['images']) + 1}"
         image_path = self.models_dir / person_id / f"{image_id}.jpg"
         image_path.parent.mkdir(exist_ok=True)
         
         image_file.save(str(image_path))
+        if timings is not None:
+            timings['save_ms'] = elapsed_ms(start)
         
-        # Extract encoding
-        if FACE_RECOGNITION_AVAILABLE:
-            try:
-                image = face_recognition.load_image_file(str(image_path))
-                face_encodings = face_recognition.face_encodings(image)
-                
-                if face_encodings:
-                    encoding = face_encodings[0].tolist()
-                    self.persons_data[person_id]['encodings'].append(encoding)
-                    self.persons_data[person_id]['images'].append(str(image_path))
-                    self._save_persons_data()
-                    return image_id
+        # Extract encoding, unless the same image was encoded before
+        # (rejected images are not cached: the thresholds may change)
+        try:
+            start = time.perf_counter()
+            key = content_key(image_path.read_bytes())
+            cached, encoding = self.encoding_cache.get(key)
+            if timings is not None:
+                timings['cache_ms'] = elapsed_ms(start)
+            if not cached:
+                start = time.perf_counter()
+                encoding = self.encoder.encode_file(image_path)
+                self.encoding_cache.put(key, encoding)
+                if timings is not None:
+                    timings['encode_ms'] = elapsed_ms(start)
+        except FaceRejected as e:
+            image_path.unlink()
+            self.count_rejection(e.reason)
+            if timings is not None:
+                metrics.ENROLLMENTS.inc(1, ('rejected',))
+            raise
+        except Exception as e:
+            image_path.unlink()
+            if timings is not None:
+                metrics.ENROLLMENTS.inc(1, ('error',))
+            raise ValueError(f"Error processing image: {str(e)}")
+        
+        if encoding is None:
+            # Delete image if no face found
+            image_path.unlink()
+            if timings is not None:
+                metrics.ENROLLMENTS.inc(1, ('no_face',))
+            raise ValueError("No face detected in image")
+        
+        start = time.perf_counter()
+        self._enroll_encoding(person_id, image_path, encoding)
+        if timings is not None:
+            timings['commit_ms'] = elapsed_ms(start)
+            metrics.observe('add_image_to_person', operation_start, timings)
+            metrics.ENROLLMENTS.inc(1, ('enrolled',))
+        return image_id
+    
+    def count_rejection(self, reason):
+        """Count a face rejected by the quality checks"""
+        with self._lock:
+            self.quality_rejections[reason] = self.quality_rejections.get(reason, 0) + 1
+    
+    def rejected_faces(self, rejected):
+        """Count faces rejected by the quality checks; their result entries"""
+        faces = []
+        for (top, right, bottom, left), error in rejected:
+            self.count_rejection(error.reason)
+            faces.append({
+                "name": None,
+                "distance": None,
+                "box": {"top": int(top), "right": int(right), "bottom": int(bottom), "left": int(left)},
+                "reason": error.reason,
+                "message": str(error)
+            })
+        return faces
+    
+    def _enroll_encoding(self, person_id, image_path, encoding):
+        """Record a new encoding for a person and add it to the live gallery"""
+        person = self.persons_data[person_id]
+        person['images'].append(str(image_path))
+        person.pop('reenroll', None)
+        self._log_persons([person_id])
+        self._add_encodings(person_id, person['name'], np.asarray([encoding], dtype=np.float32))
+    
+    def enrolled_images(self):
+        """Paths of every image already enrolled"""
+        return {image for person in self.persons_data.values() for image in person.get('images', [])}
+    
+    def enroll_many(self, people):
+        """
+        Enroll images of many persons in one commit: one persons.log record
+        and all encodings appended to the gallery in one write.
+        `people` is a list of (name, [(image_path, encoding), ...]); images
+        for a name that is already enrolled are added to that person.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            person_ids = {data['name']: person_id for person_id, data in self.persons_data.items()}
+            encodings = []
+            keys = []
+            names = []
+            added = []
+            updated = []
+            for name, images in people:
+                if not images:
+                    continue
+                person_id = person_ids.get(name)
+                if person_id is None:
+                    person_id = self._new_person_id()
+                    self.persons_data[person_id] = {"name": name, "images": []}
+                    person_ids[name] = person_id
+                    added.append(person_id)
                 else:
-                    # Delete image if no face found
-                    image_path.unlink()
-                    raise ValueError("No face detected in image")
-            except Exception as e:
-                image_path.unlink()
-                raise ValueError(f"Error processing image: {str(e)}")
-        else:
-            # Fallback to OpenCV detection
-            img = cv2.imread(str(image_path))
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
+                    updated.append(person_id)
+                self.persons_data[person_id].pop('reenroll', None)
+                for image_path, encoding in images:
+                    self.persons_data[person_id]['images'].append(str(image_path))
+                    encodings.append(encoding)
+                    keys.append(person_id)
+                    names.append(name)
             
-            if len(faces) > 0:
-                # Use histogram as simple encoding
-                hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
-                encoding = cv2.normalize(hist, hist).flatten().tolist()
-                self.persons_data[person_id]['encodings'].append(encoding)
-                self.persons_data[person_id]['images'].append(str(image_path))
-                self._save_persons_data()
-                return image_id
-            else:
-                image_path.unlink()
-                raise ValueError("No face detected in image")
+            if encodings:
+                self._log_persons(added + updated)
+                first_row, end_row = self.gallery.add_many(encodings, keys, names)
+                self.index.add(first_row, end_row)
+                self.store.log_add(self.gallery, keys)
+            
+            if metrics.ENABLED:
+                metrics.observe('enroll_many', start)
+                metrics.ENROLLMENTS.inc(len(encodings), ('enrolled',))
+            return {
+                "persons_added": len(added),
+                "persons_updated": len(updated),
+                "images_enrolled": len(encodings)
+            }
     
     def train_model(self):
-        """Train face recognition model"""
-        self.known_encodings = []
-        self.known_names = []
-        
-        face_count = 0
-        for person_id, data in self.persons_data.items():
-            if data['encodings']:
-                for encoding in data['encodings']:
-                    self.known_encodings.append(encoding)
-                    self.known_names.append(data['name'])
-                    face_count += 1
-        
-        self._save_encodings()
+        """
+        Rebuild the gallery and index from all enrolled persons.
+        Enrollment changes are applied incrementally, so this is only needed
+        to recover from edits made outside the handler.
+        """
+        timings = {} if metrics.ENABLED else None
+        start = time.perf_counter()
+        self._rewrite(keep_keys=set(self.persons_data), timings=timings)
+        if timings is not None:
+            metrics.observe('train_model', start, timings)
         
         return {
-            "faces_encoded": face_count,
+            "faces_encoded": len(self.gallery),
             "persons": len(self.persons_data),
-            "status": "trained"
+            "status": "trained",
+            "index": self.index.kind
         }
     
     def is_model_trained(self):
         """Check if model is trained"""
-        return len(self.known_encodings) > 0
+        return self.gallery.live_count > 0
     
     def get_model_stats(self):
         """Get model statistics"""
         return {
             "total_persons": len(self.persons_data),
-            "total_encoded_faces": len(self.known_encodings),
-            "persons_trained": sum(1 for p in self.persons_data.values() if p['encodings'])
+            "total_encoded_faces": self.gallery.live_count,
+            "persons_trained": len(self.gallery.live_keys() & set(self.persons_data)),
+            # Enrolled with encodings that no longer match (see _gallery_from_persons_data)
+            "persons_to_reenroll": [
+                data['name'] for data in self.persons_data.values() if data.get('reenroll')
+            ],
+            "quality_rejections": dict(self.quality_rejections)
         }
     
+    def _image_bytes(self, image_base64, timings=None):
+        """Bytes of the image in a base64 data URL"""
+        start = time.perf_counter()
+        image_data = base64.b64decode(image_base64.split(',')[1])
+        if timings is not None:
+            timings['base64_ms'] = elapsed_ms(start)
+        return image_data
+    
+    def encoding_pool(self):
+        """Worker process pool, or None when ENCODE_WORKERS is 0 (encode in the request thread)"""
+        if config.ENCODE_WORKERS <= 0:
+            return None
+        with self._lock:
+            if self._encoding_pool is None:
+                self._encoding_pool = EncodingPool(config.ENCODE_WORKERS, config.ENCODE_QUEUE_SIZE)
+            return self._encoding_pool
+    
+    def _encode_frame(self, image_data, width=None, height=None, first=False, timings=None):
+        """
+        Decode one frame and encode its faces, in a worker process when the
+        pool is enabled; returns (boxes, encodings, rejected), see
+        FaceEncoder.process
+        """
+        pool = self.encoding_pool()
+        start = time.perf_counter()
+        if pool is not None:
+            boxes, encodings, rejected, stages = pool.run(image_data, width, height, first)
+        else:
+            boxes, encodings, rejected, stages = self.encoder.process(image_data, width, height, first)
+        if timings is not None:
+            timings.update(stages)
+            if pool is not None:
+                # Includes queueing and transfer to and from the worker
+                timings['worker_ms'] = elapsed_ms(start)
+        return boxes, encodings, rejected
+    
     def recognize_face(self, image_base64):
-        """Recognize face from base64 image"""
+        """
+        Recognize face from base64 image. Raises FaceRejected when the face
+        is too poor to encode (see face_quality.py).
+        """
         if not self.is_model_trained():
             raise ValueError("Model not trained yet")
         
-        # Decode base64 image
-        image_data = base64.b64decode(image_base64.split(',')[1])
-        image = Image.open(BytesIO(image_data))
-        image_np = np.array(image)
+        timings = {} if metrics.ENABLED else None
+        operation_start = time.perf_counter()
+        image_data = self._image_bytes(image_base64, timings)
+        try:
+            _, encodings, _ = self._encode_frame(image_data, first=True, timings=timings)
+        except FaceRejected as e:
+            self.count_rejection(e.reason)
+            if timings is not None:
+                metrics.observe('recognize_face', operation_start, timings)
+                metrics.RECOGNITIONS.inc(1, ('recognize_face', 'rejected'))
+            raise
         
-        # Convert RGB to BGR for OpenCV
-        image_cv = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
-        image_rgb = cv2.cvtColor(image_cv, cv2.COLOR_BGR2RGB)
+        name = None
+        if encodings:
+            # Compare with known encodings
+            start = time.perf_counter()
+            name = self._match(encodings[0])
+            if timings is not None:
+                timings['match_ms'] = elapsed_ms(start)
         
-        if FACE_RECOGNITION_AVAILABLE:
-            try:
-                # Find faces using face_recognition
-                face_locations = face_recognition.face_locations(image_rgb)
-                face_encodings = face_recognition.face_encodings(image_rgb, face_locations)
-                
-                if not face_encodings:
-                    return None
-                
-                # Compare with known encodings
-                face_encoding = face_encodings[0]
-                matches = face_recognition.compare_faces(
-                    self.known_encodings, 
-                    face_encoding,
-                    tolerance=0.6
-                )
-                face_distances = face_recognition.face_distance(
-                    self.known_encodings, 
-                    face_encoding
-                )
-                
-                best_match_index = np.argmin(face_distances)
-                
-                if matches[best_match_index]:
-                    return self.known_names[best_match_index]
-                
-                return None
-            except Exception as e:
-                print(f"Error in face recognition: {str(e)}")
-                return None
+        if timings is not None:
+            faces = timings.pop('faces', len(encodings))
+            metrics.observe_frame('recognize_face', operation_start, timings, faces, name is not None)
+        return name
+    
+    def recognize_faces(self, image_base64, timings=None):
+        """
+        Recognize every face in a base64 image.
+        Returns a list of {"name", "distance", "box"} dicts, one per detected
+        face; name is None for faces that match nobody, and faces too poor
+        to encode also get the "reason" and "message" they were rejected
+        for. Per-stage times in milliseconds are added to `timings` when a
+        dict is given.
+        """
+        if not self.is_model_trained():
+            raise ValueError("Model not trained yet")
+        
+        if timings is None and metrics.ENABLED:
+            timings = {}
+        start = time.perf_counter()
+        image_data = self._image_bytes(image_base64, timings)
+        faces = self._recognize_frame(image_data, None, None, timings)
+        if metrics.ENABLED:
+            self._observe_faces('recognize_faces', start, timings, faces)
+        return faces
+    
+    def recognize_frame(self, image_data, width=None, height=None):
+        """
+        Recognize every face in one binary frame: encoded image bytes, or
+        packed RGB pixels when width and height are given.
+        Returns (faces, per-stage timings in milliseconds).
+        """
+        if not self.is_model_trained():
+            raise ValueError("Model not trained yet")
+        
+        timings = {}
+        start = time.perf_counter()
+        faces = self._recognize_frame(image_data, width, height, timings)
+        if metrics.ENABLED:
+            self._observe_faces('recognize_frame', start, timings, faces)
+        return faces, timings
+    
+    def create_tracker(self, **options):
+        """New stream-mode tracker for one camera (see face_tracker.py)"""
+        return FaceTracker(self, **options)
+    
+    def recognize_stream(self, tracker, image_data, width=None, height=None):
+        """
+        Recognize the faces of one frame from a camera stream, following
+        them across frames with the camera's tracker so that faces are only
+        re-encoded when their track is new or has drifted.
+        Returns (faces, per-stage timings in milliseconds).
+        Tracking needs the decoded frame, so this runs in the request thread
+        even when the worker pool is enabled.
+        """
+        if not self.is_model_trained():
+            raise ValueError("Model not trained yet")
+        
+        timings = {}
+        start = time.perf_counter()
+        image = self.encoder.decode_frame(image_data, width, height, timings)
+        faces = tracker.process(image, timings)
+        if metrics.ENABLED:
+            self._observe_faces('recognize_stream', start, timings, faces)
+        return faces, timings
+    
+    def _observe_faces(self, operation, start, timings, faces):
+        """Record a recognized frame given its {"name", ...} face results"""
+        recognized = any(face["name"] for face in faces)
+        metrics.observe_frame(operation, start, timings, len(faces), recognized)
+    
+    def _recognize_frame(self, image_data, width, height, timings=None):
+        """Decode, detect, encode and match the faces of one frame"""
+        boxes, encodings, rejected = self._encode_frame(image_data, width, height, timings=timings)
+        
+        start = time.perf_counter()
+        faces = self._match_all(boxes, encodings)
+        if timings is not None:
+            timings['match_ms'] = elapsed_ms(start)
+        return faces + self.rejected_faces(rejected)
+    
+    def recognize_batch(self, frames):
+        """
+        Recognize faces in many encoded frames (bytes) at once.
+        Frames are decoded and encoded in parallel (worker processes when
+        the pool is enabled, threads otherwise), then every face of every
+        frame is matched in one batched gallery search. Returns one
+        {"faces": [...]} (or {"error": ...}) dict per frame.
+        """
+        if not self.is_model_trained():
+            raise ValueError("Model not trained yet")
+        
+        start = time.perf_counter()
+        pool = self.encoding_pool()
+        if pool is not None:
+            futures = pool.submit_many([(image_data, None, None) for image_data in frames])
+            encoded = []
+            for future in futures:
+                try:
+                    encoded.append(future.result()[:3])
+                except Exception as e:
+                    encoded.append(e)
         else:
-            # Fallback to OpenCV detection
-            gray = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
-            faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
-            
-            if len(faces) == 0:
-                return None
+            if self._batch_pool is None:
+                self._batch_pool = ThreadPoolExecutor(max_workers=config.BATCH_WORKERS)
             
-            # Use histogram for comparison
-            hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
-            face_encoding = cv2.normalize(hist, hist).flatten().tolist()
+            def encode_frame(image_data):
+                try:
+                    return self.encoder.process(image_data)[:3]
+                except Exception as e:
+                    return e
             
-            # Simple similarity comparison
-            if len(self.known_encodings) > 0:
-                similarities = []
-                for known_enc in self.known_encodings:
-                    # Calculate cosine similarity
-                    known_arr = np.array(known_enc)
-                    curr_arr = np.array(face_encoding)
-                    similarity = np.dot(known_arr, curr_arr) / (
-                        np.linalg.norm(known_arr) * np.linalg.norm(curr_arr) + 1e-10
-                    )
-                    similarities.append(similarity)
-                
-                best_match = np.argmax(similarities)
-                if similarities[best_match] > 0.7:
-                    return self.known_names[best_match]
-            
-            return None
+            encoded = list(self._batch_pool.map(encode_frame, frames))
+        
+        boxes = []
+        encodings = []
+        for result in encoded:
+            if not isinstance(result, Exception):
+                boxes.extend(result[0])
+                encodings.extend(result[1])
+        matches = self._match_all(boxes, encodings)
+        
+        results = []
+        position = 0
+        for result in encoded:
+            if isinstance(result, Exception):
+                results.append({"error": str(result)})
+                continue
+            count = len(result[0])
+            results.append({"faces": matches[position:position + count] + self.rejected_faces(result[2])})
+            position += count
+        
+        if metrics.ENABLED:
+            metrics.observe('recognize_batch', start)
+            for result in results:
+                if "faces" in result:
+                    metrics.FACES_PER_FRAME.observe(len(result["faces"]), ('recognize_batch',))
+        return results
+    
+    def _match(self, face_encoding):
+        """Return the name of the closest known face within tolerance"""
+        index = self.index
+        best_row, distance = index.search(face_encoding)
+        if best_row is not None and distance <= self.tolerance:
+            return index.gallery.name_of(best_row)
+        return None
+    
+    def _match_all(self, boxes, encodings):
+        """Match several encodings in one batched search"""
+        index = self.index
+        rows, distances = index.search_batch(encodings)
+        results = []
+        for box, row, distance in zip(boxes, rows, distances):
+            name = None
+            if row is not None and distance <= self.tolerance:
+                name = index.gallery.name_of(row)
+            top, right, bottom, left = box
+            results.append({
+                "name": name,
+                "distance": round(distance, 4) if distance is not None else None,
+                "box": {"top": int(top), "right": int(right), "bottom": int(bottom), "left": int(left)}
+            })
+        return results
@@ -0,0 +1,238 @@
+"""
+Face Tracker
+Stream mode for FaceRecognitionHandler: faces are detected on a downscaled
+copy of the frame every few frames and followed frame-to-frame in between
+(template matching around their last position), so a face is only encoded
+again when its track is new or has drifted from where it was encoded.
+OpenCV is imported on first use (see face_encoder.py).
+"""
+
+import itertools
+import threading
+import time
+
+import config
+from face_quality import FaceRejected
+from timing import elapsed_ms
+
+def box_iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top = max(a[0], b[0])
+    right = min(a[1], b[1])
+    bottom = min(a[2], b[2])
+    left = max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+def _gray(image, top, right, bottom, left):
+    """Grayscale crop of an RGB or grayscale image"""
+    crop = image[top:bottom, left:right]
+    if crop.ndim == 2:
+        return crop
+    import cv2
+    return cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+
+
+class Track:
+    """One face followed across frames"""
+
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.box = box
+        # Box the current identity was encoded at; None until encoded
+        self.encoded_box = None
+        self.template = None
+        self.name = None
+        self.distance = None
+        # FaceRejected when the face failed the quality checks on this frame
+        self.rejected = None
+
+
+class FaceTracker:
+    """
+    Follows the faces of one camera. Not shared between cameras: each
+    stream gets its own tracker (FaceRecognitionHandler.create_tracker).
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, handler, detect_scale=None, detect_interval=None,
+                 drift_iou=None, min_score=None):
+        self.handler = handler
+        self.detect_scale = detect_scale if detect_scale is not None else config.TRACK_DETECT_SCALE
+        self.detect_interval = detect_interval if detect_interval is not None else config.TRACK_DETECT_INTERVAL
+        self.drift_iou = drift_iou if drift_iou is not None else config.TRACK_DRIFT_IOU
+        self.min_score = min_score if min_score is not None else config.TRACK_MIN_SCORE
+        self.tracks = []
+        self.frames = 0
+        self._last_detect = None
+        self._lock = threading.Lock()
+
+    def process(self, image, timings=None):
+        """
+        Track the faces of the next frame (RGB or grayscale, as decoded by
+        the handler). Returns {"name", "distance", "box", "track_id",
+        "encoded"} per face; encoded is True when the face was encoded for
+        this frame rather than carried over from its track. A face that
+        needs encoding but fails the quality checks keeps its track's
+        identity and is checked again on the next frame; an unidentified
+        one gets the "reason" and "message" it was rejected for.
+        """
+        with self._lock:
+            self.frames += 1
+            start = time.perf_counter()
+            if (not self.tracks or self._last_detect is None
+                    or self.frames - self._last_detect >= self.detect_interval):
+                self._associate(self._detect(image))
+                self._last_detect = self.frames
+                stage = 'detect_ms'
+            else:
+                self._follow(image)
+                stage = 'track_ms'
+            if timings is not None:
+                timings[stage] = elapsed_ms(start)
+
+            for track in self.tracks:
+                track.rejected = None
+            stale = [t for t in self.tracks if self._needs_encoding(t)]
+            if stale:
+                # Poor faces are not encoded
+                stale = self._check_quality(image, stale, timings)
+            start = time.perf_counter()
+            if stale:
+                boxes = [t.box for t in stale]
+                encodings = self.handler.encoder.encode_boxes(image, boxes)
+                for track, match in zip(stale, self.handler._match_all(boxes, encodings)):
+                    track.name = match['name']
+                    track.distance = match['distance']
+                    track.encoded_box = track.box
+            if timings is not None:
+                timings['encode_ms'] = elapsed_ms(start)
+
+            for track in self.tracks:
+                track.template = _gray(image, *track.box)
+            return [self._face(t, t in stale) for t in self.tracks]
+
+    def reset(self):
+        """Forget every track"""
+        with self._lock:
+            self.tracks = []
+            self._last_detect = None
+
+    def _detect(self, image):
+        """Detect on a downscaled copy; boxes mapped back to full resolution"""
+        scale = self.detect_scale
+        if not 0 < scale < 1:
+            return self.handler.encoder.detect(image)
+
+        import cv2
+        small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        height, width = image.shape[:2]
+        boxes = []
+        for top, right, bottom, left in self.handler.encoder.detect(small):
+            boxes.append((
+                max(0, int(round(top / scale))),
+                min(width, int(round(right / scale))),
+                min(height, int(round(bottom / scale))),
+                max(0, int(round(left / scale)))
+            ))
+        return boxes
+
+    def _associate(self, boxes):
+        """Match detections to tracks by overlap; unmatched detections start tracks"""
+        pairs = sorted(
+            ((box_iou(track.box, box), t, b)
+             for t, track in enumerate(self.tracks)
+             for b, box in enumerate(boxes)),
+            reverse=True
+        )
+        matched_tracks = {}
+        used_boxes = set()
+        for iou, t, b in pairs:
+            if iou < 0.3:
+                break
+            if t in matched_tracks or b in used_boxes:
+                continue
+            matched_tracks[t] = boxes[b]
+            used_boxes.add(b)
+
+        # Detection is authoritative: tracks it did not find are dropped
+        tracks = []
+        for t, box in matched_tracks.items():
+            track = self.tracks[t]
+            track.box = box
+            tracks.append(track)
+        for b, box in enumerate(boxes):
+            if b not in used_boxes and box[1] > box[3] and box[2] > box[0]:
+                tracks.append(Track(next(self._ids), box))
+        self.tracks = tracks
+
+    def _follow(self, image):
+        """Move each track to the best template match near its last box"""
+        import cv2
+        height, width = image.shape[:2]
+        tracks = []
+        for track in self.tracks:
+            top, right, bottom, left = track.box
+            pad_y = (bottom - top) // 2
+            pad_x = (right - left) // 2
+            window_box = (
+                max(0, top - pad_y), min(width, right + pad_x),
+                min(height, bottom + pad_y), max(0, left - pad_x)
+            )
+            window = _gray(image, *window_box)
+            template = track.template
+            if (template is None or template.size == 0
+                    or window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]):
+                continue
+
+            scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (x, y) = cv2.minMaxLoc(scores)
+            if score < self.min_score:
+                # Lost; the next frame runs detection
+                self._last_detect = None
+                continue
+            new_top = window_box[0] + y
+            new_left = window_box[3] + x
+            track.box = (new_top, new_left + (right - left), new_top + (bottom - top), new_left)
+            tracks.append(track)
+        self.tracks = tracks
+
+    def _check_quality(self, image, tracks, timings=None):
+        """Tracks whose face passes the quality checks; the rest are marked rejected"""
+        encoder = self.handler.encoder
+        start = time.perf_counter()
+        passed = []
+        for track in tracks:
+            try:
+                encoder.check_quality(image, track.box)
+            except FaceRejected as e:
+                track.rejected = e
+                self.handler.count_rejection(e.reason)
+            else:
+                passed.append(track)
+        if timings is not None:
+            timings['quality_ms'] = elapsed_ms(start)
+        return passed
+
+    def _needs_encoding(self, track):
+        """New tracks, and tracks that moved too far from where they were encoded"""
+        return track.encoded_box is None or box_iou(track.box, track.encoded_box) < self.drift_iou
+
+    def _face(self, track, encoded):
+        """Result entry for a track"""
+        top, right, bottom, left = track.box
+        face = {
+            "name": track.name,
+            "distance": track.distance,
+            "box": {"top": int(top), "right": int(right), "bottom": int(bottom), "left": int(left)},
+            "track_id": track.id,
+            "encoded": encoded
+        }
+        if track.rejected is not None and track.name is None:
+            face["reason"] = track.rejected.reason
+            face["message"] = str(track.rejected)
+        return face
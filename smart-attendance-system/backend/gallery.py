@@ -0,0 +1,306 @@
+"""
+Face Gallery
+Contiguous float32 matrix of known face encodings for fast matching
+"""
+
+import numpy as np
+
+class ArrayStorage:
+    """In-memory gallery rows; storage grows geometrically on append"""
+
+    def __init__(self):
+        self.count = 0
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+
+    @property
+    def dim(self):
+        return self._matrix.shape[1]
+
+    @property
+    def matrix(self):
+        return self._matrix[:self.count]
+
+    @property
+    def labels(self):
+        return self._labels[:self.count]
+
+    @property
+    def sq_norms(self):
+        return self._sq_norms[:self.count]
+
+    def append(self, rows, labels, sq_norms):
+        """Append rows with their labels and squared norms"""
+        if self.count == 0:
+            self._matrix = np.empty((0, rows.shape[1]), dtype=np.float32)
+        end = self.count + len(rows)
+        if end > self._matrix.shape[0]:
+            capacity = max(end, 2 * self._matrix.shape[0], 16)
+            self._matrix = _grow(self._matrix, self.count, capacity)
+            self._labels = _grow(self._labels, self.count, capacity)
+            self._sq_norms = _grow(self._sq_norms, self.count, capacity)
+        self._matrix[self.count:end] = rows
+        self._labels[self.count:end] = labels
+        self._sq_norms[self.count:end] = sq_norms
+        self.count = end
+
+    def flush(self):
+        """Nothing to persist for in-memory storage"""
+
+
+def _grow(array, count, capacity):
+    """Copy the first `count` rows of array into storage for `capacity` rows"""
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:count] = array[:count]
+    return grown
+
+
+class FaceGallery:
+    """
+    Holds every known encoding as one row of a float32 matrix, with a
+    parallel int32 array mapping each row to a label. Each label is one
+    person (keys[label] is the person id, names[label] the display name).
+
+    Two metrics are supported:
+    - 'euclidean': dlib 128-d encodings, matched by L2 distance. Squared row
+      norms are precomputed so a lookup is one matrix-vector product.
+    - 'cosine': OpenCV histogram encodings. Rows are normalized up front so
+      cosine similarity is a plain dot product; distance is 1 - similarity.
+
+    Rows live in a storage object (in memory by default, or memory-mapped
+    files, see gallery_store.py). Rows are only ever appended; removing a
+    person tombstones their label, and compact() drops tombstoned rows.
+    """
+
+    def __init__(self, metric='euclidean', storage=None):
+        if metric not in ('euclidean', 'cosine'):
+            raise ValueError(f"Unknown metric: {metric}")
+        self.metric = metric
+        self.storage = storage if storage is not None else ArrayStorage()
+        self.keys = []
+        self.names = []
+        self.dead_labels = set()
+        self._label_of = {}
+        self._dead = np.zeros(self.storage.count, dtype=bool)
+        self._dead_count = 0
+
+    def __len__(self):
+        return self.storage.count
+
+    @property
+    def matrix(self):
+        return self.storage.matrix
+
+    @property
+    def labels(self):
+        return self.storage.labels
+
+    @property
+    def sq_norms(self):
+        return self.storage.sq_norms
+
+    @property
+    def dead(self):
+        return self._dead[:len(self)]
+
+    @property
+    def live_count(self):
+        """Number of rows that have not been removed"""
+        return len(self) - self._dead_count
+
+    def _view(self, rows=None):
+        """Consistent (matrix, sq_norms, dead) snapshot, safe against concurrent appends"""
+        count = len(self)
+        matrix = self.storage.matrix[:count]
+        sq_norms = self.storage.sq_norms[:count]
+        dead = self._dead[:count]
+        if rows is not None:
+            return matrix[rows], sq_norms[rows], dead[rows]
+        return matrix, sq_norms, dead
+
+    def build(self, encodings, names, keys=None):
+        """Fill an empty gallery from parallel lists of encodings and names (and person ids)"""
+        if len(self):
+            raise ValueError("Gallery is not empty")
+        if keys is None:
+            keys = names
+        labels = [self._label(key, name) for key, name in zip(keys, names)]
+        if len(encodings):
+            self._append(np.asarray(encodings, dtype=np.float32), np.asarray(labels, dtype=np.int32))
+
+    def _label(self, key, name):
+        """Label for a person, creating it if needed"""
+        label = self._label_of.get(key)
+        if label is None:
+            label = len(self.keys)
+            self._label_of[key] = label
+            self.keys.append(key)
+            self.names.append(name)
+        else:
+            self.names[label] = name
+        return label
+
+    def _append(self, rows, labels):
+        """Append rows; returns the new row range"""
+        rows = rows.reshape(len(labels), -1)
+        if self.metric == 'cosine':
+            norms = np.linalg.norm(rows, axis=1, keepdims=True)
+            rows = rows / np.maximum(norms, 1e-10)
+        if len(self) and rows.shape[1] != self.storage.dim:
+            raise ValueError(
+                f"Encoding has {rows.shape[1]} values, gallery expects {self.storage.dim}"
+            )
+
+        start = len(self)
+        end = start + len(rows)
+        # Grow the tombstone mask before publishing the rows
+        if end > self._dead.shape[0]:
+            self._dead = _grow(self._dead, start, max(end, 2 * self._dead.shape[0], 16))
+        self._dead[start:end] = False
+        self.storage.append(rows, labels, np.einsum('ij,ij->i', rows, rows))
+        return start, end
+
+    def add(self, encodings, key, name):
+        """Append encodings for a person; returns the range of new rows"""
+        label = self._label(key, name)
+        rows = np.asarray(encodings, dtype=np.float32)
+        rows = rows.reshape(-1, rows.shape[-1])
+        return self._append(rows, np.full(len(rows), label, dtype=np.int32))
+
+    def add_many(self, encodings, keys, names):
+        """Append encodings of several persons (parallel lists) at once; returns the range of new rows"""
+        labels = [self._label(key, name) for key, name in zip(keys, names)]
+        rows = np.asarray(encodings, dtype=np.float32)
+        return self._append(rows, np.asarray(labels, dtype=np.int32))
+
+    def remove(self, key):
+        """Tombstone a person's label and rows; returns the number of rows removed"""
+        label = self._label_of.pop(key, None)
+        if label is None:
+            return 0
+        self.dead_labels.add(label)
+        rows = np.flatnonzero(self.labels == label)
+        self._dead[rows] = True
+        self._dead_count += len(rows)
+        return len(rows)
+
+    def label_of(self, key):
+        """Label of a person id, or None when it has none (or was removed)"""
+        return self._label_of.get(key)
+
+    def live_keys(self):
+        """Person ids that still have at least one live row"""
+        _, _, dead = self._view()
+        labels = np.unique(self.labels[:len(dead)][~dead])
+        return {self.keys[l] for l in labels}
+
+    def compact(self, storage=None, keep_keys=None):
+        """
+        Return a new gallery (in `storage`) holding only the live rows,
+        optionally restricted to persons whose id is in keep_keys
+        """
+        gallery = FaceGallery(metric=self.metric, storage=storage)
+        matrix, _, dead = self._view()
+        live = ~dead
+        if keep_keys is not None and self.keys:
+            keep = np.array([key in keep_keys for key in self.keys], dtype=bool)
+            live &= keep[self.labels[:len(live)]]
+        labels = self.labels[:len(live)][live]
+        gallery.build(
+            matrix[live],
+            [self.names[l] for l in labels],
+            [self.keys[l] for l in labels]
+        )
+        gallery.storage.flush()
+        return gallery
+
+    def metadata(self):
+        """Label table and tombstones, for persisting alongside the rows"""
+        return {
+            'metric': self.metric,
+            'dim': self.storage.dim,
+            'rows': len(self),
+            'persons': [[key, name] for key, name in zip(self.keys, self.names)],
+            'dead_labels': sorted(int(l) for l in self.dead_labels)
+        }
+
+    @classmethod
+    def open(cls, storage, metadata):
+        """Reattach a gallery to stored rows using metadata() output"""
+        gallery = cls(metric=metadata['metric'], storage=storage)
+        gallery.keys = [p[0] for p in metadata['persons']]
+        gallery.names = [p[1] for p in metadata['persons']]
+        gallery.dead_labels = set(metadata['dead_labels'])
+        gallery._label_of = {
+            key: label for label, key in enumerate(gallery.keys)
+            if label not in gallery.dead_labels
+        }
+        if gallery.dead_labels:
+            gallery._dead = np.isin(storage.labels, list(gallery.dead_labels))
+            gallery._dead_count = int(gallery._dead.sum())
+        return gallery
+
+    def _prepare_query(self, encoding):
+        """Convert a query encoding to float32 (normalized for cosine)"""
+        query = np.asarray(encoding, dtype=np.float32).ravel()
+        if self.metric == 'cosine':
+            query = query / max(float(np.linalg.norm(query)), 1e-10)
+        return query
+
+    def distances(self, encoding, rows=None):
+        """Distance from one encoding to every gallery row (or the given rows)"""
+        query = self._prepare_query(encoding)
+        matrix, sq_norms, dead = self._view(rows)
+        dots = matrix @ query
+        if self.metric == 'cosine':
+            dists = 1.0 - dots
+        else:
+            sq = sq_norms - 2.0 * dots + float(query @ query)
+            dists = np.sqrt(np.maximum(sq, 0.0))
+        if self._dead_count:
+            dists[dead] = np.inf
+        return dists
+
+    def distances_batch(self, encodings, rows=None):
+        """Distance matrix (queries x gallery rows, or the given rows) for several encodings at once"""
+        queries = np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1)
+        if self.metric == 'cosine':
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            queries = queries / np.maximum(norms, 1e-10)
+        matrix, sq_norms, dead = self._view(rows)
+        dots = queries @ matrix.T
+        if self.metric == 'cosine':
+            dists = 1.0 - dots
+        else:
+            q_sq = np.einsum('ij,ij->i', queries, queries)
+            sq = sq_norms[None, :] - 2.0 * dots + q_sq[:, None]
+            dists = np.sqrt(np.maximum(sq, 0.0))
+        if self._dead_count:
+            dists[:, dead] = np.inf
+        return dists
+
+    def search(self, encoding):
+        """Return (row index, distance) of the nearest live gallery row"""
+        if not self.live_count:
+            return None, None
+        dists = self.distances(encoding)
+        best = int(np.argmin(dists))
+        return best, float(dists[best])
+
+    def search_batch(self, encodings):
+        """Return (row indices, distances) of the nearest live row for each encoding"""
+        if not self.live_count or len(encodings) == 0:
+            return [None] * len(encodings), [None] * len(encodings)
+        dists = self.distances_batch(encodings)
+        rows = np.argmin(dists, axis=1)
+        best = dists[np.arange(len(rows)), rows]
+        return [int(r) for r in rows], [float(d) for d in best]
+
+    def name_of(self, row):
+        """Name for a gallery row"""
+        return self.names[self.labels[row]]
+
+    def key_of(self, row):
+        """Person id for a gallery row"""
+        return self.keys[self.labels[row]]
@@ -0,0 +1,231 @@
+"""
+Gallery Store
+Memory-mapped on-disk storage for the face gallery
+
+Layout inside the models directory:
+    gallery.json            label table, tombstones, row count, generation
+    gallery.<gen>.f32       float32 encoding matrix, one row per encoding
+    gallery.<gen>.i32       int32 label of each row
+    gallery.<gen>.norms     float32 squared norm of each row
+    gallery.<gen>.log       changes since gallery.json was written, one JSON
+                            record per line: appended rows with the labels
+                            they use, and removed labels
+
+The data files are append-only and mapped read-only, so startup does not
+parse anything per encoding and every process serving the same models
+directory shares the same page-cache pages. Enrollments and removals only
+append to the files and the log; compaction writes a new generation of
+data files and then switches gallery.json over to it, folding in the log.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from gallery import FaceGallery
+
+class MappedStorage:
+    """Gallery rows in append-only files, memory-mapped read-only"""
+
+    def __init__(self, base_path, dim=0, count=0):
+        self.paths = {
+            'matrix': base_path.with_name(base_path.name + ".f32"),
+            'labels': base_path.with_name(base_path.name + ".i32"),
+            'sq_norms': base_path.with_name(base_path.name + ".norms")
+        }
+        self.dim = dim
+        self.count = 0
+        self._pending = False
+
+        # Drop anything past the committed row count (a torn append)
+        sizes = {'matrix': 4 * dim, 'labels': 4, 'sq_norms': 4}
+        for name, path in self.paths.items():
+            with open(path, 'ab') as f:
+                f.truncate(count * sizes[name])
+        self._map(count)
+
+    def _map(self, count):
+        """(Re)map the first `count` rows of each file"""
+        if count == 0:
+            matrix = np.empty((0, self.dim), dtype=np.float32)
+            labels = np.empty(0, dtype=np.int32)
+            sq_norms = np.empty(0, dtype=np.float32)
+        else:
+            matrix = np.memmap(self.paths['matrix'], dtype=np.float32, mode='r', shape=(count, self.dim))
+            labels = np.memmap(self.paths['labels'], dtype=np.int32, mode='r', shape=(count,))
+            sq_norms = np.memmap(self.paths['sq_norms'], dtype=np.float32, mode='r', shape=(count,))
+        # Publish the arrays before the count so readers never see a short array
+        self.matrix, self.labels, self.sq_norms = matrix, labels, sq_norms
+        self.count = count
+
+    def append(self, rows, labels, sq_norms):
+        """Append rows to the files and remap them"""
+        if self.count == 0:
+            self.dim = rows.shape[1]
+        data = {
+            'matrix': np.ascontiguousarray(rows, dtype=np.float32),
+            'labels': np.ascontiguousarray(labels, dtype=np.int32),
+            'sq_norms': np.ascontiguousarray(sq_norms, dtype=np.float32)
+        }
+        for name, path in self.paths.items():
+            with open(path, 'ab') as f:
+                f.write(data[name].tobytes())
+        self._pending = True
+        self._map(self.count + len(rows))
+
+    def flush(self):
+        """fsync appended rows before they are recorded in gallery.json"""
+        if not self._pending:
+            return
+        for path in self.paths.values():
+            with open(path, 'rb+') as f:
+                os.fsync(f.fileno())
+        self._pending = False
+
+
+def _fold(meta, record):
+    """Apply one change log record to gallery.json metadata"""
+    if 'rows' in record:
+        meta['rows'] = max(meta['rows'], record['rows'])
+        meta['dim'] = meta['dim'] or record['dim']
+    persons = meta['persons']
+    for label, key, name in record.get('persons', []):
+        if label == len(persons):
+            persons.append([key, name])
+        else:
+            persons[label] = [key, name]
+    if 'dead' in record and record['dead'] not in meta['dead_labels']:
+        meta['dead_labels'].append(record['dead'])
+
+
+class GalleryStore:
+    """Loads and saves a FaceGallery in the memory-mapped layout"""
+
+    def __init__(self, models_dir):
+        self.models_dir = models_dir
+        self.meta_file = models_dir / "gallery.json"
+        self.generation = 0
+        # The log ends in a torn record, which the next record must not extend
+        self._log_torn = False
+        # Records in the current generation's change log
+        self.log_records = 0
+
+    def _base(self, generation):
+        """Path prefix of a generation's data files"""
+        return self.models_dir / f"gallery.{generation}"
+
+    def exists(self):
+        """Whether a saved gallery exists"""
+        return self.meta_file.exists()
+
+    def saved_metric(self):
+        """Metric of the saved gallery, or None when there is none"""
+        if not self.meta_file.exists():
+            return None
+        with open(self.meta_file, 'r') as f:
+            return json.load(f)['metric']
+
+    def load(self, metric):
+        """
+        Map the saved gallery. Returns None when there is none, or when it
+        was built with a different metric (encodings from another mode).
+        """
+        if not self.meta_file.exists():
+            return None
+        with open(self.meta_file, 'r') as f:
+            meta = json.load(f)
+        if meta['metric'] != metric:
+            return None
+
+        self.generation = meta['generation']
+        records = self._read_log(self.generation)
+        for record in records:
+            _fold(meta, record)
+        self.log_records = len(records)
+        storage = MappedStorage(self._base(self.generation), meta['dim'], meta['rows'])
+        return FaceGallery.open(storage, meta)
+
+    def create_storage(self, generation):
+        """Empty storage for a new generation"""
+        return MappedStorage(self._base(generation))
+
+    def save(self, gallery, generation):
+        """
+        Flush the gallery's rows and atomically record its metadata; the
+        generation's change log is folded in and removed
+        """
+        gallery.storage.flush()
+        meta = gallery.metadata()
+        meta['generation'] = generation
+        temp_file = self.meta_file.with_suffix('.tmp')
+        with open(temp_file, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_file, self.meta_file)
+        self.generation = generation
+        log_file = self._log_file(generation)
+        if log_file.exists():
+            log_file.unlink()
+        self._log_torn = False
+        self.log_records = 0
+
+    def _log_file(self, generation):
+        """Change log of a generation"""
+        return self.models_dir / f"gallery.{generation}.log"
+
+    def _read_log(self, generation):
+        """Records of a generation's change log"""
+        self._log_torn = False
+        log_file = self._log_file(generation)
+        if not log_file.exists():
+            return []
+        records = []
+        with open(log_file, 'r') as f:
+            for line in f:
+                self._log_torn = not line.endswith('\n')
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Torn final line after a crash
+                    continue
+        return records
+
+    def _append_log(self, record):
+        """Append one record to the current generation's change log"""
+        line = json.dumps(record) + '\n'
+        if self._log_torn:
+            line = '\n' + line
+            self._log_torn = False
+        with open(self._log_file(self.generation), 'a') as f:
+            f.write(line)
+        self.log_records += 1
+
+    def log_add(self, gallery, keys):
+        """
+        Record rows appended to the gallery for these persons (ids): the rows
+        are flushed first, then the new row count and the persons' labels
+        are logged, so a row is never counted before it is on disk
+        """
+        gallery.storage.flush()
+        labels = sorted({gallery.label_of(key) for key in keys})
+        self._append_log({
+            'rows': len(gallery),
+            'dim': gallery.storage.dim,
+            'persons': [[label, gallery.keys[label], gallery.names[label]] for label in labels]
+        })
+
+    def log_remove(self, label):
+        """Record a removed (tombstoned) label"""
+        self._append_log({'dead': label})
+
+    def remove_other_generations(self):
+        """Delete data files that do not belong to the current generation"""
+        current = self._base(self.generation).name + "."
+        for path in self.models_dir.glob("gallery.*.*"):
+            if path.name.startswith(current) or path.suffix not in ('.f32', '.i32', '.norms', '.log'):
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                # Still mapped by another process (Windows); retried next time
+                pass
@@ -0,0 +1,115 @@
+"""
+Index Report
+Measures recall and latency of the gallery indexes so an index type and
+nprobe setting can be chosen.
+
+Usage:
+    python backend/index_report.py --synthetic 50000
+    python backend/index_report.py --models-dir models --nprobe 1,4,16
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from gallery import FaceGallery
+from gallery_store import GalleryStore
+from face_index import FlatIndex, IVFIndex
+
+def load_gallery(models_dir, metric):
+    """Map the saved gallery from a models directory"""
+    gallery = GalleryStore(Path(models_dir)).load(metric)
+    return gallery if gallery is not None else FaceGallery(metric=metric)
+
+def synthetic_gallery(size, dim, metric, seed=0):
+    """Random gallery of `size` encodings, several per person"""
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(0.0, 0.1, (size, dim)).astype(np.float32)
+    names = [f"person_{i // 5}" for i in range(size)]
+    gallery = FaceGallery(metric=metric)
+    gallery.build(encodings, names)
+    return gallery
+
+def make_queries(gallery, count, noise, seed=1):
+    """Perturbed copies of random gallery rows, like a new photo of a known face"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(gallery), min(count, len(gallery)), replace=False)
+    base = gallery.matrix[rows]
+    scale = noise * float(np.abs(base).mean())
+    return base + rng.normal(0.0, scale, base.shape).astype(np.float32)
+
+def measure(index, queries):
+    """Run every query; return (results, per-query latencies in ms)"""
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        row, _ = index.search(query)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        results.append(row)
+    return results, np.array(latencies)
+
+def run_report(gallery, queries, nlist, nprobes):
+    """Compare IVF settings against exact search; returns a list of rows"""
+    flat = FlatIndex(gallery).build()
+    truth, flat_lat = measure(flat, queries)
+    report = [{
+        'index': 'flat', 'nprobe': '-', 'build_s': 0.0, 'recall': 1.0,
+        'p50_ms': float(np.percentile(flat_lat, 50)),
+        'p95_ms': float(np.percentile(flat_lat, 95))
+    }]
+
+    start = time.perf_counter()
+    ivf = IVFIndex(gallery, nlist=nlist).build()
+    build_s = time.perf_counter() - start
+
+    for nprobe in nprobes:
+        ivf.nprobe = nprobe
+        found, lat = measure(ivf, queries)
+        recall = float(np.mean([a == b for a, b in zip(found, truth)]))
+        report.append({
+            'index': f'ivf (nlist={len(ivf.lists)})', 'nprobe': nprobe,
+            'build_s': build_s, 'recall': recall,
+            'p50_ms': float(np.percentile(lat, 50)),
+            'p95_ms': float(np.percentile(lat, 95))
+        })
+    return report
+
+def print_report(report, gallery_size):
+    """Print the report as a table"""
+    print(f"Gallery size: {gallery_size}")
+    print(f"{'index':<22}{'nprobe':>8}{'build s':>10}{'recall@1':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for row in report:
+        print(f"{row['index']:<22}{row['nprobe']:>8}{row['build_s']:>10.2f}"
+              f"{row['recall']:>10.3f}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Gallery index recall vs latency report")
+    parser.add_argument('--models-dir', help="Use the trained gallery in this directory")
+    parser.add_argument('--synthetic', type=int, default=50000, help="Synthetic gallery size")
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--metric', default='euclidean', choices=['euclidean', 'cosine'],
+                        help="euclidean for dlib encodings, cosine for OpenCV histogram mode")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--noise', type=float, default=0.3, help="Query perturbation, relative to encoding scale")
+    parser.add_argument('--nlist', type=int, default=0, help="IVF clusters (0 = sqrt of gallery size)")
+    parser.add_argument('--nprobe', default="1,2,4,8,16,32", help="Comma-separated nprobe values")
+    args = parser.parse_args()
+
+    if args.models_dir:
+        gallery = load_gallery(args.models_dir, args.metric)
+    else:
+        gallery = synthetic_gallery(args.synthetic, args.dim, args.metric)
+
+    if not len(gallery):
+        print("Gallery is empty. Enroll some faces first.")
+        return
+
+    queries = make_queries(gallery, args.queries, args.noise)
+    nprobes = [int(n) for n in args.nprobe.split(',')]
+    print_report(run_report(gallery, queries, args.nlist, nprobes), len(gallery))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+Load Test
+End-to-end load generator for the API: replays a weighted mix of
+recognition, statistics and log requests at a target concurrency (closed
+loop) or request rate (open loop), and reports latency percentiles, error
+rates and throughput per endpoint.
+
+Frames are synthetic (no detectable face, so recognition exercises decoding
+and detection) unless --frames points at a folder of recorded frames.
+With --start, the server runs on a temporary data directory holding a
+synthetic gallery of --gallery encodings, so recognition is exercised past
+"model not trained" and nothing is written to the real models or logs.
+With --rate, latency is measured from when each request was due, so time
+spent waiting on a server that falls behind counts against it.
+
+Usage:
+    python backend/load_test.py --start --duration 30
+    python backend/load_test.py --url http://localhost:5000 --concurrency 16 --rate 50
+    python backend/load_test.py --mix mark-attendance=80,attendance-stats=20 --frames recorded/
+"""
+
+import argparse
+import base64
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import requests
+
+from sample_frames import synthetic_frames, load_frames, frame_size
+
+# Endpoint name -> (method, path)
+ENDPOINTS = {
+    'mark-attendance': ('POST', '/api/mark-attendance'),
+    'mark-attendance-frame': ('POST', '/api/mark-attendance/frame'),
+    'attendance-stats': ('GET', '/api/attendance-stats'),
+    'attendance-logs': ('GET', '/api/attendance-logs'),
+    'model-status': ('GET', '/api/model-status')
+}
+
+DEFAULT_MIX = "mark-attendance=60,attendance-stats=30,attendance-logs=10"
+
+REQUEST_TIMEOUT = 30
+
+def parse_mix(text):
+    """[(endpoint, weight)] from "name=weight,name=weight\""""
+    mix = []
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}' (choose from {', '.join(ENDPOINTS)})")
+        mix.append((name, float(weight or 1)))
+    if sum(weight for _, weight in mix) <= 0:
+        raise ValueError("The mix has no weight")
+    return mix
+
+
+class Recorder:
+    """Outcomes and latencies per endpoint, shared by the worker threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+
+    def record(self, endpoint, status, latency_ms):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(latency_ms)
+            counts = self.statuses.setdefault(endpoint, {})
+            counts[status] = counts.get(status, 0) + 1
+
+
+def outcome(endpoint, status):
+    """ok, unrecognized, shed (refused under load) or error"""
+    if isinstance(status, int) and 200 <= status < 300:
+        return 'ok'
+    # "Face not recognized" and "face too poor" are answers, not failures
+    if status in (404, 422) and endpoint.startswith('mark-attendance'):
+        return 'unrecognized'
+    if status in (429, 503):
+        return 'shed'
+    return 'error'
+
+
+class LoadGenerator:
+    """Sends the mix from `concurrency` threads, closed loop or at `rate` requests/s"""
+
+    def __init__(self, url, mix, frames, concurrency, rate=0.0, multi=False, seed=0):
+        self.url = url.rstrip('/')
+        self.names = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.frames = frames
+        self.data_urls = ["data:image/jpeg;base64," + base64.b64encode(f).decode() for f in frames]
+        self.concurrency = concurrency
+        self.rate = rate
+        self.multi = multi
+        self.seed = seed
+        self._slots_lock = threading.Lock()
+
+    def run(self, duration, recorder=None):
+        """Generate load for `duration` seconds; returns the Recorder and the elapsed time"""
+        recorder = recorder or Recorder()
+        self._slots = itertools.count()
+        self._start = time.perf_counter()
+        self._deadline = self._start + duration
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._worker, n, recorder) for n in range(self.concurrency)]
+            for future in futures:
+                future.result()
+        return recorder, time.perf_counter() - self._start
+
+    def _next_due(self):
+        """When the next request is due (open loop), or now (closed loop); None when done"""
+        if self.rate <= 0:
+            now = time.perf_counter()
+            return now if now < self._deadline else None
+        with self._slots_lock:
+            slot = next(self._slots)
+        due = self._start + slot / self.rate
+        return due if due < self._deadline else None
+
+    def _worker(self, number, recorder):
+        rng = random.Random(self.seed * 1000 + number)
+        with requests.Session() as session:
+            while True:
+                due = self._next_due()
+                if due is None:
+                    return
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                endpoint = rng.choices(self.names, self.weights)[0]
+                status = self._send(session, endpoint, rng)
+                recorder.record(endpoint, status, (time.perf_counter() - due) * 1000.0)
+
+    def _send(self, session, endpoint, rng):
+        """HTTP status of one request, or the exception name when it failed"""
+        method, path = ENDPOINTS[endpoint]
+        frame = rng.randrange(len(self.frames))
+        try:
+            if endpoint == 'mark-attendance':
+                payload = {"image": self.data_urls[frame]}
+                if self.multi:
+                    payload["multi"] = True
+                response = session.post(self.url + path, json=payload, timeout=REQUEST_TIMEOUT)
+            elif endpoint == 'mark-attendance-frame':
+                response = session.post(self.url + path, data=self.frames[frame],
+                                        headers={"Content-Type": "image/jpeg"}, timeout=REQUEST_TIMEOUT)
+            else:
+                response = session.request(method, self.url + path, timeout=REQUEST_TIMEOUT)
+            # Read the whole body, as a client would
+            response.content
+            return response.status_code
+        except requests.RequestException as e:
+            return type(e).__name__
+
+
+def summarize(recorder, elapsed):
+    """A result row per endpoint, and one for all of them"""
+    rows = []
+    everything = []
+    totals = {}
+    for endpoint in sorted(recorder.latencies):
+        latencies = recorder.latencies[endpoint]
+        everything.extend(latencies)
+        counts = {'ok': 0, 'unrecognized': 0, 'shed': 0, 'error': 0}
+        for status, count in recorder.statuses[endpoint].items():
+            counts[outcome(endpoint, status)] += count
+        for key, count in counts.items():
+            totals[key] = totals.get(key, 0) + count
+        rows.append(_row(endpoint, latencies, counts, recorder.statuses[endpoint], elapsed))
+    if len(rows) > 1:
+        statuses = {}
+        for endpoint_statuses in recorder.statuses.values():
+            for status, count in endpoint_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+        rows.append(_row('all', everything, totals, statuses, elapsed))
+    return rows
+
+def _row(endpoint, latencies, counts, statuses, elapsed):
+    latencies = np.array(latencies)
+    requests_sent = len(latencies)
+    return {
+        'endpoint': endpoint,
+        'requests': requests_sent,
+        'requests_per_s': requests_sent / elapsed if elapsed > 0 else 0.0,
+        **counts,
+        'error_rate': (counts['error'] + counts['shed']) / requests_sent if requests_sent else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)}
+    }
+
+def print_results(rows, elapsed):
+    """Print the results as a table"""
+    print(f"Duration: {elapsed:.1f}s")
+    print(f"{'endpoint':<24}{'n':>7}{'req/s':>9}{'ok':>7}{'no face':>8}{'shed':>6}{'err':>6}"
+          f"{'err %':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for row in rows:
+        print(f"{row['endpoint']:<24}{row['requests']:>7}{row['requests_per_s']:>9.1f}{row['ok']:>7}"
+              f"{row['unrecognized']:>8}{row['shed']:>6}{row['error']:>6}{row['error_rate'] * 100:>7.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}")
+    for row in rows:
+        unexpected = {s: c for s, c in row['statuses'].items() if not s.startswith('2')}
+        if unexpected and row['endpoint'] != 'all':
+            print(f"  {row['endpoint']}: " + ", ".join(f"{s} x{c}" for s, c in unexpected.items()))
+
+def prepare_data_dir(gallery_size):
+    """Temporary data directory whose models hold a synthetic gallery"""
+    # Imported here: only --start needs the handler
+    from benchmark import populate_gallery
+    from face_recognition_handler import FaceRecognitionHandler
+    
+    data_dir = Path(tempfile.mkdtemp(prefix="attendance_load_"))
+    handler = FaceRecognitionHandler(data_dir / "models")
+    try:
+        populate_gallery(handler, gallery_size)
+    finally:
+        handler.close()
+    return data_dir
+
+def start_server(port, gallery_size, timeout=60):
+    """
+    Start backend/serve.py on `port`, on a temporary data directory with a
+    synthetic gallery, and wait until it answers; returns (server, url, data_dir)
+    """
+    data_dir = prepare_data_dir(gallery_size)
+    server = subprocess.Popen(
+        [sys.executable, str(Path(__file__).parent / "serve.py"),
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=dict(os.environ, DATA_DIR=str(data_dir))
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+            raise SystemExit(f"The server exited with code {server.returncode}")
+        try:
+            requests.get(url + ENDPOINTS['model-status'][1], timeout=1)
+            return server, url, data_dir
+        except requests.RequestException:
+            time.sleep(0.2)
+    stop_server(server, data_dir)
+    raise SystemExit(f"The server did not start within {timeout}s")
+
+def stop_server(server, data_dir=None):
+    """Stop a server started by start_server and delete its data directory"""
+    server.terminate()
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+    if data_dir is not None:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate load against the attendance API")
+    parser.add_argument('--url', default="http://localhost:5000", help="Server to load")
+    parser.add_argument('--start', action='store_true', help="Start backend/serve.py locally and load it")
+    parser.add_argument('--port', type=int, default=5055, help="Port for the server started by --start")
+    parser.add_argument('--gallery', type=int, default=1000,
+                        help="Synthetic gallery size of the server started by --start")
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds of measured load")
+    parser.add_argument('--warmup', type=float, default=2.0, help="Seconds of unmeasured load first")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients")
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help="Target requests/s over all clients (0 = as fast as responses allow)")
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f"Weighted endpoints ({', '.join(ENDPOINTS)})")
+    parser.add_argument('--frames', help="Folder of recorded frames to use instead of synthetic ones")
+    parser.add_argument('--frame-size', default="640x480", help="Synthetic frame size, WxH")
+    parser.add_argument('--multi', action='store_true', help="Recognize every face of a frame (mark-attendance)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if args.frames:
+        frames = load_frames(args.frames)
+        if not frames:
+            raise SystemExit(f"No images found in {args.frames}")
+    else:
+        frames = synthetic_frames(16, *frame_size(args.frame_size))
+
+    server = None
+    data_dir = None
+    url = args.url
+    if args.start:
+        server, url, data_dir = start_server(args.port, args.gallery)
+    try:
+        generator = LoadGenerator(url, mix, frames, args.concurrency, args.rate, args.multi, args.seed)
+        if args.warmup > 0:
+            generator.run(args.warmup)
+        recorder, elapsed = generator.run(args.duration)
+    finally:
+        if server is not None:
+            stop_server(server, data_dir)
+
+    rows = summarize(recorder, elapsed)
+    if not rows:
+        raise SystemExit("No requests were sent")
+    print_results(rows, elapsed)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'url': url,
+                'created': datetime.now().isoformat(),
+                'mix': args.mix,
+                'concurrency': args.concurrency,
+                'rate': args.rate,
+                'duration': elapsed,
+                'frames': args.frames or f"synthetic {args.frame_size}",
+                'results': rows
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
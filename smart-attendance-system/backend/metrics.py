@@ -0,0 +1,171 @@
+"""
+Metrics
+Per-stage timers and counters for recognition, enrollment, training and
+attendance logging, served on /metrics in the Prometheus text format.
+
+Collection is off unless METRICS_ENABLED is set. Instrumented code checks
+`metrics.ENABLED` before timing anything, so a server without metrics only
+pays for that check. Stage times come from the same per-stage timing dicts
+(milliseconds, keys ending in _ms) that the recognition endpoints return.
+"""
+
+import bisect
+import threading
+import time
+
+import config
+
+ENABLED = config.METRICS_ENABLED
+
+# Upper bounds of the histogram buckets: seconds, and faces in a frame
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FACE_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 32)
+
+_registry = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """A metric family: one value per combination of label values"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def set_function(self, function):
+        """
+        Read the value when scraped instead: function() returns a number,
+        or {label values tuple: number}
+        """
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            value = self._function()
+            values = value if isinstance(value, dict) else {(): value}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+    def render(self):
+        """Exposition lines of this family"""
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Per-bucket counts (the last one past every bound), sum, count
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._values.items()}
+        for labels, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', _number(bound))])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+OPERATION_SECONDS = Histogram(
+    'attendance_operation_duration_seconds', "Time spent per operation", ('operation',)
+)
+STAGE_SECONDS = Histogram(
+    'attendance_stage_duration_seconds', "Time spent per stage of an operation", ('operation', 'stage')
+)
+FACES_PER_FRAME = Histogram(
+    'attendance_faces_per_frame', "Faces detected per recognized frame", ('operation',), buckets=FACE_BUCKETS
+)
+RECOGNITIONS = Counter(
+    'attendance_recognitions_total', "Frames recognized, by result", ('operation', 'result')
+)
+ENROLLMENTS = Counter('attendance_enrollments_total', "Images enrolled, by result", ('result',))
+CHECKINS = Counter('attendance_checkins_total', "Persons logged")
+GALLERY_ENCODINGS = Gauge('attendance_gallery_encodings', "Encodings in the gallery", ('state',))
+PERSONS = Gauge('attendance_persons', "Enrolled persons")
+ENCODING_CACHE_ENTRIES = Gauge('attendance_encoding_cache_entries', "Entries in the encoding cache")
+ENCODING_CACHE_REQUESTS = Counter(
+    'attendance_encoding_cache_requests_total', "Encoding cache lookups, by result", ('result',)
+)
+ENCODING_POOL_IN_FLIGHT = Gauge(
+    'attendance_encoding_pool_in_flight', "Frames queued or being encoded by worker processes"
+)
+QUALITY_REJECTIONS = Counter(
+    'attendance_quality_rejections_total', "Faces rejected by the quality checks before encoding", ('reason',)
+)
+STARTUP_SECONDS = Gauge('attendance_startup_seconds', "Time spent per startup stage", ('stage',))
+
+def observe(operation, start, timings=None):
+    """Record an operation begun at perf_counter() `start`, and its stage timings in ms"""
+    OPERATION_SECONDS.observe(time.perf_counter() - start, (operation,))
+    if timings:
+        for key, milliseconds in timings.items():
+            if key.endswith('_ms'):
+                STAGE_SECONDS.observe(milliseconds / 1000.0, (operation, key[:-3]))
+
+def observe_frame(operation, start, timings, faces, recognized):
+    """Record a recognized frame: timings, faces found and how many were recognized"""
+    observe(operation, start, timings)
+    FACES_PER_FRAME.observe(faces, (operation,))
+    result = 'no_face' if faces == 0 else ('recognized' if recognized else 'unrecognized')
+    RECOGNITIONS.inc(1, (operation, result))
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,51 @@
+"""
+Migrate Logs
+Copies attendance from the per-day files in attendance_logs/ (both the
+attendance_{date}.json files of earlier versions and the .jsonl journals)
+into the SQLite database used when ATTENDANCE_STORAGE=sqlite.
+
+Usage:
+    python backend/migrate_logs.py
+    python backend/migrate_logs.py --logs-dir attendance_logs --db attendance_logs/attendance.db
+
+Safe to re-run: entries already in the database are replaced, not merged.
+"""
+
+import argparse
+from pathlib import Path
+
+import config
+from attendance_storage import JournalStorage, SQLiteStorage
+
+def migrate(logs_dir, db_path):
+    """Copy every day of file-based logs into SQLite; returns (days, entries)"""
+    journal = JournalStorage(logs_dir)
+    database = SQLiteStorage(db_path)
+    days = 0
+    entries = 0
+    try:
+        for date in journal.dates():
+            rows = [(date, *entry) for entry in journal.day_entries(date)]
+            database.import_entries(rows, replace=True)
+            days += 1
+            entries += len(rows)
+            print(f"{date}: {len(rows)} entries")
+    finally:
+        journal.close()
+        database.close()
+    return days, entries
+
+def main():
+    base_dir = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser(description="Migrate attendance logs to SQLite")
+    parser.add_argument('--logs-dir', default=str(base_dir / "attendance_logs"))
+    parser.add_argument('--db', help="Database file (default: <logs-dir>/ATTENDANCE_DB)")
+    args = parser.parse_args()
+
+    logs_dir = Path(args.logs_dir)
+    db_path = Path(args.db) if args.db else logs_dir / config.ATTENDANCE_DB
+    days, entries = migrate(logs_dir, db_path)
+    print(f"Migrated {entries} entries from {days} days into {db_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""
+Sample Frames
+Frames for benchmark.py and load_test.py: synthetic JPEGs, or photos read
+from a folder.
+"""
+
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+def synthetic_frames(count, width, height, seed=0):
+    """JPEG frames of smooth random images (compressing like photos, not noise)"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        small = rng.integers(0, 255, (height // 16, width // 16, 3), dtype=np.uint8)
+        image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+        frames.append(cv2.imencode('.jpg', image)[1].tobytes())
+    return frames
+
+def load_frames(folder):
+    """Encoded images from a folder of photos"""
+    paths = sorted(p for p in Path(folder).rglob('*') if p.suffix.lower() in ('.jpg', '.jpeg', '.png'))
+    return [p.read_bytes() for p in paths]
+
+def frame_size(text):
+    """(width, height) from "WxH\""""
+    width, height = (int(v) for v in text.lower().split('x'))
+    return width, height
@@ -0,0 +1,41 @@
+"""
+Serve
+Production launcher: runs the API in ASGI mode (see asgi.py) under uvicorn
+instead of Flask's debug server.
+
+Usage:
+    python backend/serve.py
+    python backend/serve.py --host 0.0.0.0 --port 5000
+
+The server runs as one process: attendance, statistics and camera sessions
+live in it. Set ENCODE_WORKERS to spread face encoding over every core.
+"""
+
+import argparse
+
+import config
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Smart Attendance API server")
+    parser.add_argument('--host', default=config.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=config.SERVER_PORT)
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("uvicorn is required: pip install uvicorn")
+
+    # Imported by name so encoding worker processes, which re-import this
+    # module, never load the server
+    uvicorn.run(
+        "asgi:app",
+        host=args.host,
+        port=args.port,
+        log_level=args.log_level,
+        proxy_headers=True
+    )
+
+if __name__ == '__main__':
+    main()
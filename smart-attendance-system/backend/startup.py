@@ -0,0 +1,72 @@
+"""
+Startup
+Tracks how long the server takes to start and to become ready: module
+imports, handler construction, and the warmup that loads libraries and
+models ahead of the first request (see FaceRecognitionHandler.warmup).
+Warmup runs in a background thread, at startup (WARMUP_ON_START) or when
+readiness is first asked for (GET /api/ready).
+"""
+
+import threading
+import time
+
+import metrics
+from timing import elapsed_ms
+
+class Startup:
+    """Startup stage timings and readiness of one server process"""
+
+    def __init__(self, started):
+        # perf_counter() reading when the server process began starting
+        self.started = started
+        self.timings = {}
+        self.state = 'starting'
+        self.error = None
+        self._thread = None
+        self._lock = threading.Lock()
+        if metrics.ENABLED:
+            metrics.STARTUP_SECONDS.set_function(lambda: {
+                (stage[:-3],): ms / 1000.0 for stage, ms in list(self.timings.items())
+            })
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def record(self, stage, start):
+        """Time of a startup stage begun at perf_counter() `start`"""
+        self.timings[f"{stage}_ms"] = elapsed_ms(start)
+
+    def warm_up(self, warmup):
+        """Run warmup() (returning stage timings in ms) in the background, once"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.state = 'warming'
+            self._thread = threading.Thread(target=self._run, args=(warmup,), daemon=True)
+            self._thread.start()
+
+    def _run(self, warmup):
+        start = time.perf_counter()
+        try:
+            self.timings.update(warmup())
+        except Exception as e:
+            self.error = str(e)
+            self.state = 'failed'
+            print(f"Error warming up: {str(e)}")
+            return
+        self.record('warmup', start)
+        self.timings['ready_ms'] = elapsed_ms(self.started)
+        self.state = 'ready'
+        print(
+            f"Ready in {self.timings['ready_ms']:.0f} ms ("
+            + ", ".join(f"{stage[:-3]} {ms:.0f} ms" for stage, ms in self.timings.items() if stage != 'ready_ms')
+            + ")"
+        )
+
+    def status(self):
+        """Readiness and startup timings, for the readiness endpoint"""
+        status = {"state": self.state, "ready": self.ready, "timings": dict(self.timings)}
+        if self.error is not None:
+            status["error"] = self.error
+        return status
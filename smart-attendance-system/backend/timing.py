@@ -0,0 +1,10 @@
+"""
+Timing
+Helpers for per-stage timings reported by the recognition endpoints
+"""
+
+import time
+
+def elapsed_ms(start):
+    """Milliseconds since a perf_counter() reading"""
+    return round((time.perf_counter() - start) * 1000.0, 3)
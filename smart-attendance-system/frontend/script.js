@@ -3,6 +3,7 @@
 const API_BASE_URL = 'http://localhost:5000/api';
 let currentPersonId = null;
 let cameraStream = null;
+let attendanceStream = null;
 
 /* ==================== INITIALIZATION ==================== */
 
@@ -21,6 +22,9 @@ function initializeApp() {
     loadAttendanceLogs();
     setDefaultLogDate();
     
+    // Live attendance updates
+    connectAttendanceStream();
+    
     // Setup navigation
     setupNavigation();
     
@@ -119,7 +123,12 @@ async function loadModelStatus() {
         const response = await fetch(`${API_BASE_URL}/model-status`);
         const data = await response.json();
         if (data.status === 'success') {
-            const status = data.is_trained ? '✅ Trained' : '⚠️ Not Trained';
+            let status = data.is_trained ? '✅ Trained' : '⚠️ Not Trained';
+            // Persons whose images must be uploaded again (encodings from an older version)
+            const reenroll = (data.stats && data.stats.persons_to_reenroll) || [];
+            if (reenroll.length) {
+                status = `⚠️ Re-upload photos: ${reenroll.join(', ')}`;
+            }
             document.getElementById('model-status').textContent = status;
             if (data.stats) {
                 document.getElementById('faces-encoded').textContent = data.stats.total_encoded_faces || 0;
@@ -325,39 +334,60 @@ function initializeCamera() {
     }
 }
 
-function captureAndMarkAttendance() {
+// Frames captured per click; more than one sends a short burst, which
+// helps with blinks and motion blur but costs the server an encode per frame
+const BURST_FRAMES = 1;
+const BURST_INTERVAL_MS = 150;
+
+async function captureAndMarkAttendance() {
     const video = document.getElementById('camera-feed');
     const canvas = document.getElementById('camera-canvas');
     const ctx = canvas.getContext('2d');
     
     canvas.width = video.videoWidth;
     canvas.height = video.videoHeight;
-    ctx.drawImage(video, 0, 0);
     
-    const imageData = canvas.toDataURL('image/jpeg');
-    markAttendance(imageData);
+    // Capture the frame (or burst) and send it as one batch request
+    const frames = [];
+    for (let i = 0; i < BURST_FRAMES; i++) {
+        if (i > 0) {
+            await new Promise(resolve => setTimeout(resolve, BURST_INTERVAL_MS));
+        }
+        ctx.drawImage(video, 0, 0);
+        frames.push(await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg')));
+    }
+    markAttendanceBatch(frames);
 }
 
-async function markAttendance(imageBase64) {
+async function markAttendanceBatch(frames) {
     try {
         document.getElementById('attendance-status').textContent = 'Processing...';
         
-        const response = await fetch(`${API_BASE_URL}/mark-attendance`, {
+        const formData = new FormData();
+        frames.forEach((frame, i) => formData.append('frames', frame, `frame_${i}.jpg`));
+        
+        const response = await fetch(`${API_BASE_URL}/mark-attendance/batch`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ image: imageBase64 })
+            body: formData
         });
         
         const data = await response.json();
         
         if (data.status === 'success') {
-            document.getElementById('last-person').textContent = data.person;
+            const names = data.persons.join(', ');
+            document.getElementById('last-person').textContent = names;
             document.getElementById('attendance-status').textContent = '✅ Marked!';
-            showNotification('Attendance marked for ' + data.person);
-            loadTodayStats();
+            showNotification('Attendance marked for ' + names);
+        } else if (data.status === 'warning' && data.reason) {
+            // Face too small, blurry, badly lit or turned away
+            document.getElementById('attendance-status').textContent = '⚠️ Poor Image';
+            showNotification(data.message + '. Please try again.', 'warning');
         } else if (data.status === 'warning') {
             document.getElementById('attendance-status').textContent = '⚠️ Not Recognized';
             showNotification('Face not recognized. Please try again.', 'warning');
+        } else {
+            document.getElementById('attendance-status').textContent = '❌ Error';
+            showNotification('Error marking attendance: ' + data.message, 'error');
         }
     } catch (error) {
         document.getElementById('attendance-status').textContent = '❌ Error';
@@ -386,47 +416,97 @@ function displayAttendanceLogs(logs) {
     const tbody = document.getElementById('logs-tbody');
     tbody.innerHTML = '';
     
-    logs.forEach(log => {
-        const row = tbody.insertRow();
-        row.innerHTML = `
-            <td>${log.person_name}</td>
-            <td>${formatTime(log.timestamp)}</td>
-            <td>${log.checkout_time ? formatTime(log.checkout_time) : '-'}</td>
-            <td>${log.duration || '-'}</td>
-        `;
-    });
+    logs.forEach(log => fillLogRow(tbody.insertRow(), log));
     
     if (logs.length === 0) {
         tbody.innerHTML = '<tr><td colspan="4" style="text-align: center; padding: 20px;">No attendance records for this date</td></tr>';
     }
 }
 
+function fillLogRow(row, log) {
+    row.dataset.person = log.person_name;
+    row.innerHTML = `
+        <td>${log.person_name}</td>
+        <td>${formatTime(log.timestamp)}</td>
+        <td>${log.checkout_time ? formatTime(log.checkout_time) : '-'}</td>
+        <td>${log.duration || '-'}</td>
+    `;
+}
+
+function upsertLogRow(log) {
+    // Only the table showing the event's day is updated
+    if (document.getElementById('log-date').value !== log.date) return;
+    
+    const tbody = document.getElementById('logs-tbody');
+    let row = Array.from(tbody.rows).find(r => r.dataset.person === log.person_name);
+    if (!row) {
+        if (tbody.rows.length === 1 && !tbody.rows[0].dataset.person) {
+            tbody.innerHTML = '';  // "No attendance records" placeholder
+        }
+        row = tbody.insertRow();
+    }
+    fillLogRow(row, log);
+}
+
 function formatTime(isoString) {
     if (!isoString) return '-';
     const date = new Date(isoString);
     return date.toLocaleTimeString('en-US', { hour: '2-digit', minute: '2-digit' });
 }
 
+/* ==================== LIVE UPDATES ==================== */
+
+function connectAttendanceStream() {
+    // EventSource reconnects by itself; each connection starts with a snapshot
+    attendanceStream = new EventSource(`${API_BASE_URL}/attendance/stream`);
+    
+    attendanceStream.addEventListener('snapshot', event => {
+        const stats = JSON.parse(event.data);
+        document.getElementById('present-today').textContent = stats.total_present || 0;
+    });
+    
+    attendanceStream.addEventListener('stats', event => {
+        const delta = JSON.parse(event.data);
+        document.getElementById('present-today').textContent = delta.total_present;
+    });
+    
+    attendanceStream.addEventListener('checkin', event => upsertLogRow(JSON.parse(event.data)));
+    attendanceStream.addEventListener('checkout', event => upsertLogRow(JSON.parse(event.data)));
+    
+    // Events were dropped because this client fell behind: refetch
+    attendanceStream.addEventListener('resync', () => {
+        loadTodayStats();
+        loadAttendanceLogs();
+    });
+}
+
 /* ==================== DATASETS ==================== */
 
 async function loadAvailableDatasets() {
     try {
-        const response = await fetch(`${API_BASE_URL}/datasets/available`);
+        const [response, downloadedResponse] = await Promise.all([
+            fetch(`${API_BASE_URL}/datasets/available`),
+            fetch(`${API_BASE_URL}/datasets`)
+        ]);
         const data = await response.json();
+        const downloaded = await downloadedResponse.json();
         
         if (data.status === 'success') {
-            displayAvailableDatasets(data.datasets);
+            const inventory = {};
+            (downloaded.datasets || []).forEach(d => inventory[d.name] = d);
+            displayAvailableDatasets(data.datasets, inventory);
         }
     } catch (error) {
         console.error('Error loading datasets:', error);
     }
 }
 
-function displayAvailableDatasets(datasets) {
+function displayAvailableDatasets(datasets, inventory = {}) {
     const grid = document.getElementById('datasets-grid');
     grid.innerHTML = '';
     
     datasets.forEach(dataset => {
+        const local = inventory[dataset.id];
         const card = document.createElement('div');
         card.className = 'dataset-card';
         card.innerHTML = `
@@ -436,6 +516,7 @@ function displayAvailableDatasets(datasets) {
                 <p>👥 ${dataset.people_count} people</p>
                 <p>📦 ${dataset.size}</p>
             </div>
+            ${local ? `<p class="dataset-meta">✅ Downloaded: ${local.people_count} people, ${local.image_count} images, ${local.size_mb} MB</p>` : ''}
             <button class="btn btn-primary" onclick="downloadDataset('${dataset.id}')">
                 Download
             </button>
@@ -458,6 +539,9 @@ async function downloadDataset(datasetId) {
         
         if (data.status === 'success') {
             showNotification('Dataset downloaded successfully!');
+            loadAvailableDatasets();
+        } else {
+            showNotification('Error downloading dataset: ' + data.message, 'error');
         }
     } catch (error) {
         showNotification('Error downloading dataset: ' + error.message, 'error');
@@ -492,23 +576,64 @@ async function uploadDataset() {
     
     if (!file) return;
     
-    const formData = new FormData();
-    formData.append('file', file);
+    const progress = document.getElementById('dataset-progress');
+    const enroll = document.getElementById('dataset-enroll').checked;
+    const name = file.name.split('.')[0];
     
     try {
         showNotification('Uploading dataset...', 'info');
         
-        const response = await fetch(`${API_BASE_URL}/datasets/import-local`, {
+        // The archive is sent as-is and extracted while it uploads;
+        // progress comes back as one JSON object per line
+        const response = await fetch(
+            `${API_BASE_URL}/datasets/import?name=${encodeURIComponent(name)}&enroll=${enroll ? 1 : 0}`, {
             method: 'POST',
-            body: formData
+            headers: { 'Content-Type': 'application/octet-stream' },
+            body: file
         });
         
-        const data = await response.json();
+        if (!response.ok) {
+            const data = await response.json();
+            throw new Error(data.message);
+        }
         
-        if (data.status === 'success') {
-            showNotification('Dataset uploaded successfully!');
-            fileInput.value = '';
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        let result = null;
+        
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            
+            buffered += decoder.decode(value, { stream: true });
+            const lines = buffered.split('\n');
+            buffered = lines.pop();
+            
+            for (const line of lines) {
+                if (!line) continue;
+                const event = JSON.parse(line);
+                
+                if (event.type === 'error') {
+                    throw new Error(event.message);
+                } else if (event.type === 'extracted') {
+                    progress.textContent = `Extracted ${event.files} images (${(event.bytes / (1024 * 1024)).toFixed(1)} MB)`;
+                } else if (event.type === 'progress') {
+                    progress.textContent = `Enrolled ${event.done} images`;
+                } else if (event.type === 'imported' || event.type === 'result') {
+                    result = event;
+                }
+            }
+        }
+        
+        if (result && result.type === 'result') {
+            progress.textContent = `Enrolled ${result.images_enrolled} images, added ${result.persons_added} persons`;
+            loadPersons();
+        } else if (result) {
+            progress.textContent = `Imported ${result.files} images`;
         }
+        showNotification('Dataset uploaded successfully!');
+        fileInput.value = '';
     } catch (error) {
         showNotification('Error uploading dataset: ' + error.message, 'error');
     }
@@ -0,0 +1,56 @@
+import base64
+import io
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import config
+from face_recognition_handler import FaceRecognitionHandler
+
+
+class FakeCascade:
+    """Stands in for the Haar cascade: every frame has faces at fixed boxes (x, y, w, h)"""
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+    def detectMultiScale(self, image, *args, **kwargs):
+        return np.array(self.boxes).reshape(-1, 4)
+
+    def empty(self):
+        return False
+
+
+def jpeg(seed=0, low=0, high=255, width=160, height=120):
+    """
+    JPEG bytes of a noise image with pixel values in [low, high) (sharp and
+    not too dark or bright, so it passes the quality checks)
+    """
+    rng = np.random.default_rng(seed)
+    return encode_jpeg(rng.integers(low, high, (height, width, 3), dtype=np.uint8))
+
+
+def encode_jpeg(pixels):
+    """JPEG bytes of an RGB pixel array"""
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def data_url(image_data):
+    return "data:image/jpeg;base64," + base64.b64encode(image_data).decode()
+
+
+@pytest.fixture
+def handler(tmp_path, monkeypatch):
+    """Handler on an empty models directory, without background compaction or workers"""
+    monkeypatch.setattr(config, 'GALLERY_COMPACT_INTERVAL', 0)
+    monkeypatch.setattr(config, 'ENCODE_WORKERS', 0)
+    face_handler = FaceRecognitionHandler(tmp_path / "models")
+    yield face_handler
+    face_handler.close()
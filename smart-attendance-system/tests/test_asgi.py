@@ -0,0 +1,139 @@
+import asyncio
+import importlib
+import io
+import json
+import sys
+import tarfile
+
+import pytest
+
+import config
+from conftest import jpeg
+
+
+@pytest.fixture(scope='module')
+def asgi(tmp_path_factory):
+    """The ASGI app, with the server's data under a temporary directory"""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(config, 'DATA_DIR', tmp_path_factory.mktemp("data"))
+        monkeypatch.setattr(config, 'GALLERY_COMPACT_INTERVAL', 0)
+        monkeypatch.setattr(config, 'ENCODE_WORKERS', 0)
+        monkeypatch.setattr(config, 'WARMUP_ON_START', False)
+        monkeypatch.setattr(config, 'ATTENDANCE_STORAGE', 'journal')
+        module = importlib.import_module('asgi')
+        yield module
+        assert asyncio.run(lifespan(module, ['lifespan.startup', 'lifespan.shutdown'])) == [
+            'lifespan.startup.complete', 'lifespan.shutdown.complete'
+        ]
+    sys.modules.pop('asgi')
+    sys.modules.pop('app')
+
+
+async def lifespan(module, messages):
+    sent = []
+
+    async def receive():
+        return {'type': messages.pop(0)}
+
+    async def send(message):
+        sent.append(message['type'])
+
+    await module.app({'type': 'lifespan'}, receive, send)
+    return sent
+
+
+def request(asgi, method, path, body=b'', headers=(), query=b'', chunk_size=None):
+    """(status, headers, body) of one HTTP request, its body sent in chunks of `chunk_size`"""
+    chunk_size = chunk_size or max(len(body), 1)
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b'']
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'path': path,
+        'query_string': query, 'headers': [(k.encode(), v.encode()) for k, v in headers]
+    }
+    asyncio.run(asgi.app(scope, receive, send))
+    start = sent[0]
+    assert start['type'] == 'http.response.start'
+    assert not sent[-1].get('more_body', False)
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    return start['status'], {k.decode().lower(): v.decode() for k, v in start['headers']}, body
+
+
+def test_requests_are_served_by_the_flask_views(asgi):
+    body = json.dumps({"name": "Alice"}).encode()
+    status, _, response = request(asgi, 'POST', '/api/persons', body,
+                                  [('Content-Type', 'application/json')], chunk_size=4)
+    assert status == 200
+    person_id = json.loads(response)['person_id']
+
+    status, headers, response = request(asgi, 'GET', '/api/persons')
+    assert status == 200
+    assert headers['content-type'] == 'application/json'
+    assert [person['id'] for person in json.loads(response)['persons']] == [person_id]
+
+    assert request(asgi, 'GET', '/api/missing')[0] == 404
+
+
+def test_statistics_are_revalidated(asgi):
+    status, headers, _ = request(asgi, 'GET', '/api/attendance-stats')
+    assert status == 200
+
+    status, _, body = request(asgi, 'GET', '/api/attendance-stats', headers=[('If-None-Match', headers['etag'])])
+    assert (status, body) == (304, b'')
+
+
+def test_archive_import_is_read_while_it_arrives(asgi):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as archive:
+        for person in ("alice", "bob"):
+            data = jpeg()
+            info = tarfile.TarInfo(f"{person}/1.jpg")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+    status, _, body = request(asgi, 'POST', '/api/datasets/import', buffer.getvalue(),
+                              query=b'name=team', chunk_size=1000)
+
+    assert status == 200
+    events = [json.loads(line) for line in body.splitlines()]
+    assert events[-1]['type'] == 'imported'
+    assert sorted(p.name for p in (config.DATA_DIR / "datasets" / "team").iterdir()) == ["alice", "bob"]
+
+
+def test_attendance_stream_sends_a_snapshot_then_checkins(asgi):
+    sent = []
+    disconnect = asyncio.Event()
+
+    async def receive():
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+        body = message.get('body', b'')
+        if b'event: snapshot' in body:
+            asyncio.get_running_loop().run_in_executor(None, asgi.attendance_logger.log_attendance, "Alice")
+        elif b'event: stats' in body:
+            disconnect.set()
+
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET',
+             'path': '/api/attendance/stream', 'query_string': b'', 'headers': []}
+    asyncio.run(asyncio.wait_for(asgi.app(scope, receive, send), 10))
+
+    assert sent[0]['status'] == 200
+    text = b''.join(message.get('body', b'') for message in sent[1:]).decode()
+    assert [line for line in text.splitlines() if line.startswith('event:')] == [
+        'event: snapshot', 'event: checkin', 'event: stats'
+    ]
+    assert not asgi.attendance_logger.events.has_subscribers
@@ -0,0 +1,74 @@
+import os
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from attendance_logger import AttendanceLogger
+
+
+@pytest.fixture
+def new_york():
+    """Run with the local time zone set away from UTC"""
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = 'America/New_York'
+    time.tzset()
+    yield
+    if previous is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = previous
+    time.tzset()
+
+
+@pytest.mark.parametrize('storage', ['journal', 'sqlite'])
+def test_statistics_last_modified_is_the_last_checkin_in_utc(tmp_path, new_york, storage):
+    logger = AttendanceLogger(tmp_path, storage)
+    logger.get_statistics()
+    before = datetime.now(timezone.utc)
+    logger.log_attendance("Alice")
+    timestamp = logger.log_attendance("Bob")
+    stats, etag, modified = logger.get_statistics_cached()
+    logger.close()
+
+    assert modified.tzinfo is not None
+    assert modified == datetime.fromisoformat(timestamp).astimezone(timezone.utc)
+    assert before <= modified <= datetime.now(timezone.utc)
+    assert stats['last_updated'] == modified.isoformat()
+
+    # A restarted server loads the day with the same validators
+    reloaded = AttendanceLogger(tmp_path, storage)
+    assert reloaded.get_statistics_cached()[1:] == (etag, modified)
+    assert reloaded.statistics_etag() == etag
+    reloaded.log_attendance("Alice")
+    assert reloaded.statistics_etag() != etag
+    assert reloaded.get_statistics_cached()[2] > modified
+    reloaded.close()
+
+
+@pytest.mark.parametrize('storage', ['journal', 'sqlite'])
+def test_cached_statistics_match_statistics_rebuilt_from_storage(tmp_path, storage):
+    logger = AttendanceLogger(tmp_path, storage)
+    logger.log_attendance("Alice")
+    # Cached from here on; later check-ins update it in place
+    etag = logger.statistics_etag()
+    logger.log_attendance_many(["Bob", "Alice", "Carol"])
+    logger.log_attendance("Bob")
+    stats = logger.get_statistics()
+    assert logger.statistics_etag() != etag
+    etag = logger.statistics_etag()
+    assert logger.get_statistics_cached()[1] == etag
+    logger.close()
+
+    assert stats['total_present'] == 3
+    assert stats['total_marked'] == 5
+    assert stats['unique_persons'] == ["Alice", "Bob", "Carol"]
+    assert sum(stats['hourly_checkins']) == 3
+
+    reloaded = AttendanceLogger(tmp_path, storage)
+    rebuilt = reloaded.get_statistics()
+    assert {key: rebuilt[key] for key in rebuilt if key != 'unique_persons'} == \
+        {key: stats[key] for key in stats if key != 'unique_persons'}
+    assert sorted(rebuilt['unique_persons']) == stats['unique_persons']
+    assert reloaded.statistics_etag() == etag
+    reloaded.close()
@@ -0,0 +1,164 @@
+import json
+
+import pytest
+
+import attendance_storage
+import config
+from attendance_storage import JournalStorage, SQLiteStorage
+from migrate_logs import migrate
+
+DATE = "2024-03-01"
+
+# A day as earlier versions wrote it: one entry per mark, with the latest
+# check-out copied onto the person's earlier entries
+LEGACY_LOGS = [
+    {'person_name': "Alice", 'timestamp': f"{DATE}T09:00:00", 'checkout_time': f"{DATE}T17:00:00", 'duration': '8h 0m'},
+    {'person_name': "Bob", 'timestamp': f"{DATE}T09:30:00", 'checkout_time': None, 'duration': '0m'},
+    {'person_name': "Alice", 'timestamp': f"{DATE}T12:00:00", 'checkout_time': f"{DATE}T17:00:00", 'duration': '5h 0m'},
+    {'person_name': "Alice", 'timestamp': f"{DATE}T17:00:00", 'checkout_time': None, 'duration': '0m'},
+]
+
+
+def legacy_statistics(logs):
+    """(total_present, total_marked) as earlier versions computed them"""
+    return len({log['person_name'] for log in logs}), len(logs)
+
+
+def statistics(storage, date):
+    return len(storage.day_logs(date)), storage.marked_count(date)
+
+
+def test_legacy_day_keeps_its_statistics_through_the_journal_and_sqlite(tmp_path):
+    (tmp_path / f"attendance_{DATE}.json").write_text(json.dumps(LEGACY_LOGS))
+    expected = legacy_statistics(LEGACY_LOGS)
+
+    journal = JournalStorage(tmp_path)
+    assert statistics(journal, DATE) == expected
+    assert sorted(journal.day_entries(DATE)) == [
+        ("Alice", f"{DATE}T09:00:00", f"{DATE}T17:00:00", 3),
+        ("Bob", f"{DATE}T09:30:00", None, 1),
+    ]
+    journal.close()
+
+    assert migrate(tmp_path, tmp_path / "attendance.db") == (1, 2)
+    database = SQLiteStorage(tmp_path / "attendance.db")
+    assert statistics(database, DATE) == expected
+    assert database.day_logs(DATE, "Alice")[0]['duration'] == '8h 0m'
+
+    # Re-running the migration replaces the entries instead of adding marks
+    database.close()
+    migrate(tmp_path, tmp_path / "attendance.db")
+    database = SQLiteStorage(tmp_path / "attendance.db")
+    assert statistics(database, DATE) == expected
+    database.close()
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    """JournalStorage that fsyncs every write, without the background thread"""
+    monkeypatch.setattr(config, 'ATTENDANCE_FSYNC_INTERVAL', 0)
+    storage = JournalStorage(tmp_path)
+    yield storage
+    storage.close()
+
+
+def record_day(storage):
+    storage.record(DATE, ["Alice", "Bob"], f"{DATE}T09:00:00")
+    storage.record(DATE, ["Alice"], f"{DATE}T12:00:00")
+    storage.record(DATE, ["Alice"], f"{DATE}T17:30:00")
+
+
+def test_journal_appends_check_ins_and_indexes_them_by_person(journal, tmp_path):
+    record_day(journal)
+
+    assert journal.day_logs(DATE, "Alice") == [{
+        'person_name': "Alice",
+        'timestamp': f"{DATE}T09:00:00",
+        'checkout_time': f"{DATE}T17:30:00",
+        'duration': '8h 30m'
+    }]
+    assert journal.marked_count(DATE) == 4
+    lines = (tmp_path / f"attendance_{DATE}.jsonl").read_text().splitlines()
+    assert [json.loads(line)['person_name'] for line in lines] == ["Alice", "Bob", "Alice", "Alice"]
+
+
+def test_journal_is_rebuilt_from_disk_past_a_torn_line(journal, tmp_path, monkeypatch):
+    record_day(journal)
+    expected = (journal.day_logs(DATE), journal.marked_count(DATE))
+    journal.close()
+    with open(tmp_path / f"attendance_{DATE}.jsonl", 'a') as f:
+        f.write('{"person_name": "Ca')
+
+    monkeypatch.setattr(config, 'ATTENDANCE_FSYNC_INTERVAL', 0)
+    reopened = JournalStorage(tmp_path)
+    assert (reopened.day_logs(DATE), reopened.marked_count(DATE)) == expected
+    assert reopened.dates() == [DATE]
+    # The next check-in starts on a line of its own
+    reopened.record(DATE, ["Carol"], f"{DATE}T18:00:00")
+    reopened.close()
+
+    reopened = JournalStorage(tmp_path)
+    assert reopened.marked_count(DATE) == 5
+    assert reopened.day_logs(DATE, "Carol")[0]['timestamp'] == f"{DATE}T18:00:00"
+    reopened.close()
+
+
+def test_journal_keeps_a_bounded_number_of_days_in_memory(journal, monkeypatch):
+    monkeypatch.setattr(attendance_storage, 'CACHED_DAYS', 2)
+    journal.record("2024-03-05", ["Alice"], "2024-03-05T09:00:00")
+    for day in range(1, 5):
+        journal.record(f"2024-02-0{day}", ["Bob"], f"2024-02-0{day}T09:00:00")
+    journal.record("2024-03-05", ["Carol"], "2024-03-05T09:00:00")
+
+    assert len(journal._days) == 3
+    # Evicted days are read back from their journals
+    assert journal.marked_count("2024-02-01") == 1
+    result = journal.query(start_date="2024-02-02", end_date="2024-03-05", person_name="Bob")
+    assert result['total'] == 3
+    assert [log['date'] for log in result['logs']] == ["2024-02-02", "2024-02-03", "2024-02-04"]
+
+
+def test_sqlite_matches_the_journal_and_persists(journal, tmp_path):
+    database = SQLiteStorage(tmp_path / "attendance.db")
+    for storage in (journal, database):
+        record_day(storage)
+        storage.record("2024-03-02", ["Bob"], "2024-03-02T08:00:00")
+
+    for date in (DATE, "2024-03-02", "2024-03-03"):
+        assert database.day_logs(date) == sorted(journal.day_logs(date), key=lambda log: log['timestamp'])
+        assert database.marked_count(date) == journal.marked_count(date)
+    database.close()
+
+    reopened = SQLiteStorage(tmp_path / "attendance.db")
+    assert reopened.day_logs(DATE, "Alice") == journal.day_logs(DATE, "Alice")
+    assert reopened.marked_count(DATE) == 4
+    reopened.close()
+
+
+def test_sqlite_queries_ranges_by_person_one_page_at_a_time(tmp_path):
+    database = SQLiteStorage(tmp_path / "attendance.db")
+    for day in range(1, 8):
+        database.record(f"2024-03-0{day}", ["Alice", "Bob"], f"2024-03-0{day}T09:00:00")
+
+    result = database.query(start_date="2024-03-02", end_date="2024-03-06", person_name="Bob", page=2, page_size=2)
+
+    assert result['total'] == 5
+    assert [(log['date'], log['person_name']) for log in result['logs']] == [
+        ("2024-03-04", "Bob"), ("2024-03-05", "Bob")
+    ]
+    assert database.query(page=5, page_size=4)['logs'] == []
+    database.close()
+
+
+def test_migration_copies_journal_days_into_sqlite(journal, tmp_path):
+    record_day(journal)
+    journal.close()
+
+    assert migrate(tmp_path, tmp_path / "attendance.db") == (1, 2)
+
+    database = SQLiteStorage(tmp_path / "attendance.db")
+    reopened = JournalStorage(tmp_path)
+    assert database.day_logs(DATE) == sorted(reopened.day_logs(DATE), key=lambda log: log['timestamp'])
+    assert database.marked_count(DATE) == 4
+    reopened.close()
+    database.close()
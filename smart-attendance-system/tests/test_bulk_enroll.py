@@ -0,0 +1,108 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import bulk_enroll
+from bulk_enroll import enroll_dataset
+from conftest import jpeg
+from encoding_cache import content_key
+from face_encoder import FACE_RECOGNITION_AVAILABLE
+
+DIM = 128 if FACE_RECOGNITION_AVAILABLE else 256
+
+
+@pytest.fixture
+def encoded(monkeypatch):
+    """
+    Paths encoded by the workers. Workers run as threads, and an image's
+    name decides the outcome: 'dark' fails the quality checks, 'blank' has
+    no face, 'broken' cannot be read; other images get an encoding derived
+    from their content.
+    """
+    paths = []
+
+    def encode_file(path):
+        paths.append(os.path.relpath(path, os.path.dirname(os.path.dirname(path))))
+        name = os.path.basename(path)
+        if name.startswith('dark'):
+            return None, "Face is too dark", 'too_dark'
+        if name.startswith('blank'):
+            return None, None, None
+        if name.startswith('broken'):
+            return None, "Could not read image", None
+        with open(path, 'rb') as f:
+            seed = int.from_bytes(content_key(f.read())[:4], 'little')
+        return np.random.default_rng(seed).standard_normal(DIM), None, None
+
+    monkeypatch.setattr(bulk_enroll, 'encode_file', encode_file)
+    monkeypatch.setattr(bulk_enroll, 'worker_executor', lambda workers: ThreadPoolExecutor(workers))
+    return paths
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    images = {
+        "alice": {"1.jpg": jpeg(1), "2.jpg": jpeg(2)},
+        # The same content as alice/1.jpg under another name
+        "bob": {"1.jpg": jpeg(3), "copy.jpg": jpeg(1), "dark.jpg": jpeg(4), "blank.jpg": jpeg(5)},
+        "carol": {"broken.jpg": b"not an image"},
+        ".hidden": {"1.jpg": jpeg(6)}
+    }
+    for person, files in images.items():
+        (tmp_path / "team" / person).mkdir(parents=True)
+        for name, data in files.items():
+            (tmp_path / "team" / person / name).write_bytes(data)
+    (tmp_path / "team" / "alice" / "notes.txt").write_text("not an image")
+    return tmp_path / "team"
+
+
+def test_dataset_is_enrolled_in_one_commit_with_failures_reported(handler, dataset, encoded):
+    events = list(enroll_dataset(handler, dataset, workers=2))
+
+    assert events[0] == {"type": "start", "dataset": "team", "persons": 3, "images": 7, "already_enrolled": 0}
+    statuses = {os.path.relpath(e["image"], dataset): e["status"] for e in events if e["type"] == "progress"}
+    assert statuses == {
+        "alice/1.jpg": "enrolled", "alice/2.jpg": "enrolled", "bob/1.jpg": "enrolled",
+        "bob/copy.jpg": "enrolled", "bob/dark.jpg": "rejected", "bob/blank.jpg": "no_face",
+        "carol/broken.jpg": "error"
+    }
+    # Identical content is encoded once
+    assert sorted(encoded) == ["alice/1.jpg", "alice/2.jpg", "bob/1.jpg", "bob/blank.jpg",
+                               "bob/dark.jpg", "carol/broken.jpg"]
+    result = events[-1]
+    assert result["type"] == "result"
+    assert (result["persons_added"], result["images_enrolled"]) == (2, 4)
+    assert (result["images_failed"], result["images_rejected"]) == (2, 1)
+    assert sorted(os.path.relpath(f["image"], dataset) for f in result["failures"]) == [
+        "bob/blank.jpg", "bob/dark.jpg", "carol/broken.jpg"
+    ]
+    assert handler.quality_rejections == {'too_dark': 1}
+    assert sorted(p['name'] for p in handler.get_all_persons()) == ["alice", "bob"]
+
+
+def test_rerun_skips_enrolled_images_and_reuses_cached_encodings(handler, dataset, encoded):
+    list(enroll_dataset(handler, dataset))
+    encoded.clear()
+    (dataset / "alice" / "3.jpg").write_bytes(jpeg(2))
+
+    events = list(enroll_dataset(handler, dataset))
+
+    assert events[0]["already_enrolled"] == 4
+    assert events[0]["images"] == 4
+    # Rejections and read errors are tried again; no-face results come from the cache
+    assert sorted(encoded) == ["bob/dark.jpg", "carol/broken.jpg"]
+    result = events[-1]
+    assert (result["persons_added"], result["images_enrolled"], result["images_cached"]) == (0, 1, 2)
+    assert result["images_skipped"] == 4
+
+
+def test_enrollment_closed_early_commits_nothing(handler, dataset, encoded):
+    events = enroll_dataset(handler, dataset)
+    next(events)
+    next(events)
+    events.close()
+
+    assert handler.get_all_persons() == []
+    assert handler.enrolled_images() == set()
@@ -0,0 +1,75 @@
+import pytest
+
+import camera_sessions
+from camera_sessions import SessionManager
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ScriptedHandler:
+    """Stands in for FaceRecognitionHandler: each frame is the list of (track id, name) it shows"""
+
+    def create_tracker(self, **options):
+        tracker = type('Tracker', (), {})()
+        tracker.tracks = []
+        tracker.options = options
+        return tracker
+
+    def recognize_stream(self, tracker, frame, width=None, height=None):
+        tracker.tracks = list(frame)
+        return [{"track_id": track_id, "name": name} for track_id, name in frame], {}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(camera_sessions.time, 'monotonic', clock)
+    return clock
+
+
+def test_person_is_logged_once_per_track_and_not_again_within_the_cooldown(clock):
+    handler = ScriptedHandler()
+    session = SessionManager(handler, idle_timeout=60, cooldown=30).create("door")
+
+    def logged(frame):
+        faces, persons, _ = session.process(handler, frame)
+        assert [face["name"] for face in faces if face["logged"]] == persons
+        return persons
+
+    assert logged([(1, "Alice"), (2, None)]) == ["Alice"]
+    assert logged([(1, "Alice"), (2, "Bob")]) == ["Bob"]
+    assert logged([(1, "Alice"), (2, "Bob")]) == []
+    # Alice lost and found again on a new track within the cooldown
+    assert logged([(3, "Alice")]) == []
+    clock.now += 31
+    assert logged([(3, "Alice")]) == []
+    assert logged([(4, "Alice"), (5, "Alice")]) == ["Alice"]
+    assert session.info()["frames"] == 6
+    assert session.info()["logged"] == 3
+
+
+def test_sessions_are_created_limited_closed_and_expire(clock):
+    manager = SessionManager(ScriptedHandler(), idle_timeout=60, cooldown=30, max_sessions=2)
+    door = manager.create("door", detect_interval=3)
+    manager.create()
+
+    assert door.tracker.options == {"detect_interval": 3}
+    assert manager.get(door.id) is door
+    with pytest.raises(RuntimeError):
+        manager.create()
+
+    manager.close(door.id)
+    with pytest.raises(KeyError):
+        manager.get(door.id)
+    with pytest.raises(KeyError):
+        manager.close(door.id)
+
+    clock.now += 61
+    assert manager.list() == []
+    manager.create()
@@ -0,0 +1,301 @@
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+import config
+import dataset_downloader
+from dataset_downloader import DatasetDownloader
+
+
+class Mirror:
+    """
+    Local HTTP server standing in for a dataset mirror: serves `files` by
+    path, answers Range requests with 206 (or 416 past the end), and can
+    ignore ranges or drop a response part way through
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.ignore_range = False
+        # {path: bytes of the next response body sent before the connection is closed}
+        self.drop_after = {}
+        mirror = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                mirror.requests.append((self.path, self.headers.get('Range')))
+                data = mirror.files.get(self.path)
+                if data is None:
+                    self.send_error(404)
+                    return
+                start = 0
+                if self.headers.get('Range') and not mirror.ignore_range:
+                    start = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header('Content-Range', f"bytes */{len(data)}")
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f"bytes {start}-{len(data) - 1}/{len(data)}")
+                else:
+                    self.send_response(200)
+                body = data[start:]
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.path in mirror.drop_after:
+                    body = body[:mirror.drop_after.pop(self.path)]
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def publish(self, name, data, checksum=True):
+        self.files[f"/{name}"] = data
+        if checksum:
+            self.files[f"/{name}.sha256"] = f"{hashlib.sha256(data).hexdigest()}  {name}\n".encode()
+
+    def archive_requests(self, name):
+        return [headers for path, headers in self.requests if path == f"/{name}"]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def dataset_archive(images=(("alice", "1.jpg"), ("alice", "2.jpg"), ("bob", "1.jpg"))):
+    """tar.gz of a dataset: <root>/<person>/<image>, of incompressible images"""
+    rng = np.random.default_rng(0)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for person, name in images:
+            data = rng.bytes(4096)
+            info = tarfile.TarInfo(f"subset/{person}/{name}")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+ARCHIVE = "vggface2_subset.tar.gz"
+
+
+@pytest.fixture
+def mirror(monkeypatch):
+    server = Mirror()
+    monkeypatch.setattr(config, 'DATASET_MIRROR_URL', server.url)
+    monkeypatch.setattr(config, 'DATASET_ALLOW_UNVERIFIED', False)
+    monkeypatch.setattr(dataset_downloader.time, 'sleep', lambda seconds: None)
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def downloader(tmp_path):
+    return DatasetDownloader(tmp_path / "datasets")
+
+
+def assert_extracted(downloader):
+    dataset_path = downloader.datasets_dir / "vggface2_subset"
+    assert sorted(p.relative_to(dataset_path).as_posix() for p in dataset_path.rglob('*.jpg')) == [
+        "alice/1.jpg", "alice/2.jpg", "bob/1.jpg"
+    ]
+    # Nothing left behind: no archive, part file or staging folder
+    assert list(downloader.downloads_dir.iterdir()) == []
+
+
+def test_download_is_verified_and_extracted_through_a_staging_folder(mirror, downloader, monkeypatch):
+    mirror.publish(ARCHIVE, dataset_archive())
+    staged = []
+    importer = downloader._importer
+    monkeypatch.setattr(downloader, '_importer', lambda path: staged.append(path) or importer(path))
+
+    path = downloader.download_dataset("vggface2_subset")
+
+    assert path == str(downloader.datasets_dir / "vggface2_subset")
+    assert staged == [downloader.downloads_dir / "vggface2_subset"]
+    assert_extracted(downloader)
+    assert downloader.get_dataset_info("vggface2_subset")['people_count'] == 2
+
+
+def test_failed_extraction_leaves_no_dataset_and_keeps_the_verified_archive(mirror, downloader):
+    mirror.publish(ARCHIVE, b"not an archive" * 100)
+
+    with pytest.raises(ValueError, match="archive"):
+        downloader.download_dataset("vggface2_subset")
+
+    assert not (downloader.datasets_dir / "vggface2_subset").exists()
+    assert [p.name for p in downloader.downloads_dir.iterdir()] == [ARCHIVE]
+
+    # Extraction is retried from the kept archive, without downloading it again
+    mirror.publish(ARCHIVE, dataset_archive())
+    with pytest.raises(ValueError):
+        downloader.download_dataset("vggface2_subset")
+    assert len(mirror.archive_requests(ARCHIVE)) == 1
+
+
+def test_dropped_download_resumes_with_a_range_request(mirror, downloader, monkeypatch):
+    monkeypatch.setattr(dataset_downloader, 'DOWNLOAD_CHUNK_SIZE', 1024)
+    data = dataset_archive()
+    mirror.publish(ARCHIVE, data)
+    mirror.drop_after[f"/{ARCHIVE}"] = 4 * 1024
+
+    downloader.download_dataset("vggface2_subset")
+
+    assert mirror.archive_requests(ARCHIVE) == [None, "bytes=4096-"]
+    assert_extracted(downloader)
+
+
+def test_partial_download_is_resumed(mirror, downloader):
+    data = dataset_archive()
+    mirror.publish(ARCHIVE, data)
+    downloader.downloads_dir.mkdir()
+    (downloader.downloads_dir / f"{ARCHIVE}.part").write_bytes(data[:1000])
+
+    downloader.download_dataset("vggface2_subset")
+
+    assert mirror.archive_requests(ARCHIVE) == ["bytes=1000-"]
+    assert_extracted(downloader)
+
+
+def test_server_ignoring_the_range_restarts_the_download(mirror, downloader):
+    data = dataset_archive()
+    mirror.publish(ARCHIVE, data)
+    mirror.ignore_range = True
+    downloader.downloads_dir.mkdir()
+    # Not a prefix of the archive: only a restarted download passes the checksum
+    (downloader.downloads_dir / f"{ARCHIVE}.part").write_bytes(b"x" * 1000)
+
+    downloader.download_dataset("vggface2_subset")
+
+    assert mirror.archive_requests(ARCHIVE) == ["bytes=1000-"]
+    assert_extracted(downloader)
+
+
+def test_complete_part_file_is_used_when_the_range_is_unsatisfiable(mirror, downloader):
+    data = dataset_archive()
+    mirror.publish(ARCHIVE, data)
+    downloader.downloads_dir.mkdir()
+    (downloader.downloads_dir / f"{ARCHIVE}.part").write_bytes(data)
+
+    downloader.download_dataset("vggface2_subset")
+
+    assert mirror.archive_requests(ARCHIVE) == [f"bytes={len(data)}-"]
+    assert_extracted(downloader)
+
+
+def test_part_file_longer_than_the_archive_is_downloaded_again(mirror, downloader):
+    data = dataset_archive()
+    mirror.publish(ARCHIVE, data)
+    downloader.downloads_dir.mkdir()
+    (downloader.downloads_dir / f"{ARCHIVE}.part").write_bytes(data + b"stale")
+
+    downloader.download_dataset("vggface2_subset")
+
+    assert mirror.archive_requests(ARCHIVE) == [f"bytes={len(data) + 5}-", None]
+    assert_extracted(downloader)
+
+
+def test_checksum_mismatch_deletes_the_download(mirror, downloader):
+    # LFW has a pinned SHA-256, which this archive does not match
+    mirror.publish("lfw.tgz", dataset_archive(), checksum=False)
+
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        downloader.download_dataset("lfw")
+
+    assert list(downloader.downloads_dir.iterdir()) == []
+    assert not (downloader.datasets_dir / "lfw").exists()
+
+
+def test_archive_without_checksum_is_refused(mirror, downloader, monkeypatch):
+    mirror.publish(ARCHIVE, dataset_archive(), checksum=False)
+
+    with pytest.raises(ValueError, match="No checksum"):
+        downloader.download_dataset("vggface2_subset")
+
+    assert mirror.archive_requests(ARCHIVE) == []
+    assert not (downloader.datasets_dir / "vggface2_subset").exists()
+
+    monkeypatch.setattr(config, 'DATASET_ALLOW_UNVERIFIED', True)
+    downloader.download_dataset("vggface2_subset")
+    assert_extracted(downloader)
+
+
+@pytest.fixture
+def scans(downloader, monkeypatch):
+    """Datasets whose tree was scanned, in order"""
+    scanned = []
+    scan = DatasetDownloader._scan_inventory
+    monkeypatch.setattr(DatasetDownloader, '_scan_inventory',
+                        lambda self, path: scanned.append(path.name) or scan(self, path))
+    return scanned
+
+
+def write_dataset(path, images):
+    for image in images:
+        (path / image).parent.mkdir(parents=True, exist_ok=True)
+        (path / image).write_bytes(b"x" * 1024)
+
+
+def touch(path):
+    """Move a directory's mtime forward, as adding or removing an entry would"""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_inventory_is_reused_until_a_directory_changes(downloader, scans):
+    dataset_path = downloader.datasets_dir / "team"
+    write_dataset(dataset_path, ["alice/1.jpg", "alice/2.jpg", "bob/1.jpg", "bob/notes.txt"])
+
+    info = downloader.get_dataset_info("team")
+    assert (info['people_count'], info['image_count']) == (2, 3)
+    assert downloader.get_dataset_info("team") == info
+    # Also across restarts, from metadata.json
+    assert DatasetDownloader(downloader.datasets_dir).get_dataset_info("team") == info
+    assert scans == ["team"]
+
+    write_dataset(dataset_path, ["bob/2.jpg"])
+    touch(dataset_path / "bob")
+    assert downloader.get_dataset_info("team")['image_count'] == 4
+
+    shutil.rmtree(dataset_path / "alice")
+    touch(dataset_path)
+    assert downloader.get_dataset_info("team")['people_count'] == 1
+    assert scans == ["team"] * 3
+
+
+def test_refresh_rescans_an_unchanged_tree(downloader, scans):
+    dataset_path = downloader.datasets_dir / "team"
+    write_dataset(dataset_path, ["alice/1.jpg"])
+    assert downloader.get_dataset_info("team")['size_mb'] == 0.0
+
+    # Rewriting a file in place leaves its directory's mtime alone
+    stat = os.stat(dataset_path / "alice")
+    (dataset_path / "alice" / "1.jpg").write_bytes(b"x" * 2 * 1024 * 1024)
+    os.utime(dataset_path / "alice", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert downloader.get_dataset_info("team")['size_mb'] == 0.0
+    assert downloader.get_dataset_info("team", refresh=True)['size_mb'] == 2.0
+    assert scans == ["team", "team"]
+
+
+def test_list_datasets_skips_files_and_invalid_names(downloader):
+    write_dataset(downloader.datasets_dir / "team", ["alice/1.jpg"])
+    write_dataset(downloader.datasets_dir / ".downloads", ["alice/1.jpg"])
+    (downloader.datasets_dir / "notes.txt").write_text("not a dataset")
+
+    assert [info['name'] for info in downloader.list_datasets()] == ["team"]
+    assert downloader.get_dataset_info("../team") is None
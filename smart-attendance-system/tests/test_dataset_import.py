@@ -0,0 +1,258 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from dataset_import import ArchiveImporter, archive_members, image_destination
+
+MB = 1024 * 1024
+
+
+class Unseekable(io.RawIOBase):
+    """Write-only stream that cannot seek, so zipfile writes data descriptors"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+class Trickle(io.RawIOBase):
+    """Stream handing out at most `size` bytes per read, as an upload arrives"""
+
+    def __init__(self, data, size=7):
+        self.data = memoryview(data)
+        self.size = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self.size, len(self.data))
+        buffer[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+
+def zip_archive(members, seekable=True, compression=zipfile.ZIP_DEFLATED, force_zip64=False):
+    """Zip of {name: bytes}; written to an unseekable stream, members get data descriptors"""
+    stream = io.BytesIO() if seekable else Unseekable()
+    with zipfile.ZipFile(stream, 'w', compression) as archive:
+        for name, data in members.items():
+            info = zipfile.ZipInfo(name)
+            info.compress_type = compression
+            with archive.open(info, 'w', force_zip64=force_zip64) as member:
+                member.write(data)
+    return bytes(stream.getvalue() if seekable else stream.data)
+
+
+def tar_archive(members, mode='w:gz'):
+    """tar of {name: bytes, or a TarInfo for links and other special members}"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        for name, data in members.items():
+            if isinstance(data, tarfile.TarInfo):
+                archive.addfile(data)
+                continue
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+IMAGES = {"alice/1.jpg": b"a1" * 5000, "alice/2.png": b"a2" * 300, "bob/1.jpeg": os.urandom(70000)}
+
+
+def extract(dataset_path, data, max_bytes=100 * MB, max_file_bytes=10 * MB, max_files=100, trickle=7):
+    importer = ArchiveImporter(dataset_path, max_bytes, max_file_bytes, max_files)
+    extracted = list(importer.extract(Trickle(data, trickle)))
+    return importer, extracted
+
+
+def files(path):
+    return {p.relative_to(path).as_posix(): p.read_bytes() for p in path.rglob('*') if p.is_file()}
+
+
+@pytest.mark.parametrize('name, destination', [
+    ("alice/1.jpg", ("alice", "1.jpg")),
+    ("lfw/team/alice/1.JPG", ("alice", "1.JPG")),
+    ("alice\\1.png", ("alice", "1.png")),
+    ("./alice/./1.jpeg", ("alice", "1.jpeg")),
+    # Absolute paths land inside the dataset
+    ("/etc/alice/1.jpg", ("alice", "1.jpg")),
+    ("C:\\alice\\1.jpg", ("alice", "1.jpg")),
+    ("../alice/1.jpg", None),
+    ("alice/../../1.jpg", None),
+    ("alice/..\\..\\1.jpg", None),
+    ("1.jpg", None),
+    ("alice/1.gif", None),
+    ("alice/.1.jpg", None),
+    (".cache/alice/1.jpg", None),
+    ("__MACOSX/alice/1.jpg", None),
+    ("alice/1.jpg\0.txt", None),
+    ("alice/1\0.jpg", None),
+])
+def test_image_destination(name, destination):
+    assert image_destination(name) == destination
+
+
+# Non-image members are read past and counted as skipped
+MEMBERS = {**IMAGES, "alice/notes.txt": b"notes", "README.md": b"readme"}
+
+
+@pytest.mark.parametrize('archive', [
+    pytest.param(lambda: zip_archive(MEMBERS), id='zip'),
+    pytest.param(lambda: zip_archive(MEMBERS, compression=zipfile.ZIP_STORED), id='zip-stored'),
+    pytest.param(lambda: zip_archive(MEMBERS, seekable=False), id='zip-data-descriptors'),
+    pytest.param(lambda: zip_archive(MEMBERS, force_zip64=True), id='zip64'),
+    pytest.param(lambda: zip_archive(MEMBERS, seekable=False, force_zip64=True), id='zip64-data-descriptors'),
+    pytest.param(lambda: tar_archive(MEMBERS), id='tar.gz'),
+    pytest.param(lambda: tar_archive(MEMBERS, 'w'), id='tar'),
+    pytest.param(lambda: tar_archive(MEMBERS, 'w:bz2'), id='tar.bz2'),
+    pytest.param(lambda: tar_archive(MEMBERS, 'w:xz'), id='tar.xz'),
+])
+def test_images_are_extracted_as_the_archive_arrives(tmp_path, archive):
+    importer, extracted = extract(tmp_path / "team", archive())
+
+    assert files(tmp_path / "team") == IMAGES
+    assert [(person, path.name) for person, path, _ in extracted] == [
+        ("alice", "1.jpg"), ("alice", "2.png"), ("bob", "1.jpeg")
+    ]
+    assert all(image_data == IMAGES[f"{person}/{path.name}"] for person, path, image_data in extracted)
+    assert (importer.files, importer.skipped) == (3, 2)
+    assert importer.bytes == sum(len(data) for data in MEMBERS.values())
+
+
+def test_zip64_sizes_are_read_from_the_extra_field():
+    data = zip_archive({"alice/1.jpg": b"x" * 1000}, compression=zipfile.ZIP_STORED, force_zip64=True)
+    # The local header stores 0xFFFFFFFF and the real sizes in the zip64 extra field
+    assert data[18:26] == b"\xff" * 8
+
+    [(name, chunks)] = [(name, b"".join(chunks)) for name, chunks in archive_members(io.BytesIO(data))]
+    assert (name, chunks) == ("alice/1.jpg", b"x" * 1000)
+
+
+def test_stored_zip_members_with_data_descriptors_are_refused(tmp_path):
+    data = zip_archive(IMAGES, seekable=False, compression=zipfile.ZIP_STORED)
+
+    with pytest.raises(ValueError, match="Stored entries without sizes"):
+        extract(tmp_path / "team", data)
+    assert not (tmp_path / "team").exists()
+
+
+@pytest.mark.parametrize('seekable', [True, False])
+def test_zip_member_with_a_bad_checksum_is_not_written(tmp_path, seekable):
+    data = bytearray(zip_archive({"alice/1.jpg": b"a1" * 5000, "bob/1.jpg": b"b1" * 5000}, seekable))
+    second = data.index(b"PK\x03\x04", 4)
+    if seekable:
+        # CRC-32 of the second member's local header
+        data[second + 14] ^= 0xFF
+    else:
+        # CRC-32 of the first member's data descriptor, just before the second header
+        data[second - 12] ^= 0xFF
+
+    importer = ArchiveImporter(tmp_path / "team", 100 * MB, 10 * MB, 100)
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        for _ in importer.extract(Trickle(bytes(data))):
+            pass
+
+    assert files(tmp_path / "team") == ({"alice/1.jpg": b"a1" * 5000} if seekable else {})
+
+
+def test_zip_symlink_members_are_written_as_regular_files(tmp_path):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        link = zipfile.ZipInfo("alice/1.jpg")
+        link.external_attr = 0o120777 << 16
+        archive.writestr(link, "/etc/passwd")
+
+    extract(tmp_path / "team", buffer.getvalue())
+
+    image = tmp_path / "team" / "alice" / "1.jpg"
+    assert not image.is_symlink()
+    assert image.read_bytes() == b"/etc/passwd"
+
+
+def test_tar_links_and_devices_are_skipped(tmp_path):
+    symlink = tarfile.TarInfo("alice/2.jpg")
+    symlink.type = tarfile.SYMTYPE
+    symlink.linkname = "/etc/passwd"
+    hardlink = tarfile.TarInfo("alice/3.jpg")
+    hardlink.type = tarfile.LNKTYPE
+    hardlink.linkname = "alice/1.jpg"
+    device = tarfile.TarInfo("alice/4.jpg")
+    device.type = tarfile.CHRTYPE
+    data = tar_archive({"alice/1.jpg": b"a1", "alice/2.jpg": symlink, "alice/3.jpg": hardlink, "alice/4.jpg": device})
+
+    importer, _ = extract(tmp_path / "team", data)
+
+    assert files(tmp_path / "team") == {"alice/1.jpg": b"a1"}
+    assert not any(p.is_symlink() for p in (tmp_path / "team").rglob('*'))
+    assert importer.files == 1
+
+
+def test_images_are_not_written_through_existing_symlinks(tmp_path):
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (tmp_path / "team" / "carol").mkdir(parents=True)
+    (tmp_path / "team" / "alice").symlink_to(outside)
+    (tmp_path / "team" / "carol" / "1.jpg").symlink_to(outside / "carol.jpg")
+
+    importer, extracted = extract(tmp_path / "team", zip_archive({
+        "alice/1.jpg": b"a1", "carol/1.jpg": b"c1", "bob/1.jpg": b"b1"
+    }))
+
+    assert [path.name for _, path, _ in extracted] == ["1.jpg"]
+    assert list(outside.iterdir()) == []
+    assert (tmp_path / "team" / "bob" / "1.jpg").read_bytes() == b"b1"
+    assert importer.skipped == 2
+
+
+def test_archive_expanding_past_the_size_limit_is_refused(tmp_path):
+    data = zip_archive({"alice/1.jpg": bytes(64 * 1024), "bob/1.jpg": bytes(2 * MB)})
+
+    with pytest.raises(ValueError, match="more than 1 MB"):
+        extract(tmp_path / "team", data, max_bytes=MB, trickle=4096)
+
+    # Images written before the limit was reached are kept
+    assert files(tmp_path / "team") == {"alice/1.jpg": bytes(64 * 1024)}
+
+
+def test_archive_past_the_size_limit_straight_away_leaves_nothing(tmp_path):
+    data = tar_archive({"alice/1.jpg": bytes(2 * MB)})
+
+    with pytest.raises(ValueError, match="more than 1 MB"):
+        extract(tmp_path / "team", data, max_bytes=MB, trickle=4096)
+
+    assert not (tmp_path / "team").exists()
+
+
+def test_images_past_the_file_size_limit_are_skipped(tmp_path):
+    importer, _ = extract(tmp_path / "team", zip_archive(IMAGES), max_file_bytes=10000)
+
+    assert files(tmp_path / "team") == {"alice/1.jpg": IMAGES["alice/1.jpg"], "alice/2.png": IMAGES["alice/2.png"]}
+    assert importer.skipped == 1
+
+
+def test_archive_with_too_many_images_is_refused(tmp_path):
+    with pytest.raises(ValueError, match="more than 2 images"):
+        extract(tmp_path / "team", zip_archive(IMAGES), max_files=2)
+
+    assert len(files(tmp_path / "team")) == 2
+
+
+@pytest.mark.parametrize('data, message', [
+    (b"", "empty"),
+    (b"not an archive at all", "Not a zip or tar archive"),
+    (zip_archive(IMAGES)[:3000], "truncated"),
+])
+def test_corrupt_archives_are_refused(tmp_path, data, message):
+    with pytest.raises(ValueError, match=message):
+        extract(tmp_path / "team", data)
@@ -0,0 +1,88 @@
+import io
+
+import numpy as np
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from conftest import FakeCascade, jpeg
+from encoding_cache import EncodingCache, content_key
+from face_encoder import FACE_RECOGNITION_AVAILABLE
+
+opencv_only = pytest.mark.skipif(FACE_RECOGNITION_AVAILABLE, reason="histogram encodings (OpenCV mode) only")
+
+# Keys ending in zero bytes must survive a save
+KEYS = [bytes(15) + bytes([n]) if n else bytes(16) for n in range(4)]
+
+
+def encoding(n):
+    return np.full(8, n, dtype=np.float32)
+
+
+def test_content_key_depends_only_on_the_bytes():
+    assert content_key(b"image") == content_key(bytearray(b"image"))
+    assert content_key(b"image") != content_key(b"image2")
+    assert len(content_key(b"image")) == 16
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EncodingCache(tmp_path / "cache.npz", 3, 'face-histogram')
+    for n in range(3):
+        cache.put(KEYS[n], encoding(n))
+    assert cache.get(KEYS[0])[0]
+    cache.put(KEYS[3], None)
+
+    assert len(cache) == 3
+    assert cache.get(KEYS[1]) == (False, None)
+    assert cache.get(KEYS[3]) == (True, None)
+    found, cached = cache.get(KEYS[0])
+    assert found
+    np.testing.assert_array_equal(cached, encoding(0))
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_cache_is_saved_and_loaded_for_its_mode_only(tmp_path, capsys):
+    path = tmp_path / "cache.npz"
+    cache = EncodingCache(path, 10, 'face-histogram')
+    for n in range(3):
+        cache.put(KEYS[n], encoding(n))
+    cache.put(KEYS[3], None)
+    cache.save()
+
+    loaded = EncodingCache(path, 10, 'face-histogram')
+    assert len(loaded) == 4
+    for n in range(3):
+        np.testing.assert_array_equal(loaded.get(KEYS[n])[1], encoding(n))
+    assert loaded.get(KEYS[3]) == (True, None)
+
+    # A smaller cache keeps the most recently used entries
+    smaller = EncodingCache(path, 2, 'face-histogram')
+    assert [smaller.get(key)[0] for key in KEYS] == [False, False, True, True]
+
+    assert len(EncodingCache(path, 10, 'dlib')) == 0
+    path.write_bytes(b"not a cache")
+    assert len(EncodingCache(path, 10, 'face-histogram')) == 0
+    assert "unreadable encoding cache" in capsys.readouterr().out
+
+
+def test_disabled_cache_keeps_nothing(tmp_path):
+    cache = EncodingCache(tmp_path / "cache.npz", 0, 'face-histogram')
+    cache.put(KEYS[0], encoding(0))
+    cache.save()
+
+    assert cache.get(KEYS[0]) == (False, None)
+    assert not (tmp_path / "cache.npz").exists()
+
+
+@opencv_only
+def test_image_uploaded_again_is_not_encoded_again(handler, monkeypatch):
+    handler.encoder._cascade = FakeCascade([(20, 20, 64, 64)])
+    encoded = []
+    encode_file = handler.encoder.encode_file
+    monkeypatch.setattr(handler.encoder, 'encode_file', lambda path: encoded.append(path) or encode_file(path))
+    person_id = handler.add_person("Alice")
+
+    for _ in range(2):
+        handler.add_image_to_person(person_id, FileStorage(io.BytesIO(jpeg(1, 20, 120)), filename="face.jpg"))
+
+    assert len(encoded) == 1
+    assert handler.get_model_stats()['total_encoded_faces'] == 2
@@ -0,0 +1,58 @@
+import time
+
+import numpy as np
+import pytest
+
+from conftest import jpeg
+from encoding_pool import EncodingPool, PoolBusy
+from face_encoder import FaceEncoder
+
+
+@pytest.fixture(scope='module')
+def pool():
+    """One worker process and no queue, shared by the tests (workers are slow to start)"""
+    encoding_pool = EncodingPool(workers=1, queue_size=0)
+    yield encoding_pool
+    encoding_pool.close()
+
+
+def settled(pool):
+    """Wait for finished futures to give back their slots"""
+    deadline = time.monotonic() + 5
+    while pool.in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return pool.in_flight == 0
+
+
+def test_worker_encodes_frames_as_the_server_process_would(pool):
+    encoder = FaceEncoder()
+    blank = bytes(64 * 48 * 3)
+    for frame in [(jpeg(1), None, None), (blank, 64, 48)]:
+        boxes, encodings, rejected, timings = pool.run(*frame)
+        expected = encoder.process(*frame)
+        assert boxes == expected[0]
+        assert len(encodings) == len(expected[1])
+        for encoding, other in zip(encodings, expected[1]):
+            np.testing.assert_allclose(encoding, other)
+        assert [box for box, _ in rejected] == [box for box, _ in expected[2]]
+        assert 'decode_ms' in timings
+    assert settled(pool)
+
+
+def test_frames_beyond_the_capacity_are_refused_without_queueing_any(pool):
+    assert settled(pool)
+    frames = [(jpeg(seed), None, None) for seed in range(2)]
+
+    with pytest.raises(PoolBusy):
+        pool.submit_many(frames)
+    assert pool.in_flight == 0
+
+    # A large frame keeps the worker busy while the next one is submitted
+    large = np.random.default_rng(0).integers(0, 255, (960, 1280, 3), dtype=np.uint8)
+    futures = pool.submit_many([(large.tobytes(), 1280, 960)])
+    assert len(futures) == 1
+    with pytest.raises(PoolBusy):
+        pool.submit_many(frames[1:])
+    futures[0].result()
+    assert settled(pool)
+    assert len(pool.submit_many(frames[1:])) == 1
@@ -0,0 +1,72 @@
+import pytest
+
+from attendance_logger import AttendanceLogger
+from event_stream import EventBroadcaster, format_sse
+
+
+def drain(subscription):
+    events = []
+    while True:
+        event = subscription.get(timeout=0)
+        if event is None:
+            return events
+        events.append(event)
+
+
+def test_every_subscriber_gets_published_events():
+    broadcaster = EventBroadcaster()
+    first, second = broadcaster.subscribe(), broadcaster.subscribe()
+    woken = []
+    third = broadcaster.subscribe(on_push=lambda: woken.append(True))
+    broadcaster.unsubscribe(second)
+
+    broadcaster.publish('checkin', {'person_name': "Alice"})
+
+    assert drain(first) == drain(third) == [('checkin', {'person_name': "Alice"})]
+    assert drain(second) == []
+    assert woken == [True]
+
+
+def test_slow_subscriber_is_told_to_resync_instead_of_blocking_the_publisher():
+    broadcaster = EventBroadcaster(buffer_size=3)
+    slow = broadcaster.subscribe()
+
+    for i in range(10):
+        broadcaster.publish('checkin', {'n': i})
+
+    events = drain(slow)
+    assert events[0] == ('resync', {})
+    # Only the newest events are kept, and the resync is sent once
+    assert events[1:] == [('checkin', {'n': 8}), ('checkin', {'n': 9})]
+    broadcaster.publish('checkin', {'n': 10})
+    assert drain(slow) == [('checkin', {'n': 10})]
+
+
+def test_subscribers_are_limited():
+    broadcaster = EventBroadcaster(max_subscribers=1)
+    subscription = broadcaster.subscribe()
+    with pytest.raises(RuntimeError):
+        broadcaster.subscribe()
+    broadcaster.unsubscribe(subscription)
+    broadcaster.subscribe()
+
+
+def test_logger_publishes_checkins_checkouts_and_statistics(tmp_path):
+    logger = AttendanceLogger(tmp_path, 'journal')
+    subscription = logger.events.subscribe()
+
+    timestamp = logger.log_attendance("Alice")
+    logger.log_attendance_many(["Alice", "Bob"])
+    logger.close()
+
+    events = drain(subscription)
+    assert [event_type for event_type, _ in events] == ['checkin', 'stats', 'checkout', 'checkin', 'stats']
+    assert events[0][1]['person_name'] == "Alice" and events[0][1]['timestamp'] == timestamp
+    assert events[2][1]['person_name'] == "Alice" and events[2][1]['checkout_time'] is not None
+    assert events[4][1]['total_present'] == 2
+    assert events[4][1]['total_marked'] == 3
+    assert events[4][1]['present_delta'] == 1
+
+
+def test_events_are_encoded_as_server_sent_events():
+    assert format_sse('stats', {'total_present': 2}) == 'event: stats\ndata: {"total_present": 2}\n\n'
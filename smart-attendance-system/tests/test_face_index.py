@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from face_index import IVFIndex
+from gallery import FaceGallery
+
+
+def clustered_gallery(metric, persons=40, per_person=5, dim=32, seed=0):
+    """Gallery of `persons` tight clusters of encodings, plus queries near each person"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((persons, dim)).astype(np.float32)
+    encodings = np.repeat(centers, per_person, axis=0) + 0.05 * rng.standard_normal((persons * per_person, dim))
+    keys = [f"person_{i // per_person}" for i in range(persons * per_person)]
+    gallery = FaceGallery(metric=metric)
+    gallery.build(encodings, keys)
+    queries = centers + 0.05 * rng.standard_normal(centers.shape)
+    return gallery, queries.astype(np.float32)
+
+
+@pytest.mark.parametrize('metric', ['euclidean', 'cosine'])
+@pytest.mark.parametrize('nprobe', [1, 3, 100])
+def test_ivf_batch_search_matches_single_searches(metric, nprobe):
+    gallery, queries = clustered_gallery(metric)
+    gallery.remove("person_3")
+    index = IVFIndex(gallery, nlist=8, nprobe=nprobe).build()
+    # Far from every cluster, so it probes lists of other persons too
+    queries = np.vstack([queries, np.full((1, queries.shape[1]), 3.0, dtype=np.float32)])
+
+    rows, dists = index.search_batch(queries)
+
+    expected = [index.search(query) for query in queries]
+    assert rows == [row for row, _ in expected]
+    assert dists == pytest.approx([dist for _, dist in expected], rel=1e-4)
+    assert rows[3] is None or gallery.key_of(rows[3]) != "person_3"
+    assert index.search_batch([]) == ([], [])
+
+
+def test_ivf_search_finds_nothing_when_probed_rows_were_removed():
+    gallery, queries = clustered_gallery('euclidean', persons=1)
+    index = IVFIndex(gallery, nlist=1, nprobe=1).build()
+    gallery.remove("person_0")
+
+    assert index.search(queries[0]) == (None, None)
+    assert index.search_batch(queries) == ([None], [None])
@@ -0,0 +1,165 @@
+import io
+import json
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+import config
+import metrics
+from conftest import FakeCascade, jpeg, encode_jpeg, data_url
+from face_encoder import FACE_RECOGNITION_AVAILABLE
+from face_recognition_handler import FaceRecognitionHandler
+from gallery import FaceGallery
+from gallery_store import GalleryStore
+
+opencv_only = pytest.mark.skipif(FACE_RECOGNITION_AVAILABLE, reason="histogram encodings (OpenCV mode) only")
+
+
+def upload(handler, person_id, image_data):
+    return handler.add_image_to_person(person_id, FileStorage(io.BytesIO(image_data), filename="face.jpg"))
+
+
+@opencv_only
+def test_enrolled_image_matches_itself_in_multi_face_recognition(handler):
+    handler.encoder._cascade = FakeCascade([(20, 20, 64, 64)])
+    alice = handler.add_person("Alice")
+    bob = handler.add_person("Bob")
+    upload(handler, alice, jpeg(1, 20, 120))
+    upload(handler, bob, jpeg(2, 120, 220))
+
+    faces = handler.recognize_faces(data_url(jpeg(1, 20, 120)))
+
+    assert [face['name'] for face in faces] == ["Alice"]
+    assert faces[0]['distance'] < 1e-3
+    assert handler.recognize_face(data_url(jpeg(2, 120, 220))) == "Bob"
+
+
+def test_gallery_from_the_other_mode_is_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'GALLERY_COMPACT_INTERVAL', 0)
+
+    models_dir = tmp_path / "models"
+    models_dir.mkdir()
+    other_metric = 'cosine' if FACE_RECOGNITION_AVAILABLE else 'euclidean'
+    store = GalleryStore(models_dir)
+    gallery = FaceGallery(metric=other_metric)
+    gallery.build(np.random.default_rng(0).random((3, 8)), ["A", "A", "B"], ["p1", "p1", "p2"])
+    store.save(gallery.compact(store.create_storage(1)), 1)
+    saved = {path.name: path.read_bytes() for path in models_dir.iterdir()}
+
+    with pytest.raises(ValueError, match="gallery"):
+        FaceRecognitionHandler(models_dir)
+
+    assert {path.name: path.read_bytes() for path in models_dir.iterdir() if path.name in saved} == saved
+    assert GalleryStore(models_dir).load(other_metric).live_count == 3
+
+
+def test_enroll_many_observes_its_duration(handler, monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    encodings = np.random.default_rng(0).random((4, 128 if FACE_RECOGNITION_AVAILABLE else 256))
+
+    def observed():
+        for line in metrics.render().splitlines():
+            if line.startswith('attendance_operation_duration_seconds_sum{operation="enroll_many"}'):
+                return float(line.split()[-1])
+        return 0.0
+
+    before = observed()
+    started = time.perf_counter()
+    for n in range(2):
+        handler.enroll_many([(f"person_{n}", [(f"{n}_{i}.jpg", row) for i, row in enumerate(encodings)])])
+    elapsed = time.perf_counter() - started
+
+    assert 0.0 < observed() - before <= elapsed
+
+
+@opencv_only
+def test_poor_faces_of_a_frame_are_rejected_with_their_reason(handler):
+    handler.encoder._cascade = FakeCascade([(10, 20, 64, 64), (90, 20, 64, 64)])
+    alice = handler.add_person("Alice")
+    frame = np.asarray(Image.open(io.BytesIO(jpeg(1, 20, 220)))).copy()
+    frame[:, 80:] = 10
+    image_data = encode_jpeg(frame)
+    upload(handler, alice, image_data)
+
+    faces = handler.recognize_faces(data_url(image_data))
+
+    assert [(face['name'], face.get('reason')) for face in faces] == [("Alice", None), (None, "too_dark")]
+    assert handler.get_model_stats()['quality_rejections'] == {"too_dark": 1}
+
+
+def test_enrollments_are_logged_and_folded_in_on_compaction(handler):
+    models_dir = handler.models_dir
+    dim = 128 if FACE_RECOGNITION_AVAILABLE else 256
+    encodings = np.random.default_rng(0).standard_normal((3, dim)).astype(np.float32)
+    handler.enroll_many([("Alice", [("a.jpg", encodings[0])]), ("Bob", [("b.jpg", encodings[1])])])
+    handler.compact()
+    snapshot = {name: (models_dir / name).read_bytes() for name in ("gallery.json", "persons.json")}
+
+    carol = handler.add_person("Carol")
+    handler.enroll_many([("Carol", [("c.jpg", encodings[2])])])
+    bob = next(pid for pid, data in handler.persons_data.items() if data['name'] == "Bob")
+    handler.delete_person(bob)
+
+    # Changes only went to the logs
+    assert {name: (models_dir / name).read_bytes() for name in snapshot} == snapshot
+    assert (models_dir / "persons.log").exists()
+    assert (models_dir / f"gallery.{handler.store.generation}.log").exists()
+    handler.close()
+
+    # A torn record at the end of each log is skipped, and not extended by the next one
+    for log_file in (models_dir / "persons.log", models_dir / f"gallery.{handler.store.generation}.log"):
+        with open(log_file, 'a') as f:
+            f.write('{"torn')
+    reopened = FaceRecognitionHandler(models_dir)
+    assert sorted(data['name'] for data in reopened.persons_data.values()) == ["Alice", "Carol"]
+    assert reopened.persons_data[carol]['images'] == ["c.jpg"]
+    assert reopened.gallery.live_count == 2
+    assert reopened.store.log_records == 2
+    assert [reopened._match(e) for e in encodings] == ["Alice", None, "Carol"]
+    reopened.delete_person(carol)
+    reopened.close()
+
+    reopened = FaceRecognitionHandler(models_dir)
+    assert [data['name'] for data in reopened.persons_data.values()] == ["Alice"]
+    assert [reopened._match(e) for e in encodings] == ["Alice", None, None]
+
+    reopened.compact()
+    assert not (models_dir / "persons.log").exists()
+    assert list(models_dir.glob("gallery.*.log")) == []
+    reopened.close()
+    reopened = FaceRecognitionHandler(models_dir)
+    assert [data['name'] for data in reopened.persons_data.values()] == ["Alice"]
+    assert reopened.gallery.live_count == 1
+    assert [reopened._match(e) for e in encodings] == ["Alice", None, None]
+    reopened.close()
+
+
+@opencv_only
+def test_whole_image_histograms_are_not_migrated(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(config, 'GALLERY_COMPACT_INTERVAL', 0)
+    models_dir = tmp_path / "models"
+    models_dir.mkdir()
+    # persons.json as earlier versions wrote it, with whole-image histograms
+    persons = {
+        "person_1": {"name": "Alice", "images": ["a.jpg"], "encodings": [list(np.full(256, 1 / 16))]},
+        "person_2": {"name": "Bob", "images": []}
+    }
+    (models_dir / "persons.json").write_text(json.dumps(persons))
+
+    handler = FaceRecognitionHandler(models_dir)
+
+    assert "1 persons were enrolled with whole-image histograms" in capsys.readouterr().out
+    assert handler.gallery.live_count == 0
+    assert handler.get_model_stats()['persons_to_reenroll'] == ["Alice"]
+    assert 'encodings' not in json.loads((models_dir / "persons.json").read_text())["person_1"]
+
+    handler.encoder._cascade = FakeCascade([(20, 20, 64, 64)])
+    upload(handler, "person_1", jpeg(1, 20, 120))
+    assert handler.get_model_stats()['persons_to_reenroll'] == []
+    handler.close()
+    reopened = FaceRecognitionHandler(models_dir)
+    assert reopened.get_model_stats()['persons_to_reenroll'] == []
+    reopened.close()
@@ -0,0 +1,71 @@
+import io
+
+import numpy as np
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from conftest import FakeCascade, encode_jpeg
+from face_encoder import FACE_RECOGNITION_AVAILABLE
+from face_tracker import box_iou
+
+opencv_only = pytest.mark.skipif(FACE_RECOGNITION_AVAILABLE, reason="histogram encodings (OpenCV mode) only")
+
+WIDTH, HEIGHT = 160, 120
+
+
+@pytest.fixture
+def stream(handler, monkeypatch):
+    """Handler with Alice enrolled from a noise frame, counting the faces it encodes"""
+    handler.encoder._cascade = FakeCascade([(20, 20, 64, 64)])
+    pixels = np.random.default_rng(1).integers(20, 120, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+    image = FileStorage(io.BytesIO(encode_jpeg(pixels)), filename="face.jpg")
+    handler.add_image_to_person(handler.add_person("Alice"), image)
+
+    encoded = []
+    encode_boxes = handler.encoder.encode_boxes
+    monkeypatch.setattr(handler.encoder, 'encode_boxes',
+                        lambda image, boxes: encoded.extend(boxes) or encode_boxes(image, boxes))
+    return handler, pixels, encoded
+
+
+def recognize(handler, tracker, pixels):
+    faces, _ = handler.recognize_stream(tracker, pixels.tobytes(), WIDTH, HEIGHT)
+    return faces
+
+
+def test_box_iou():
+    assert box_iou((0, 10, 10, 0), (0, 10, 10, 0)) == 1.0
+    assert box_iou((0, 10, 10, 0), (0, 20, 10, 10)) == 0.0
+    assert box_iou((0, 10, 10, 0), (0, 15, 10, 5)) == pytest.approx(1 / 3)
+
+
+@opencv_only
+def test_tracked_faces_are_not_encoded_again(stream):
+    handler, pixels, encoded = stream
+    tracker = handler.create_tracker(detect_scale=1, detect_interval=3)
+
+    faces = [recognize(handler, tracker, pixels) for _ in range(5)]
+
+    assert [[face['encoded'] for face in frame] for frame in faces] == [[True], [False], [False], [False], [False]]
+    assert {face['name'] for frame in faces for face in frame} == {"Alice"}
+    assert len({face['track_id'] for frame in faces for face in frame}) == 1
+    assert len(encoded) == 1
+
+    tracker.reset()
+    assert recognize(handler, tracker, pixels)[0]['encoded']
+    assert len(encoded) == 2
+
+
+@opencv_only
+def test_face_is_encoded_again_when_its_track_drifts(stream):
+    handler, pixels, encoded = stream
+    tracker = handler.create_tracker(detect_scale=1, detect_interval=10, drift_iou=0.7)
+    first = recognize(handler, tracker, pixels)[0]
+
+    # The face moves 20 pixels right between detections
+    moved = recognize(handler, tracker, np.roll(pixels, 20, axis=1))[0]
+
+    assert moved['track_id'] == first['track_id']
+    assert moved['box'] == {"top": 20, "right": 104, "bottom": 84, "left": 40}
+    assert moved['encoded']
+    assert len(encoded) == 2